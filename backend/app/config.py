@@ -23,6 +23,80 @@ class Settings(BaseSettings):
     cognito_app_client_secret: str = ""  # 可选
     cognito_domain: Optional[str] = ""  # 自定义域名，如 auth.thankly.app
     
+    # 分页游标签名密钥（多实例部署时必须配置；为空时每个进程随机生成，游标不能跨实例使用）
+    cursor_secret: Optional[str] = ""
+
+    # 日记列表缓存（进程内 LRU）
+    diary_list_cache_enabled: bool = True
+    diary_list_cache_ttl_seconds: int = 60
+    diary_list_cache_max_entries: int = 1024
+    diary_list_cache_max_bytes: int = 32 * 1024 * 1024
+
+    # AI 结果缓存（润色 / 标题 / 反馈，按内容寻址）：进程内 LRU，可选按用户分区写入 DynamoDB（expiresAt TTL）
+    ai_cache_enabled: bool = True
+    ai_cache_ttl_seconds: int = 24 * 3600
+    ai_cache_max_entries: int = 2048
+    ai_cache_max_bytes: int = 16 * 1024 * 1024
+    ai_cache_dynamodb_enabled: bool = False
+    ai_cache_dynamodb_ttl_days: int = 30
+
+    # Whisper 转录缓存（音频 sha256 + 时长 → 文本与分段），按字节数上限淘汰
+    transcription_cache_enabled: bool = True
+    transcription_cache_ttl_seconds: int = 6 * 3600
+    transcription_cache_max_entries: int = 512
+    transcription_cache_max_bytes: int = 8 * 1024 * 1024
+
+    # 增量同步：变更日志/墓碑保留天数（需在表上为 expiresAt 开启 TTL），
+    # 以及查询时回退的重叠窗口（秒），用于容忍多实例间的时钟偏差
+    diary_changes_retention_days: int = 30
+    diary_changes_overlap_seconds: int = 5
+
+    # 创建日记的幂等键（Idempotency-Key）：记录保留时长，以及处理中占用的最长时间（超过视为请求已中断，可被重试接管）
+    idempotency_ttl_hours: int = 24
+    idempotency_lock_seconds: int = 300
+
+    # DynamoDB 异步访问线程池大小（每个线程持有独立的 boto3 客户端）
+    dynamodb_max_workers: int = 8
+
+    # 账号删除：并行执行 BatchWriteItem 的线程数
+    account_purge_max_workers: int = 4
+
+    # 异步语音任务进度存储：memory（单实例）| sqlite（同机多 worker）| redis（多实例 / Lambda）
+    task_store_backend: str = "memory"
+    task_store_sqlite_path: str = "/tmp/thankly_tasks.db"
+    task_store_redis_url: Optional[str] = ""
+    task_ttl_seconds: int = 3600
+    # 处理中任务的过期时间（自最后一次进度更新起算），以及后台处理的超时时间
+    task_processing_ttl_seconds: int = 600
+    task_processing_timeout_seconds: int = 300
+    # 进度推送：长轮询最长等待、SSE 心跳间隔、回查存储的间隔（发现其他实例写入的变更）
+    task_long_poll_max_seconds: int = 25
+    task_sse_heartbeat_seconds: int = 15
+    task_change_recheck_seconds: float = 1.0
+    # 内存后端的上限（超过时优先淘汰最早到期的任务）
+    task_store_max_tasks: int = 10000
+    task_store_max_bytes: int = 64 * 1024 * 1024
+
+    # 后台语音处理调度：同时运行数、排队总数上限、单用户排队上限（超出返回 429）
+    voice_job_max_concurrency: int = 4
+    voice_job_max_queue: int = 50
+    voice_job_max_queue_per_user: int = 5
+
+    # 音频落盘配置（上传的音频分块写入临时文件，不整段读入内存）
+    audio_spool_max_bytes: int = 100 * 1024 * 1024
+    audio_spool_dir: str = ""  # 为空时使用系统临时目录
+
+    # 共享 HTTP 客户端配置（Whisper 等外部 API 调用，连接复用）
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30.0
+    http_timeout_seconds: float = 60.0
+    http_connect_timeout_seconds: float = 10.0
+
+    # OpenAI 对话接口（润色 / 反馈）单次调用超时与 SDK 重试次数
+    openai_timeout_seconds: float = 45.0
+    openai_max_retries: int = 2
+
     # 应用配置
     app_name: str = "Gratitude Diary API"
     debug: bool = False
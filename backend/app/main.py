@@ -5,6 +5,12 @@ from fastapi.openapi.utils import get_openapi
 from datetime import datetime  # 用于健康检查的时间戳
 from .routers import diary, auth, account  # 新增 auth 路由
 from .config import get_settings
+from .services.cache_service import get_diary_list_cache
+from .services.task_store import get_task_store
+from .services.stage_timing import get_stage_timings
+from .services.voice_job_scheduler import get_voice_job_scheduler
+from .services.http_client import close_http_client
+from .services.ai_result_cache import get_ai_result_cache, get_transcription_cache
 
 # 获取配置（延迟初始化，避免启动时失败）
 try:
@@ -114,6 +120,12 @@ app.include_router(
     prefix="/diaries",#支持 /diaries 路径
     tags=["日记管理"]
 )
+
+# 关闭共享 HTTP 客户端（释放 keep-alive 连接）
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await close_http_client()
+
 # 根路径
 @app.get("/", tags=["健康检查"])
 async def root():
@@ -137,9 +149,16 @@ async def health_check():
         except Exception as e:
             config_status = f"config_error: {str(e)}"
         
+        transcription_cache = get_transcription_cache()
         return {
             "status": "healthy",
             "config": config_status,
+            "diary_list_cache": get_diary_list_cache().stats(),  # 命中率等指标，便于调优
+            "task_store": get_task_store().stats(),  # 存活任务数 / 字节数
+            "stage_timings": get_stage_timings().snapshot(),  # 各处理阶段耗时 p50 / p90
+            "voice_jobs": get_voice_job_scheduler().stats(),  # 运行中 / 排队中 / 已拒绝
+            "ai_result_cache": get_ai_result_cache().stats(),  # 润色 / 反馈结果缓存命中率
+            "transcription_cache": transcription_cache.stats() if transcription_cache else None,  # Whisper 转录缓存
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 class DiaryCreate(BaseModel):
@@ -74,6 +74,7 @@ class DiaryResponse(BaseModel):
     audio_duration: Optional[int] = Field(None, description="音频时长(秒)")
     image_urls: Optional[List[str]] = None  # List of image URLs (max 9)
     emotion_data: Optional[dict] = Field(None, description="情感分析结果")
+    updated_at: Optional[str] = Field(None, description="最后修改时间（增量同步版本）")
 
 
     class Config:
@@ -95,4 +96,60 @@ class DiaryResponse(BaseModel):
                     "https://s3.amazonaws.com/.../image2.jpg"
                 ]
             }
-        }
\ No newline at end of file
+        }
+
+class DiaryListPage(BaseModel):
+    """分页的日记列表（传入 limit 或 cursor 时返回）"""
+    items: List[DiaryResponse] = Field(..., description="本页日记")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示没有更多数据")
+
+
+class DiarySummaryResponse(BaseModel):
+    """时间线摘要（fields=summary 时返回，完整内容请调用 /diary/{id}）"""
+    diary_id: str = Field(..., description="日记ID")
+    created_at: str = Field(..., description="创建时间")
+    date: str = Field(..., description="日期(YYYY-MM-DD)")
+    language: str = Field(..., description="检测到的语言代码")
+    title: str = Field(..., description="AI生成的标题")
+    preview: str = Field(..., description="服务端截断的内容预览")
+    emotion: Optional[str] = Field(None, description="情绪标签")
+    image_count: int = Field(0, description="图片数量")
+    first_image_url: Optional[str] = Field(None, description="第一张图片URL（用于缩略图）")
+    has_audio: bool = Field(False, description="是否包含音频")
+    audio_duration: Optional[int] = Field(None, description="音频时长(秒)")
+
+
+class DiarySummaryPage(BaseModel):
+    """分页的时间线摘要列表"""
+    items: List[DiarySummaryResponse] = Field(..., description="本页日记摘要")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示没有更多数据")
+
+
+class CalendarDay(BaseModel):
+    """日历中某一天的索引"""
+    date: str = Field(..., description="日期(YYYY-MM-DD)")
+    count: int = Field(..., description="当天日记数量")
+    dominant_emotion: Optional[str] = Field(None, description="当天出现最多的情绪")
+
+
+class CalendarIndexResponse(BaseModel):
+    """某月的日历索引（不含日记正文）"""
+    month: str = Field(..., description="月份(YYYY-MM)")
+    days: List[CalendarDay] = Field(..., description="有日记的日期（升序）")
+
+
+class DiaryChangesResponse(BaseModel):
+    """增量同步结果（GET /diary/changes）"""
+    changed: List[DiaryResponse] = Field(..., description="自上次同步以来新建或编辑的日记")
+    deleted: List[str] = Field(..., description="自上次同步以来删除的日记ID")
+    next_token: str = Field(..., description="下次同步时传入的 since 令牌")
+    reset: bool = Field(False, description="为 true 时令牌缺失或过期，客户端需要全量拉取 /diary/list")
+
+
+class UserStatsResponse(BaseModel):
+    """用户写作统计（GET /diary/stats，写入时维护，单次读取）"""
+    diary_count: int = Field(..., description="日记总数")
+    current_streak: int = Field(..., description="当前连续写作天数（截至今天或昨天，UTC）")
+    longest_streak: int = Field(..., description="历史最长连续写作天数")
+    last_entry_date: Optional[str] = Field(None, description="最近一次写日记的日期(YYYY-MM-DD)")
+    emotion_counts: Dict[str, int] = Field(default_factory=dict, description="情绪分布（情绪 → 日记数）")
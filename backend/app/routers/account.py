@@ -6,14 +6,14 @@ import boto3
 from botocore.exceptions import ClientError
 
 from ..utils.cognito_auth import get_current_user
-from ..services.dynamodb_service import DynamoDBService
+from ..services.async_dynamodb_service import get_async_db_service
 from ..services.s3_service import S3Service
 from ..config import get_settings
 
 
 router = APIRouter()
 
-db_service = DynamoDBService()
+db_service = get_async_db_service()
 s3_service = S3Service()
 
 
@@ -38,16 +38,16 @@ async def delete_account(user: Dict = Depends(get_current_user)):
     print(f"🗑️ 收到账号删除请求 - user_id: {user_id}, username: {username}")
 
     try:
-        audio_urls = db_service.delete_user_data(user_id)
+        media_urls = await db_service.delete_user_data(user_id)
         print(
-            f"🧹 已删除用户日记，共 {len(audio_urls)} 条音频记录需要清理"
+            f"🧹 已删除用户日记，共 {len(media_urls)} 个音频/图片文件需要清理"
         )
     except Exception as e:
         print(f"❌ 删除用户日记失败: {e}")
         raise HTTPException(status_code=500, detail="删除用户内容失败")
 
     try:
-        s3_service.delete_objects_by_urls(audio_urls)
+        s3_service.delete_objects_by_urls(media_urls)
     except Exception as e:
         print(f"⚠️ 删除S3文件失败: {e}")
         raise HTTPException(status_code=500, detail="删除用户存储文件失败")
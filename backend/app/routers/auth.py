@@ -23,11 +23,11 @@ from botocore.exceptions import ClientError
 import uuid
 from datetime import datetime
 from ..utils.cognito_auth import get_current_user
-from ..services.dynamodb_service import DynamoDBService
+from ..services.async_dynamodb_service import get_async_db_service
 
 # 创建路由器
 router = APIRouter()
-db_service = DynamoDBService()
+db_service = get_async_db_service()
 
 # AWS Cognito 配置
 COGNITO_USER_POOL_ID = "us-east-1_1DgDNffb0"
@@ -1321,7 +1321,7 @@ async def update_user_name(
             print(f"✅ 用户姓名更新成功")
 
             try:
-                db_service.upsert_user_profile(user_id=username, name=request.name)
+                await db_service.upsert_user_profile(user_id=username, name=request.name)
             except Exception as profile_error:
                 print(f"⚠️ 更新用户档案失败: {profile_error}")
                 # 不抛出异常，以免影响主流程
@@ -7,57 +7,149 @@
 4. ✅ 保持所有原有逻辑不变
 """
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Request
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Request, Query, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
-from typing import List, Dict, Optional, AsyncGenerator
+from typing import Any, Awaitable, Callable, List, Dict, Optional, AsyncGenerator, Union, Literal
 import asyncio
+import functools
 import re
 import json
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
-from ..models.diary import DiaryCreate, DiaryResponse, DiaryUpdate, ImageOnlyDiaryCreate, PresignedUrlRequest
-from ..services.openai_service import OpenAIService
-from ..services.dynamodb_service import DynamoDBService
+from ..models.diary import DiaryCreate, DiaryResponse, DiaryUpdate, ImageOnlyDiaryCreate, PresignedUrlRequest, DiaryListPage, DiarySummaryResponse, DiarySummaryPage, CalendarIndexResponse, DiaryChangesResponse, UserStatsResponse
+from ..services.openai_service import get_openai_service
+from ..services.async_dynamodb_service import get_async_db_service
 from ..services.s3_service import S3Service
+from ..services.audio_spool import SpooledAudio
+from ..services.task_store import get_task_store
+from ..services.voice_pipeline import VoiceDiaryPipeline, VoiceDiaryInput
+from ..services.voice_job_scheduler import get_voice_job_scheduler, QueueFullError, JobCancelledError
+from ..services.task_notifier import get_task_notifier, wait_for_task_change, TERMINAL_STATUSES
 from ..utils.cognito_auth import get_current_user
 from ..utils.cognito_auth import get_current_user
 from ..utils.cognito_auth import get_current_user
-from ..utils.transcription import validate_audio_quality, validate_transcription
+from ..utils.transcription import validate_audio_quality
+from ..utils.pagination import encode_cursor, decode_cursor
+from ..utils.idempotency import normalize_idempotency_key, request_fingerprint
+from ..utils.date_range import build_created_at_range, parse_month
+from ..config import get_settings
 
 # ============================================================================
 # 初始化
 # ============================================================================
 
 router = APIRouter()
-db_service = DynamoDBService()
+db_service = get_async_db_service()
 s3_service = S3Service()
 
 # ============================================================================
-# 任务进度存储（内存存储，生产环境建议使用Redis）
+# 任务进度存储（后端由 task_store_backend 配置：memory / sqlite / redis）
 # ============================================================================
 
-# 任务进度字典：{task_id: {status, progress, step, step_name, message, diary, error}}
-task_progress: Dict[str, Dict] = {}
+# 任务数据：{user_id, status, progress, step, step_name, message, diary, error, image_urls, ...}
+# 过期清理由存储在写入时摊还完成（内存后端为到期堆，SQLite 为 expires_at 索引，Redis 为 EXPIRE）
+task_store = get_task_store()
+task_notifier = get_task_notifier()
+# 后台语音处理统一经调度器运行：限制并发、排队封顶、按用户轮转
+voice_scheduler = get_voice_job_scheduler()
 
-def cleanup_old_tasks():
-    """清理超过1小时的任务（防止内存泄漏）"""
-    current_time = datetime.now(timezone.utc)
-    expired_tasks = []
-    for task_id, task_data in task_progress.items():
-        if task_data.get("status") in ["completed", "failed"]:
-            created_at = task_data.get("created_at")
-            if created_at:
-                age = (current_time - created_at).total_seconds()
-                if age > 3600:  # 1小时
-                    expired_tasks.append(task_id)
-    for task_id in expired_tasks:
-        task_progress.pop(task_id, None)
 
+async def run_voice_task(task_id: str, processor) -> None:
+    """
+    运行后台语音处理，超时则取消并标记失败
+
+    processor 为零参数工厂，排队结束、真正开始运行时才创建协程；超时从开始运行起算，不含排队时间。
+    取消后协程帧被释放，其中持有的原始音频随之回收，不会因卡住的任务常驻内存
+    """
+    timeout = get_settings().task_processing_timeout_seconds
+    try:
+        await asyncio.wait_for(processor(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"⏰ 后台任务超时（{timeout}秒），已取消: {task_id}")
+        await update_task_progress(task_id, "failed", 0, 0, "错误", "处理超时，请重试", error="处理超时")
+
+
+def get_voice_pipeline() -> VoiceDiaryPipeline:
+    """语音日记流水线：同步、SSE、异步任务三个入口共用同一张阶段图"""
+    return VoiceDiaryPipeline(get_openai_service(), s3_service, db_service)
+
+
+def resolve_user_display_name(user: Dict, request: Optional[Request]) -> Optional[str]:
+    """用户名字（用于个性化反馈）：优先 X-User-Name 请求头（前端传递的最新名字），其次 token；只取第一个词"""
+    user_name = ""
+    if request:
+        user_name = request.headers.get("X-User-Name", "").strip()
+    if not user_name:
+        user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
+    if not user_name:
+        user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
+    return re.split(r'\s+', user_name)[0] if user_name else None
+
+
+def resolve_request_language(request: Optional[Request]) -> str:
+    """从 Accept-Language / X-User-Language 请求头判断用户语言，默认为 Chinese"""
+    user_language = "Chinese"
+    if request:
+        accept_lang = request.headers.get("Accept-Language", "").lower()
+        if "en" in accept_lang and "zh" not in accept_lang:
+            user_language = "English"
+        # 也可以支持 X-User-Language 自定义 Header
+        custom_lang = request.headers.get("X-User-Language", "").strip().capitalize()
+        if custom_lang in ["Chinese", "English"]:
+            user_language = custom_lang
+    return user_language
+
+
+async def run_idempotent(
+    user: Dict,
+    idempotency_key: Optional[str],
+    fingerprint: str,
+    create: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    按 Idempotency-Key 执行创建请求
+
+    - 未携带键：直接执行
+    - 首次请求：条件写入占用键 → 执行 → 保存结果；执行失败时释放键，允许用同一个键重试；
+      结果重试后仍保存失败时返回 503，不当作成功返回
+    - 重试：返回首次请求的结果（日记或 task_id），不再重复调用 Whisper / GPT，也不会重复建日记
+    - 同一个键用于不同的请求内容：422；首次请求仍在处理中：409
+    """
+    try:
+        key = normalize_idempotency_key(idempotency_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if key is None:
+        return await create()
 
-def get_openai_service():
-    """获取 OpenAI 服务实例（延迟初始化）"""
-    return OpenAIService()
+    user_id = user['user_id']
+    existing = await db_service.claim_idempotency_key(user_id, key, fingerprint)
+    if existing is not None:
+        if existing.get("fingerprint") != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key 已用于不同的请求")
+        if existing.get("status") == "completed":
+            print(f"♻️ 幂等重放: {key}")
+            return existing.get("response")
+        raise HTTPException(
+            status_code=409,
+            detail="相同的请求正在处理中，请稍后重试",
+            headers={"Retry-After": "2"}
+        )
+
+    try:
+        result = await create()
+    except BaseException:
+        await db_service.release_idempotency_key(user_id, key)
+        raise
+    try:
+        await db_service.complete_idempotency_key(user_id, key, jsonable_encoder(result))
+    except Exception as e:
+        # 重试后仍无法保存结果：不能当作成功返回，否则占用超时后的重试会重复创建
+        print(f"❌ 保存幂等结果失败 - 键: {key}, 错误: {str(e)}")
+        raise HTTPException(status_code=503, detail="请求结果保存失败，请稍后重试")
+    return result
 
 
 # ============================================================================
@@ -68,7 +160,8 @@ def get_openai_service():
 async def create_text_diary(
     diary: DiaryCreate,
     request: Request,  # ✅ 添加 Request 参数
-    user: Dict = Depends(get_current_user)
+    user: Dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     创建文字日记 - 支持多语言
@@ -76,33 +169,30 @@ async def create_text_diary(
     流程：
     1. AI 多语言处理（检测语言、润色、生成标题和反馈）
     2. 保存到 DynamoDB
+
+    携带 Idempotency-Key 时，超时重试会返回首次创建的日记
     """
+    return await run_idempotent(
+        user,
+        idempotency_key,
+        request_fingerprint("text", diary.model_dump()),
+        lambda: _create_text_diary(diary, request, user)
+    )
+
+
+async def _create_text_diary(diary: DiaryCreate, request: Request, user: Dict) -> Dict:
+    """创建文字日记（实际处理）"""
     try:
         openai_service = get_openai_service()
         
         # ✅ 修复：添加 await
         print(f"✨ 开始处理文字日记...")
         # 获取用户名字用于个性化反馈
-        import re
-        
-        user_name = ""
-        # 1. 优先从请求头获取（前端传递的最新名字）
-        if request:
-            header_name = request.headers.get("X-User-Name", "").strip()
-            if header_name:
-                user_name = header_name
-                print(f"   ✅ 优先使用请求头中的用户名字: {user_name}")
-        
-        # 2. 如果请求头没有，从 token 获取
-        if not user_name:
-            user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
-            
-        if not user_name:
-            user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-
-        user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
+        user_display_name = resolve_user_display_name(user, request)
         print(f"👤 用户信息: user_id={user.get('user_id')}, name={user.get('name')}, display_name={user_display_name}")
-        ai_result = await openai_service.polish_content_multilingual(diary.content, user_name=user_display_name)
+        ai_result = await openai_service.polish_content_multilingual(
+            diary.content, user_name=user_display_name, user_id=user['user_id']
+        )
         print(f"✅ AI 处理完成 - 标题: {ai_result['title']}")
         
         # ✅ 调试：检查emotion_data
@@ -110,7 +200,7 @@ async def create_text_diary(
         print(f"🔍 [DEBUG] emotion_data from AI: {emotion_data}")
         
         # 保存到数据库
-        diary_obj = db_service.create_diary(
+        diary_obj = await db_service.create_diary(
             user_id=user['user_id'],
             original_content=diary.content,
             polished_content=ai_result["polished_content"],
@@ -141,7 +231,8 @@ async def create_voice_diary(
     audio: UploadFile = File(...),
     duration: int = Form(...),
     user: Dict = Depends(get_current_user),
-    request: Request = None  # ✅ 添加 Request 参数以获取请求头
+    request: Request = None,  # ✅ 添加 Request 参数以获取请求头
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     创建语音日记
@@ -157,113 +248,43 @@ async def create_voice_diary(
         audio: 音频文件（支持 mp3, m4a, wav 等格式）
         duration: 音频时长（秒）
         user: 当前登录用户
+        idempotency_key: 可选，超时重试时返回首次创建的日记
     """
+    # 分块落盘（同时计算 sha256 作为幂等指纹），处理过程中不再把整段音频读入内存
+    spooled_audio = await SpooledAudio.from_upload(audio)
+    try:
+        return await run_idempotent(
+            user,
+            idempotency_key,
+            request_fingerprint("voice", spooled_audio.sha256, duration),
+            lambda: _create_voice_diary(audio, spooled_audio, duration, user, request)
+        )
+    finally:
+        spooled_audio.close()
+
+
+async def _create_voice_diary(
+    audio: UploadFile,
+    spooled_audio: SpooledAudio,
+    duration: int,
+    user: Dict,
+    request: Optional[Request]
+) -> Dict:
+    """创建语音日记（实际处理）"""
     try:
-        openai_service = get_openai_service()
-        
-        # ============================================
-        # Step 1: 验证音频文件
-        # ============================================
         if not audio.content_type.startswith("audio/"):
             raise HTTPException(
                 status_code=400,
                 detail="请上传音频文件"
             )
         
-        audio_content = await audio.read()
-        validate_audio_quality(duration, len(audio_content))
-        
-        # ============================================
-        # Step 2: 并行处理（提升速度）
-        # ============================================
-        print(f"📤 开始并行处理：上传 S3 + 语音转文字...")
-        
-        async def upload_to_s3_async():
-            """异步上传到 S3"""
-            return await asyncio.to_thread(
-                s3_service.upload_audio,
-                file_content=audio_content,
-                file_name=audio.filename or "recording.m4a",
-                content_type=audio.content_type or "audio/m4a"
-            )
-        
-        async def transcribe_async():
-            """异步语音转文字 - ✅ 添加 await"""
-            return await openai_service.transcribe_audio(
-                audio_content,
-                audio.filename or "recording.m4a",
-                expected_duration=duration
-            )
-        
-        # 并行执行（同时进行，节省时间）
-        audio_url, transcription = await asyncio.gather(
-            upload_to_s3_async(),
-            transcribe_async()
-        )
-        
-        print(f"✅ 并行处理完成")
-        print(f"  - 音频 URL: {audio_url}")
-        print(f"  - 转录结果: {transcription[:50]}...")
-        
-        # ============================================
-        # Step 3: 验证转录内容
-        # ============================================
-        validate_transcription(transcription, duration)
-        
-        # ============================================
-        # Step 4: AI 处理 - ✅ 添加 await
-        # ============================================
-        print(f"✨ 开始 AI 处理...")
-        # 获取用户名字用于个性化反馈
-        # ✅ 优先从 user dict 获取，如果没有则尝试从请求头获取（备用方案）
-        import re
-        
-        user_name = ""
-        # 1. 优先从请求头获取（前端传递的最新名字）
-        if request:
-            header_name = request.headers.get("X-User-Name", "").strip()
-            if header_name:
-                user_name = header_name
-                print(f"   ✅ 优先使用请求头中的用户名字: {user_name}")
-
-        # 2. 如果请求头没有，从 token 获取
-        if not user_name:
-            user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
-        
-        if not user_name:
-            user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-        
-        # 提取名字（取第一个词）
-        user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
-        
-        print(f"👤 用户信息提取:")
-        print(f"   user_id: {user.get('user_id')}")
-        print(f"   name字段: '{user.get('name')}'")
-        print(f"   given_name字段: '{user.get('given_name')}'")
-        print(f"   nickname字段: '{user.get('nickname')}'")
-        print(f"   最终使用的名字: '{user_display_name}'")
-        
-        ai_result = await openai_service.polish_content_multilingual(transcription, user_name=user_display_name)
-        print(f"✅ AI 处理完成")
-        print(f"  - 标题: {ai_result['title']}")
-        print(f"  - 语言: {ai_result.get('language', 'zh')}")
-        
-        # ============================================
-        # Step 5: 保存到数据库
-        # ============================================
-        print(f"📝 准备保存日记到数据库...")
-        
-        diary_obj = db_service.create_diary(
+        # 验证音频 → 并行（上传 S3 ∥ 语音转文字）→ 并行（润色 ∥ 反馈）→ 保存
+        diary_obj = await get_voice_pipeline().run(VoiceDiaryInput(
             user_id=user['user_id'],
-            original_content=transcription,
-            polished_content=ai_result["polished_content"],
-            ai_feedback=ai_result["feedback"],
-            language=ai_result.get("language", "zh"),
-            title=ai_result["title"],
-            audio_url=audio_url,
-            audio_duration=duration,
-            emotion_data=ai_result.get("emotion_data") # ✅ 传递情感数据
-        )
+            audio=spooled_audio,
+            duration=duration,
+            user_display_name=resolve_user_display_name(user, request)
+        ))
         
         print(f"✅ 语音日记创建成功 - ID: {diary_obj['diary_id']}")
         return diary_obj
@@ -322,471 +343,172 @@ async def send_sse_event(event_type: str, data: Dict) -> str:
     return f"{event_line}data: {data_json}\n\n"
 
 
-def update_task_progress(task_id: str, status: str, progress: int = 0, 
+async def update_task_progress(task_id: str, status: str, progress: int = 0, 
                         step: int = 0, step_name: str = "", message: str = "",
-                        diary: Optional[Dict] = None, error: Optional[str] = None):
-    """更新任务进度"""
-    if task_id not in task_progress:
-        task_progress[task_id] = {
-            "status": "processing",
-            "progress": 0,
-            "step": 0,
-            "step_name": "",
-            "message": "",
-            "created_at": datetime.now(timezone.utc)
-        }
-    
-    task_progress[task_id].update({
+                        diary: Optional[Dict] = None, error: Optional[str] = None,
+                        **hints) -> Optional[Dict]:
+    """
+    更新任务进度（合并写入任务存储，只覆盖进度相关字段），返回更新后的任务数据
+
+    只更新已有任务，不会重新创建：任务已过期或被删除时返回 None，处理中的任务随之中止
+    （重建的任务没有 user_id，谁也查不到，只会白白占用存储）
+
+    hints: 流水线附加的 stage / eta_ms / stage_expected_ms 等提示
+    """
+    fields = {
         "status": status,
         "progress": progress,
         "step": step,
         "step_name": step_name,
         "message": message,
-        "updated_at": datetime.now(timezone.utc)
-    })
-    
+        "updated_at": datetime.now(timezone.utc),
+        **hints
+    }
     if diary:
-        task_progress[task_id]["diary"] = diary
+        fields["diary"] = diary
     if error:
-        task_progress[task_id]["error"] = error
+        fields["error"] = error
+
+    task_data = await task_store.aupdate(task_id, fields)
+    if task_data is None:
+        print(f"⚠️ 任务不存在或已过期，不再更新进度: {task_id}")
+    # 其他实例发起的取消：本实例的调度器无法直接取消，在下一次进度写入时发现并中止处理
+    if status == "processing" and (task_data is None or task_data.get("cancel_requested")):
+        raise JobCancelledError(task_id)
+    return task_data
 
 
-async def process_pure_voice_diary_async(
+async def mark_task_cancelled(task_id: str) -> Optional[Dict]:
+    """
+    将处理中的任务标记为已取消（cancel_requested 同时通知正在其他实例上运行的处理）
+
+    以 status == "processing" 为条件原子写入：任务已完成 / 失败 / 取消时不覆盖，返回 None
+    """
+    return await task_store.aupdate(task_id, {
+        "status": "cancelled",
+        "step_name": "已取消",
+        "message": "任务已取消",
+        "cancel_requested": True,
+        "updated_at": datetime.now(timezone.utc)
+    }, expected={"status": "processing"})
+
+
+async def wait_for_task_images(
     task_id: str,
-    audio_content: bytes,
-    audio_filename: str,
-    audio_content_type: str,
-    duration: int,
-    user: Dict,
-    request: Optional[Request]
-):
+    max_wait_time: float = 30,
+    progress_update_interval: float = 1,
+    report: Optional[Callable[[int, int, str, str], Awaitable[Any]]] = None
+) -> List[str]:
     """
-    优化的纯语音日记处理函数 - 快速通道
-    
-    专门处理纯语音输入，去除所有图片处理逻辑，最大化性能
-    
-    流程：
-    1. 并行处理：S3 上传 + 语音转文字 (0% → 50%)
-    2. AI 处理：润色 + 反馈 (50% → 85%)
-    3. 保存到数据库 (85% → 100%)
+    等待 add_images_to_task 补充图片URL（图片上传与AI处理并行）
+
+    - 由任务变更通知唤醒，图片URL写入后立即继续，不再按固定间隔轮询
+    - 最多等待 max_wait_time 秒，期间每 progress_update_interval 秒把进度从 93% 推进到 97%
+    - 共享任务存储时，其他实例写入的图片URL由定期回查发现
     """
-    try:
-        openai_service = get_openai_service()
-        
-        # ============================================
-        # Step 0: 初始化 (5% → 10%)
-        # ============================================
-        # ✅ 任务已在创建时设置为5%，这里快速更新到8%
-        update_task_progress(task_id, "processing", 8, 0, "验证中", "正在验证音频...")
-        
-        # 验证音频质量
-        validate_audio_quality(duration, len(audio_content))
-        
-        # ✅ 验证完成，立即更新到10%
-        update_task_progress(task_id, "processing", 10, 0, "准备上传", "准备上传音频...")
-        await asyncio.sleep(0.1)  # 短暂延迟，让前端看到进度变化
-        
-        # ============================================
-        # Step 1: 并行处理 S3 上传 + 语音转文字 (10% → 50%)
-        # ============================================
-        update_task_progress(task_id, "processing", 15, 1, "上传中", "正在上传并识别语音...")
-        
-        async def upload_to_s3_async():
-            return await asyncio.to_thread(
-                s3_service.upload_audio,
-                file_content=audio_content,
-                file_name=audio_filename,
-                content_type=audio_content_type
-            )
-        
-        async def transcribe_async():
-            return await openai_service.transcribe_audio(
-                audio_content,
-                audio_filename,
-                expected_duration=duration
-            )
-        
-        # 并行执行
-        audio_url, transcription = await asyncio.gather(
-            upload_to_s3_async(),
-            transcribe_async()
-        )
-        
-        update_task_progress(task_id, "processing", 50, 1, "处理中", "语音识别完成")
-        
-        # 验证转录内容
-        validate_transcription(transcription, duration)
-        
-        # ============================================
-        # Step 2: AI 处理 - 润色 + 反馈 (50% → 85%)
-        # ============================================
-        update_task_progress(task_id, "processing", 55, 2, "AI润色", "正在美化文字...")
-        
-        # 获取用户名字（优先使用 X-User-Name header）
-        import re
-        user_name = ""
-        # 1. 优先从请求头获取（前端传递的最新名字）
-        if request:
-            header_name = request.headers.get("X-User-Name", "").strip()
-            if header_name:
-                user_name = header_name
-                print(f"   ✅ 优先使用请求头中的用户名字: {user_name}")
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    last_progress_update = 0.0
+    report = report or functools.partial(update_task_progress, task_id, "processing")
+    await report(93, 5, "等待图片", "正在等待图片上传...")
+    task_data = await task_store.aget(task_id)
 
-        # 2. 如果请求头没有，从 token 获取
-        if not user_name:
-            user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
-        
-        if not user_name:
-            user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-        
-        user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
-        
-        # ✅ 细化进度更新：AI处理分为多个子步骤
-        update_task_progress(task_id, "processing", 60, 2, "AI润色", "正在优化文字表达...")
-        
-        # AI 润色和生成反馈（这个调用包含了润色、标题、情绪分析、反馈）
-        ai_result = await openai_service.polish_content_multilingual(
-            transcription, 
-            user_name=user_display_name
-        )
-        
-        # ✅ AI处理完成后的进度更新
-        update_task_progress(task_id, "processing", 70, 3, "生成标题", "正在提炼标题...")
-        await asyncio.sleep(0.2)  # 短暂延迟，让用户看到进度变化
-        
-        update_task_progress(task_id, "processing", 75, 3, "情绪分析", "正在读懂你的心情...")
-        await asyncio.sleep(0.2)
-        
-        update_task_progress(task_id, "processing", 80, 3, "生成反馈", "正在准备暖心回复...")
-        await asyncio.sleep(0.2)
-        
-        update_task_progress(task_id, "processing", 85, 3, "AI处理", "AI处理完成")
-        
-        # ============================================
-        # Step 3: 保存到数据库 (85% → 100%)
-        # ============================================
-        update_task_progress(task_id, "processing", 90, 3, "保存", "正在保存日记...")
-        
-        # --------------------------------------------------------
-        # 🔥 Step 2.5: 情绪分析结果 (Pure Text Analysis)
-        # --------------------------------------------------------
-        text_emotion = ai_result.get("emotion_data", {})
-        
-        # 直接使用 GPT-4o-mini 的分析结果
-        final_emotion_data = {
-            "emotion": text_emotion.get("emotion", "Reflective"),
-            "confidence": text_emotion.get("confidence", 0.0),
-            "rationale": text_emotion.get("rationale", ""),
-            "source": "text_only",
-            "meta": {
-                "text": text_emotion
-            }
-        }
+    while task_data is not None:
+        if task_data.get("image_urls"):
+            image_urls = task_data["image_urls"] or []
+            print(f"✅ 图片上传完成，共 {len(image_urls)} 张")
+            return image_urls
+        if not task_data.get("pending_image_upload"):
+            # 已补充但为空列表：不再等待
+            return []
 
-        diary_obj = db_service.create_diary(
-            user_id=user['user_id'],
-            original_content=transcription,
-            polished_content=ai_result["polished_content"],
-            ai_feedback=ai_result["feedback"],
-            language=ai_result.get("language", "zh"),
-            title=ai_result["title"],
-            audio_url=audio_url,
-            audio_duration=duration,
-            emotion_data=final_emotion_data # ✅ 传递情绪数据
+        waited_time = loop.time() - started
+        if waited_time >= max_wait_time:
+            return []
+
+        next_update = last_progress_update + progress_update_interval
+        task_data = await wait_for_task_change(
+            task_store,
+            task_notifier,
+            task_id,
+            task_data.get("version"),
+            timeout=max(min(next_update, max_wait_time) - waited_time, 0),
+            recheck_interval=settings.task_change_recheck_seconds
         )
 
+        # ✅ 定期更新进度，避免用户感觉卡住（93% -> 94% -> 95%）
+        waited_time = loop.time() - started
+        if task_data is not None and not task_data.get("image_urls") and waited_time >= next_update:
+            progress_value = min(93 + int((waited_time / max_wait_time) * 4), 97)
+            await report(
+                progress_value,
+                5,
+                "等待图片",
+                f"正在等待图片上传... ({int(waited_time)}秒)"
+            )
+            last_progress_update = waited_time
 
-        
-        # ============================================
-        # Step 4: 完成 (100%)
-        # ============================================
-        update_task_progress(task_id, "completed", 100, 4, "完成", "日记创建成功", diary=diary_obj)
-        
-    except HTTPException as e:
-        update_task_progress(task_id, "failed", 0, 0, "错误", str(e.detail), error=str(e.detail))
-    except Exception as e:
-        print(f"❌ 纯语音日记处理失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        update_task_progress(task_id, "failed", 0, 0, "错误", f"处理失败: {str(e)}", error=str(e))
+    return []
 
 
-async def process_voice_diary_async(
+async def collect_task_images(
     task_id: str,
-    audio_content: bytes,
-    audio_filename: str,
-    audio_content_type: str,
-    duration: int,
-    user: Dict,
-    request: Optional[Request],
-    image_urls: Optional[List[str]] = None,  # ✅ 新增：图片URL列表
-    content: Optional[str] = None  # ✅ 新增：用户手动输入的文字内容
-):
-    """异步处理语音日记（后台任务）"""
-    try:
-        openai_service = get_openai_service()
-        
-        # ✅ 优化：任务已在创建时设置为5%，这里快速更新到8%
-        update_task_progress(task_id, "processing", 8, 0, "验证中", "正在验证音频...")
-        
-        # 验证音频质量
-        validate_audio_quality(duration, len(audio_content))
-        
-        # ✅ 验证完成，立即更新到10%
-        update_task_progress(task_id, "processing", 10, 0, "准备处理", "准备开始处理...")
-        await asyncio.sleep(0.1)  # 短暂延迟，让前端看到进度变化
-        
-        # ============================================
-        # Step 1: 启动 S3 上传 (后台并行)
-        # ============================================
-        # 🚀 优化：不阻塞转录，后台上传
-        async def upload_to_s3_async():
-            return await asyncio.to_thread(
-                s3_service.upload_audio,
-                file_content=audio_content,
-                file_name=audio_filename,
-                content_type=audio_content_type
-            )
-        
-        # 启动上传任务
-        s3_upload_task = asyncio.create_task(upload_to_s3_async())
-
-        # ============================================
-        # Step 1.5: 启动音频情绪分析 (并行)
-        # ============================================
-        async def analyze_audio_emotion_async():
-            emotion_service = get_emotion_service()
-            return await emotion_service.analyze_audio_emotion(audio_content, audio_filename)
-
-        # 启动情绪分析任务
-        audio_emotion_task = asyncio.create_task(analyze_audio_emotion_async())
-
-        
-        # ============================================
-        # Step 2 & 4: 并行处理 (25% → 70%)
-        # ============================================
-        update_task_progress(task_id, "processing", 25, 2, "并行处理", "正在同时处理语音和图片...")
-        
-        # 预先下载并编码图片（如果存在）
-        # 🚀 优化：不再下载和分析图片，避免 AI 被图片内容误导（如生成日文标题）
-        # encoded_images = []
-        # if image_urls and len(image_urls) > 0:
-        #     update_task_progress(task_id, "processing", 28, 2, "图片处理", "正在预处理图片...")
-        #     download_tasks = [openai_service._download_and_encode_image(url) for url in image_urls]
-        #     img_results = await asyncio.gather(*download_tasks, return_exceptions=True)
-        #     for i, img_data in enumerate(img_results):
-        #         if not isinstance(img_data, Exception):
-        #             encoded_images.append(img_data)
-        # 获取用户名字
-        import re
-        user_name = user.get('name', '').strip()
-        if not user_name:
-            user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-        if not user_name and request:
-            user_name = request.headers.get("X-User-Name", "").strip()
-        user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
-
-        # 检测语言 (从 Header 获取，默认为 Chinese)
-        user_language = "Chinese"
-        if request:
-            accept_lang = request.headers.get("Accept-Language", "").lower()
-            if "en" in accept_lang and "zh" not in accept_lang:
-                user_language = "English"
-            # 也可以支持 X-User-Language 自定义 Header
-            custom_lang = request.headers.get("X-User-Language", "").strip().capitalize()
-            if custom_lang in ["Chinese", "English"]:
-                user_language = custom_lang
-        
-        print(f"🌐 检测到用户语言: {user_language}")
-
-        # 🚀 优化并行逻辑：将转录提取为独立任务，支持按需等待
-        async def do_transcription():
-            update_task_progress(task_id, "processing", 35, 2, "语音识别", "正在识别语音...")
-            result = await openai_service.transcribe_audio(
-                audio_content,
-                audio_filename,
-                expected_duration=duration
-            )
-            update_task_progress(task_id, "processing", 50, 2, "语音识别", "识别完成")
-            return result
-        
-        # 立即启动转录任务
-        transcription_task = asyncio.create_task(do_transcription())
+    initial_image_urls: Optional[List[str]],
+    report: Callable[[int, int, str, str], Awaitable[Any]]
+) -> List[str]:
+    """
+    保存前确定日记的图片URL
 
-        # 定义任务1：等待转录 -> AI 润色 & 标题
-        async def task_voice_and_polish():
-            # 等待转录完成
-            transcription = await transcription_task
-            
-            # 组合文字 - ✅ 优化：去除分割线，直接换行，更自然
-            combined_text = transcription
-            if content and content.strip():
-                combined_text = f"{content.strip()}\n{transcription}"
-            
-            # AI 润色
-            update_task_progress(task_id, "processing", 55, 3, "AI润色", "正在美化文字...")
-            polish_result = await openai_service._call_gpt4o_mini_for_polish_and_title(
-                combined_text, 
-                user_language, 
-                None # ✅ 不传图片，避免干扰
-            )
-            return transcription, polish_result
+    ✅ 无论是否有初始图片URL，都检查任务数据中是否有补充的图片URL（图片可能在上传完成后才补充到任务中）；
+    标记了等待图片上传但还没有URL时，等待 add_images_to_task
+    """
+    task_data = await task_store.aget(task_id) or {}
+    if task_data.get("image_urls"):
+        image_urls = task_data["image_urls"] or []
+        print(f"✅ 从任务数据中获取图片URL，共 {len(image_urls)} 张")
+        return image_urls
+    if task_data.get("pending_image_upload"):
+        print("⏳ 等待图片上传完成...")
+        image_urls = await wait_for_task_images(task_id, report=report)
+        if not image_urls:
+            print("⚠️ 图片上传超时，继续保存（无图片）")
+        return image_urls
+    return initial_image_urls or []
 
-        # 定义任务2：图片/文字分析 -> 暖心反馈
-        async def task_vision_and_feedback():
-            update_task_progress(task_id, "processing", 40, 3, "生成反馈", "正在感受你的心情...")
-            
-            # 💡 核心要求：始终等待语音转录完成，以确保获取完整上下文
-            print("⏳ 等待转录结果以获取完整上下文...")
-            transcription = await transcription_task
-            
-            # 合并手动文字和语音转录
-            full_context = content or ""
-            if transcription and transcription.strip():
-                if full_context.strip():
-                    full_context = f"{full_context.strip()}\n\n{transcription.strip()}"
-                else:
-                    full_context = transcription.strip()
-            
-            feedback = await openai_service._call_gpt4o_mini_for_feedback(
-                full_context, 
-                user_language,
-                user_display_name,
-                None # ✅ 不传图片，避免干扰
-            )
-            update_task_progress(task_id, "processing", 65, 3, "生成反馈", "反馈生成完成")
-            return feedback
 
-        # 并行执行
-        (transcription, polish_result), feedback_data = await asyncio.gather(
-            task_voice_and_polish(),
-            task_vision_and_feedback()
-        )
-        
-        # 提取反馈内容 (旧逻辑返回 string, 新逻辑返回 dict)
-        if isinstance(feedback_data, dict):
-            feedback_text = feedback_data.get("reply", "")
-            text_emotion = feedback_data
-        else:
-            # 兼容旧代码或其他错误情况
-            feedback_text = feedback_data
-            text_emotion = {"emotion": "Reflective", "confidence": 0.0}
-
-        # --------------------------------------------------------
-        # 🔥 Step C: 情绪分析 (Text Optimization)
-        # --------------------------------------------------------
-        update_task_progress(task_id, "processing", 75, 3, "情绪分析", "正在读懂你的心...")
-        
-        # 直接使用 GPT-4o-mini 的分析结果
-        emotion_data = {
-            "emotion": text_emotion.get("emotion", "Reflective"),
-            "confidence": text_emotion.get("confidence", 0.0),
-            "rationale": text_emotion.get("rationale", ""),
-            "source": "text_only",
-            "meta": {
-                "text": text_emotion
-            }
-        }
-        
-        ai_result = {
-            "title": polish_result['title'],
-            "polished_content": polish_result['polished_content'],
-            "feedback": feedback_text,
-            "emotion_data": emotion_data # ✅ 新增
-        }
-        
-        update_task_progress(task_id, "processing", 70, 3, "AI处理", "全部处理完成")
-        
-        update_task_progress(task_id, "processing", 85, 4, "整理内容", "正在为你整理日记...")
-        await asyncio.sleep(0.2)
-        update_task_progress(task_id, "processing", 92, 5, "保存数据", "正在保存到数据库...")
-        await asyncio.sleep(0.2)
-        
-        # ✅ 优化：如果图片URL还没准备好，等待图片上传完成
-        # 这样可以实现图片上传和AI处理的真正并行
-        final_image_urls = image_urls if image_urls else []
-        
-        # ✅ 关键修复：无论是否有初始图片URL，都检查任务数据中是否有补充的图片URL
-        # 因为图片可能在上传完成后才补充到任务中
-        if task_id in task_progress:
-            task_data = task_progress[task_id]
-            
-            # 如果任务数据中已经有图片URL，直接使用（图片已上传完成）
-            if task_data.get("image_urls"):
-                final_image_urls = task_data["image_urls"] or []
-                print(f"✅ 从任务数据中获取图片URL，共 {len(final_image_urls)} 张")
-            # 如果还没有图片URL，但标记了等待图片上传，则等待
-            elif task_data.get("pending_image_upload"):
-                print("⏳ 等待图片上传完成...")
-                update_task_progress(task_id, "processing", 93, 5, "等待图片", "正在等待图片上传...")
-                # 等待最多30秒，让图片上传完成
-                max_wait_time = 30  # 30秒
-                wait_interval = 0.5  # 每0.5秒检查一次
-                progress_update_interval = 1  # 每1秒更新一次进度，更平滑
-                waited_time = 0
-                last_progress_update = 0
-                while waited_time < max_wait_time:
-                    # 重新获取任务数据（可能被更新）
-                    if task_id in task_progress:
-                        task_data = task_progress[task_id]
-                        if task_data.get("image_urls"):
-                            final_image_urls = task_data["image_urls"] or []
-                            print(f"✅ 图片上传完成，共 {len(final_image_urls)} 张")
-                            break
-                    
-                    # ✅ 定期更新进度，避免用户感觉卡住（93% -> 94% -> 95%）
-                    if waited_time - last_progress_update >= progress_update_interval:
-                        progress_value = min(93 + int((waited_time / max_wait_time) * 4), 97)
-                        update_task_progress(
-                            task_id,
-                            "processing",
-                            progress_value,
-                            5,
-                            "等待图片",
-                            f"正在等待图片上传... ({int(waited_time)}秒)"
-                        )
-                        last_progress_update = waited_time
-                    
-                    await asyncio.sleep(wait_interval)
-                    waited_time += wait_interval
-                
-                if not final_image_urls:
-                    print("⚠️ 图片上传超时，继续保存（无图片）")
-        
-        # ✅ 确保 final_image_urls 是列表而不是 None
-        if final_image_urls is None:
-            final_image_urls = []
-        
-        print(f"📸 保存日记，图片数量: {len(final_image_urls)}, URLs: {final_image_urls}")
-        
-        # 保存到数据库
-        diary_obj = db_service.create_diary(
-            user_id=user['user_id'],
-            original_content=transcription,
-            polished_content=ai_result["polished_content"],
-            ai_feedback=ai_result["feedback"],
-            language=ai_result.get("language", "zh"),
-            title=ai_result["title"],
-            audio_url=await s3_upload_task,  # ✅ 等待上传完成
-            audio_duration=duration,
-            image_urls=final_image_urls,  # ✅ 使用最终图片URL（确保是列表）
-            emotion_data=ai_result["emotion_data"] # ✅ 传递情绪数据
+async def process_voice_diary_async(task_id: str, inputs: VoiceDiaryInput):
+    """
+    异步处理语音日记（后台任务）
+
+    流水线进度（含阶段与 ETA 提示）写入任务存储，供轮询 / 长轮询 / SSE 订阅读取
+    """
+    async def on_progress(progress: Dict) -> None:
+        await update_task_progress(
+            task_id, "processing",
+            progress["progress"], progress["step"], progress["step_name"], progress["message"],
+            stage=progress["stage"],
+            eta_ms=progress["eta_ms"],
+            stage_expected_ms=progress["stage_expected_ms"]
         )
-        
-        # 更新进度：完成（分两步，让进度更平滑）
-        update_task_progress(task_id, "processing", 96, 5, "保存数据", "数据保存中...")
-        await asyncio.sleep(0.2)
-        update_task_progress(task_id, "processing", 98, 5, "完成", "数据保存成功")
-        await asyncio.sleep(0.2)
-        update_task_progress(task_id, "completed", 100, 5, "完成", "处理完成", diary=diary_obj)
-        
+
+    try:
+        diary_obj = await get_voice_pipeline().run(inputs, on_progress=on_progress)
+        await update_task_progress(task_id, "completed", 100, 5, "完成", "处理完成", diary=diary_obj)
+        
+    except (asyncio.CancelledError, JobCancelledError) as e:
+        # 取消（用户取消或超时）：流水线已中止进行中的阶段并清理已上传的音频，不写入日记
+        print(f"🛑 语音日记处理已取消: {task_id}")
+        await mark_task_cancelled(task_id)
+        if isinstance(e, asyncio.CancelledError):
+            raise
     except HTTPException as e:
-        update_task_progress(task_id, "failed", 0, 0, "错误", str(e.detail), error=str(e.detail))
+        await update_task_progress(task_id, "failed", 0, 0, "错误", str(e.detail), error=str(e.detail))
     except Exception as e:
         print(f"❌ 异步处理失败: {str(e)}")
         import traceback
         traceback.print_exc()
-        update_task_progress(task_id, "failed", 0, 0, "错误", f"处理失败: {str(e)}", error=str(e))
+        await update_task_progress(task_id, "failed", 0, 0, "错误", f"处理失败: {str(e)}", error=str(e))
 
 
 @router.post("/voice/stream", summary="创建语音日记（实时进度版）")
@@ -812,11 +534,14 @@ async def create_voice_diary_stream(
     5. 推送进度：生成标题 (85%)
     6. 推送进度：生成反馈 (95%)
     7. 推送最终结果 (100%)
+    
+    润色和反馈流式生成：标题、润色正文、反馈文字通过 partial 事件边生成边推送
     """
     
-    # 🔥 关键修复：在生成器外部先读取文件内容
+    # 🔥 关键修复：在生成器外部先把音频落盘
     # 原因：在流式响应中，一旦生成器开始yield，请求体就会被关闭
-    # 所以必须在生成器外部先读取所有数据
+    # 所以必须在生成器外部先读完请求体（分块写入临时文件，不整段读入内存）
+    spooled_audio: Optional[SpooledAudio] = None
     try:
         # 验证文件类型
         if not audio.content_type.startswith("audio/"):
@@ -834,15 +559,15 @@ async def create_voice_diary_stream(
                 }
             )
         
-        # 读取音频内容（必须在生成器外部）
-        audio_content = await audio.read()
-        audio_filename = audio.filename or "recording.m4a"
-        audio_content_type = audio.content_type or "audio/m4a"
+        # 落盘音频（必须在生成器外部）
+        spooled_audio = await SpooledAudio.from_upload(audio)
         
         # 验证音频质量
-        validate_audio_quality(duration, len(audio_content))
+        validate_audio_quality(duration, spooled_audio.size)
         
     except HTTPException as e:
+        if spooled_audio is not None:
+            spooled_audio.close()
         # 验证失败，返回错误流
         async def error_stream() -> AsyncGenerator[str, None]:
             error_data = {"error": str(e.detail), "status_code": e.status_code}
@@ -859,6 +584,9 @@ async def create_voice_diary_stream(
         )
     except Exception as e:
         # 其他错误
+        if spooled_audio is not None:
+            spooled_audio.close()
+
         async def error_stream() -> AsyncGenerator[str, None]:
             error_data = {"error": f"读取音频文件失败: {str(e)}", "status_code": 500}
             yield await send_sse_event("error", error_data)
@@ -874,13 +602,27 @@ async def create_voice_diary_stream(
         )
     
     async def process_and_stream() -> AsyncGenerator[str, None]:
-        """异步生成器：处理语音并推送进度"""
+        """
+        异步生成器：运行流水线，把阶段进度逐条推送给客户端
+
+        润色 / 反馈流式生成时推送 partial 事件：{"stage": "polish" | "feedback", "fields": {字段: 本次新增的文本}}，
+        客户端按字段拼接，避免每个 token 都重发整段内容
+        """
+        # 队列元素为 (SSE 事件名, 数据)
+        event_queue: asyncio.Queue = asyncio.Queue()
+        pipeline_task = asyncio.create_task(get_voice_pipeline().run(
+            VoiceDiaryInput(
+                user_id=user['user_id'],
+                audio=spooled_audio,
+                duration=duration,
+                user_display_name=resolve_user_display_name(user, request),
+                on_partial=lambda stage, fields: event_queue.put_nowait(
+                    ("partial", {"stage": stage, "fields": fields})
+                )
+            ),
+            on_progress=lambda progress: event_queue.put_nowait(("progress", progress))
+        ))
         try:
-            openai_service = get_openai_service()
-            
-            # ============================================
-            # Step 1: 开始处理（音频内容已在外部读取）
-            # ============================================
             yield await send_sse_event("progress", {
                 "step": 0,
                 "step_name": "开始处理",
@@ -888,124 +630,18 @@ async def create_voice_diary_stream(
                 "message": "正在验证音频..."
             })
             
-            # ============================================
-            # Step 2 & 3: 并行处理 (上传S3 + 语音转文字)
-            # ============================================
-            yield await send_sse_event("progress", {
-                "step": 1,
-                "step_name": "处理中",
-                "progress": 20,
-                "message": "正在上传音频并识别内容..."
-            })
-            
-            async def upload_to_s3_async():
-                return await asyncio.to_thread(
-                    s3_service.upload_audio,
-                    file_content=audio_content,
-                    file_name=audio_filename,
-                    content_type=audio_content_type
-                )
-            
-            async def transcribe_async():
-                return await openai_service.transcribe_audio(
-                    audio_content,
-                    audio_filename,
-                    expected_duration=duration
-                )
-
-            # 并行执行
-            audio_url, transcription = await asyncio.gather(
-                upload_to_s3_async(),
-                transcribe_async()
-            )
-            
-            yield await send_sse_event("progress", {
-                "step": 2,
-                "step_name": "语音转文字",
-                "progress": 50,
-                "message": "语音识别完成"
-            })
-            
-            # ============================================
-            # Step 4: 验证转录内容
-            # ============================================
-            validate_transcription(transcription, duration)
-            
-            # ============================================
-            # Step 5: AI处理 - 润色 (70%)
-            # ============================================
-            yield await send_sse_event("progress", {
-                "step": 3,
-                "step_name": "AI润色",
-                "progress": 55,
-                "message": "正在美化文字..."
-            })
-            
-            # 获取用户名字
-            import re
-            user_name = ""
-            # 1. 优先从请求头获取（前端传递的最新名字）
-            if request:
-                header_name = request.headers.get("X-User-Name", "").strip()
-                if header_name:
-                    user_name = header_name
-                    print(f"   ✅ 优先使用请求头中的用户名字: {user_name}")
-
-            # 2. 如果请求头没有，从 token 获取
-            if not user_name:
-                user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
-            
-            if not user_name:
-                user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-            user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
-            
-            ai_result = await openai_service.polish_content_multilingual(
-                transcription, 
-                user_name=user_display_name
-            )
-            
-            yield await send_sse_event("progress", {
-                "step": 3,
-                "step_name": "AI润色",
-                "progress": 70,
-                "message": "文字润色完成"
-            })
+            while True:
+                next_event = asyncio.ensure_future(event_queue.get())
+                await asyncio.wait({next_event, pipeline_task}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    next_event.cancel()
+                    break
+                yield await send_sse_event(*next_event.result())
+            while not event_queue.empty():
+                yield await send_sse_event(*event_queue.get_nowait())
             
-            # ============================================
-            # Step 6: 生成标题和反馈 (85% -> 95%)
-            # ============================================
-            yield await send_sse_event("progress", {
-                "step": 4,
-                "step_name": "生成标题",
-                "progress": 85,
-                "message": "正在生成标题..."
-            })
+            diary_obj = pipeline_task.result()
             
-            yield await send_sse_event("progress", {
-                "step": 5,
-                "step_name": "生成反馈",
-                "progress": 95,
-                "message": "正在生成AI反馈..."
-            })
-            
-            # ============================================
-            # Step 7: 保存到数据库
-            # ============================================
-            diary_obj = db_service.create_diary(
-                user_id=user['user_id'],
-                original_content=transcription,
-                polished_content=ai_result["polished_content"],
-                ai_feedback=ai_result["feedback"],
-                language=ai_result.get("language", "zh"),
-                title=ai_result["title"],
-                audio_url=audio_url,
-                audio_duration=duration,
-                emotion_data=ai_result.get("emotion_data") # ✅ 传递情感数据
-            )
-            
-            # ============================================
-            # Step 8: 推送最终结果
-            # ============================================
             yield await send_sse_event("progress", {
                 "step": 5,
                 "step_name": "完成",
@@ -1036,6 +672,10 @@ async def create_voice_diary_stream(
                 "status_code": 500
             }
             yield await send_sse_event("error", error_data)
+        finally:
+            # 客户端断开连接时生成器被关闭：取消流水线（会清理已上传的音频）
+            if not pipeline_task.done():
+                pipeline_task.cancel()
     
     # 返回流式响应
     return StreamingResponse(
@@ -1057,7 +697,8 @@ async def create_voice_diary_async(
     content: Optional[str] = Form(None),  # ✅ 新增：用户手动输入的文字内容
     expect_images: bool = Form(False),  # ✅ 是否后续补充图片URL（并行上传场景）
     user: Dict = Depends(get_current_user),
-    request: Request = None
+    request: Request = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     创建语音日记 - 异步任务模式（支持轮询查询进度）
@@ -1073,19 +714,43 @@ async def create_voice_diary_async(
     3. 启动后台异步处理
     4. 立即返回task_id
     5. 前端定期查询 /voice/progress/{task_id} 获取进度
+
+    携带 Idempotency-Key 时，重试返回首次创建的 task_id，不会再启动一次处理
     """
+    spooled_audio = await SpooledAudio.from_upload(audio)
+    try:
+        return await run_idempotent(
+            user,
+            idempotency_key,
+            request_fingerprint("voice/async", spooled_audio.sha256, duration, image_urls, content, expect_images),
+            lambda: _create_voice_diary_async(
+                audio, spooled_audio, duration, image_urls, content, expect_images, user, request
+            )
+        )
+    finally:
+        # 已交给后台任务的音频由流水线在处理完成后删除
+        if not spooled_audio.detached:
+            spooled_audio.close()
+
+
+async def _create_voice_diary_async(
+    audio: UploadFile,
+    spooled_audio: SpooledAudio,
+    duration: int,
+    image_urls: Optional[str],
+    content: Optional[str],
+    expect_images: bool,
+    user: Dict,
+    request: Optional[Request]
+) -> Dict:
+    """创建异步语音日记任务（实际处理）"""
     try:
         # 验证文件类型
         if not audio.content_type.startswith("audio/"):
             raise HTTPException(status_code=400, detail="请上传音频文件")
         
-        # 读取音频内容
-        audio_content = await audio.read()
-        audio_filename = audio.filename or "recording.m4a"
-        audio_content_type = audio.content_type or "audio/m4a"
-        
         # 验证音频质量
-        validate_audio_quality(duration, len(audio_content))
+        validate_audio_quality(duration, spooled_audio.size)
         
         # ✅ 解析图片URL列表（如果有）
         parsed_image_urls = None
@@ -1105,7 +770,8 @@ async def create_voice_diary_async(
         
         # ✅ 优化：初始化任务进度时立即设置为5%，避免前端长时间停留在0%
         pending_image_upload = bool(expect_images) and not parsed_image_urls
-        task_progress[task_id] = {
+        await task_store.acreate(task_id, {
+            "user_id": user['user_id'],
             "status": "processing",
             "progress": 5,  # ✅ 立即设置为5%，让用户看到进度开始
             "step": 0,
@@ -1114,46 +780,65 @@ async def create_voice_diary_async(
             "created_at": datetime.now(timezone.utc),
             "image_urls": parsed_image_urls,
             "pending_image_upload": pending_image_upload
-        }
+        })
         
-        # 启动后台异步任务（根据是否有图片选择处理函数）
+        # 选择处理方式（根据是否有图片），交给调度器运行
         has_images = parsed_image_urls and len(parsed_image_urls) > 0
         has_text_content = content and content.strip()
-        pending_images = task_progress[task_id].get("pending_image_upload", False)  # ✅ 检查是否等待图片上传
+        pending_images = pending_image_upload  # ✅ 检查是否等待图片上传
+        inputs = VoiceDiaryInput(
+            user_id=user['user_id'],
+            audio=spooled_audio,
+            duration=duration,
+            user_display_name=resolve_user_display_name(user, request),
+            wrap_emotion_data=True
+        )
         
         # ✅ 关键修复：如果有图片、文字内容，或者正在等待图片上传，都使用完整处理流程
         if has_images or has_text_content or pending_images:
-            # 混合媒体模式：使用完整处理流程（支持等待图片上传）
+            # 混合媒体模式：合并手动文字，保存前收集（或等待）图片URL
             print(f"📸 混合媒体模式 - 图片: {len(parsed_image_urls) if parsed_image_urls else 0}, 文字: {bool(has_text_content)}, 等待图片: {pending_images}")
-            asyncio.create_task(
-                process_voice_diary_async(
-                    task_id=task_id,
-                    audio_content=audio_content,
-                    audio_filename=audio_filename,
-                    audio_content_type=audio_content_type,
-                    duration=duration,
-                    user=user,
-                    request=request,
-                    image_urls=parsed_image_urls,  # 可能为 None，后续会通过 add_images_to_task 补充
-                    content=content
-                )
-            )
+            inputs.language = resolve_request_language(request)
+            inputs.content = content
+            inputs.image_urls = parsed_image_urls or []
+            # 混合媒体任务中润色 / 反馈失败时任务失败，由客户端重试
+            inputs.degrade_on_ai_error = False
+            # 可能为 None，后续会通过 add_images_to_task 补充
+            inputs.wait_for_images = functools.partial(collect_task_images, task_id, parsed_image_urls)
         else:
-            # 纯语音模式：使用快速通道 ⚡
-            print(f"🎤 纯语音模式 - 使用快速通道")
-            asyncio.create_task(
-                process_pure_voice_diary_async(
-                    task_id=task_id,
-                    audio_content=audio_content,
-                    audio_filename=audio_filename,
-                    audio_content_type=audio_content_type,
-                    duration=duration,
-                    user=user,
-                    request=request
-                )
+            print(f"🎤 纯语音模式")
+        processor = functools.partial(process_voice_diary_async, task_id, inputs)
+        
+        async def on_job_start(queue_wait_ms: float) -> None:
+            await task_store.aupdate(task_id, {"queue_wait_ms": round(queue_wait_ms), "queue_position": 0})
+        
+        try:
+            queue_position = voice_scheduler.submit(
+                task_id,
+                user['user_id'],
+                functools.partial(run_voice_task, task_id, processor),
+                on_start=on_job_start
+            )
+        except QueueFullError as e:
+            # 满载：丢弃刚创建的任务记录，让客户端按 Retry-After 重试
+            await task_store.adelete(task_id)
+            print(f"🚦 处理队列已满，拒绝任务: {voice_scheduler.stats()}")
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
             )
+        # 排队 / 运行中的任务持有落盘音频（排队中被取消时随任务对象回收）
+        spooled_audio.detach()
+        
+        if queue_position:
+            await task_store.aupdate(task_id, {
+                "queue_position": queue_position,
+                "step_name": "排队中",
+                "message": "正在排队等待处理..."
+            })
         
-        print(f"✅ 任务已创建: {task_id}")
+        print(f"✅ 任务已创建: {task_id}（排队位置: {queue_position}）")
         
         return {
             "task_id": task_id,
@@ -1170,52 +855,138 @@ async def create_voice_diary_async(
         raise HTTPException(status_code=500, detail=f"创建任务失败: {str(e)}")
 
 
+async def get_user_task(task_id: str, user: Dict) -> Dict:
+    """读取任务并校验归属；不存在、已过期、没有归属或属于其他用户时统一返回 404"""
+    task_data = await task_store.aget(task_id)
+    if not task_data or not task_data.get("user_id") or task_data["user_id"] != user.get("user_id"):
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return task_data
+
+
+def build_task_progress(task_id: str, task_data: Dict) -> Dict:
+    """任务数据 → 进度响应（轮询、长轮询、SSE 共用）"""
+    return {
+        "task_id": task_id,
+        "status": task_data.get("status", "processing"),
+        "progress": task_data.get("progress", 0),
+        "step": task_data.get("step", 0),
+        "step_name": task_data.get("step_name", ""),
+        "message": task_data.get("message", ""),
+        "diary": task_data.get("diary"),
+        "error": task_data.get("error"),
+        "version": task_data.get("version", 0),
+        # 进度动画提示：当前阶段、预计剩余毫秒数、当前阶段的典型耗时
+        "stage": task_data.get("stage"),
+        "eta_ms": task_data.get("eta_ms"),
+        "stage_expected_ms": task_data.get("stage_expected_ms"),
+        # 调度信息：排队位置（0 表示已开始处理）与实际排队等待的毫秒数
+        "queue_position": task_data.get("queue_position", 0),
+        "queue_wait_ms": task_data.get("queue_wait_ms")
+    }
+
+
 @router.get("/voice/progress/{task_id}", summary="查询语音日记处理进度")
 async def get_voice_diary_progress(
     task_id: str,
+    wait_for_change: Optional[int] = Query(None, description="长轮询：当前已知的 version，进度变化后才返回"),
+    timeout: float = Query(20, gt=0, description="长轮询最长等待秒数"),
     user: Dict = Depends(get_current_user)
 ):
     """
     查询语音日记处理进度
     
-    📚 学习点：轮询模式
-    - 前端定期调用此端点（如每500ms）
-    - 返回当前进度、状态和结果
+    📚 学习点：轮询 → 长轮询
+    - 不带 wait_for_change 时立即返回当前进度（兼容原有每500ms轮询）
+    - 带 wait_for_change=<version> 时，进度变化（或超时）后才返回，一次请求代替多次轮询
     - 当status为"completed"时，返回完整的diary对象
     
     返回格式：
     {
         "task_id": "xxx",
-        "status": "processing" | "completed" | "failed",
+        "status": "processing" | "completed" | "failed" | "cancelled",
         "progress": 0-100,
         "step": 0-5,
         "step_name": "上传音频",
         "message": "正在处理...",
         "diary": {...}  # 仅当status为completed时存在
         "error": "..."  # 仅当status为failed时存在
+        "version": 3    # 每次进度变化加1，用于下一次长轮询
     }
     """
-    # 清理过期任务
-    cleanup_old_tasks()
-    
-    if task_id not in task_progress:
-        raise HTTPException(status_code=404, detail="任务不存在或已过期")
-    
-    task_data = task_progress[task_id]
-    
-    # 检查任务是否属于当前用户（简单验证，生产环境需要更严格的验证）
-    # 这里可以添加更严格的用户验证逻辑
+    task_data = await get_user_task(task_id, user)
+
+    if wait_for_change is not None:
+        settings = get_settings()
+        task_data = await wait_for_task_change(
+            task_store,
+            task_notifier,
+            task_id,
+            wait_for_change,
+            timeout=min(timeout, settings.task_long_poll_max_seconds),
+            recheck_interval=settings.task_change_recheck_seconds
+        )
+        if task_data is None:
+            raise HTTPException(status_code=404, detail="任务不存在或已过期")
     
-    return {
-        "task_id": task_id,
-        "status": task_data.get("status", "processing"),
-        "progress": task_data.get("progress", 0),
-        "step": task_data.get("step", 0),
-        "step_name": task_data.get("step_name", ""),
-        "message": task_data.get("message", ""),
-        "diary": task_data.get("diary"),
-        "error": task_data.get("error")
-    }
+    return build_task_progress(task_id, task_data)
+
+
+@router.get("/voice/progress/{task_id}/stream", summary="订阅语音日记处理进度（SSE）")
+async def stream_voice_diary_progress(
+    task_id: str,
+    user: Dict = Depends(get_current_user)
+):
+    """
+    以 SSE 推送任务进度：只在进度变化时发送 progress 事件，到达终态后发送 complete / error 并结束
+
+    长时间无变化时发送注释行作为心跳，防止连接被代理断开
+    """
+    task_data = await get_user_task(task_id, user)
+    settings = get_settings()
+
+    async def event_stream() -> AsyncGenerator[str, None]:
+        current = task_data
+        while True:
+            payload = build_task_progress(task_id, current)
+            status = payload["status"]
+            if status == "completed":
+                yield await send_sse_event("complete", payload)
+                return
+            if status == "failed":
+                yield await send_sse_event("error", payload)
+                return
+            if status == "cancelled":
+                yield await send_sse_event("cancelled", payload)
+                return
+            yield await send_sse_event("progress", payload)
+
+            version = payload["version"]
+            while True:
+                latest = await wait_for_task_change(
+                    task_store,
+                    task_notifier,
+                    task_id,
+                    version,
+                    timeout=settings.task_sse_heartbeat_seconds,
+                    recheck_interval=settings.task_change_recheck_seconds
+                )
+                if latest is None:
+                    yield await send_sse_event("error", {"task_id": task_id, "error": "任务不存在或已过期"})
+                    return
+                if latest.get("version") != version or latest.get("status") in TERMINAL_STATUSES:
+                    current = latest
+                    break
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 
 @router.post("/voice/progress/{task_id}/images", summary="补充图片URL到任务（用于并行优化）")
@@ -1237,14 +1008,15 @@ async def add_images_to_task(
         image_urls: 图片URL列表
         user: 当前用户
     """
-    if task_id not in task_progress:
-        raise HTTPException(status_code=404, detail="任务不存在或已过期")
-    
-    task_data = task_progress[task_id]
+    await get_user_task(task_id, user)
     
     # ✅ 更新任务进度，添加图片URL（确保是列表）
-    task_data["image_urls"] = image_urls if image_urls else []
-    task_data["pending_image_upload"] = False
+    updated = await task_store.aupdate(task_id, {
+        "image_urls": image_urls if image_urls else [],
+        "pending_image_upload": False
+    })
+    if updated is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
     
     print(f"✅ 任务 {task_id} 已补充图片URL，共 {len(image_urls)} 张")
     print(f"📸 图片URLs: {image_urls}")
@@ -1256,6 +1028,38 @@ async def add_images_to_task(
     }
 
 
+@router.delete("/voice/progress/{task_id}", summary="取消语音日记处理任务")
+async def cancel_voice_diary_task(
+    task_id: str,
+    user: Dict = Depends(get_current_user)
+):
+    """
+    取消排队中或处理中的语音日记任务（用户放弃录音时调用）
+
+    - 排队中：直接移出队列
+    - 处理中：取消后台任务，中止进行中的转录 / AI 调用，删除已上传的音频
+    - 任务在其他实例上运行：写入 cancel_requested，由该实例在下一次进度更新时中止
+    - 已进入保存阶段或已结束的任务不能取消（409）
+    """
+    task_data = await get_user_task(task_id, user)
+    if task_data.get("status") in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    if task_data.get("stage") == "save":
+        raise HTTPException(status_code=409, detail="日记正在保存，无法取消")
+
+    # 先条件写入：检查之后任务可能已经结束，此时不能再标记为已取消
+    if await mark_task_cancelled(task_id) is None:
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    cancelled = voice_scheduler.cancel(task_id)
+    print(f"🛑 任务已取消: {task_id}（{cancelled or '远程'}）")
+
+    return {
+        "success": True,
+        "task_id": task_id,
+        "status": "cancelled"
+    }
+
+
 @router.post("/images/presigned-urls", summary="Get presigned URLs for direct S3 upload")
 async def get_presigned_urls(
     data: PresignedUrlRequest,
@@ -1435,7 +1239,8 @@ async def upload_diary_images(
 async def create_image_only_diary(
     data: ImageOnlyDiaryCreate,
     user: Dict = Depends(get_current_user),
-    request: Request = None  # ✅ 添加 Request 参数以获取请求头
+    request: Request = None,  # ✅ 添加 Request 参数以获取请求头
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Create a diary entry with images (optionally with text)
@@ -1450,13 +1255,23 @@ async def create_image_only_diary(
         image_urls: List of S3 image URLs (from /images endpoint)
         content: Optional text content (if provided, will be processed by AI)
         user: Current authenticated user
+        idempotency_key: Optional; a retry with the same key returns the diary created first
     
     Returns:
         Created diary entry with images (and optionally AI-processed text)
     """
+    return await run_idempotent(
+        user,
+        idempotency_key,
+        request_fingerprint("image-only", data.model_dump()),
+        lambda: _create_image_only_diary(data, user, request)
+    )
+
+
+async def _create_image_only_diary(data: ImageOnlyDiaryCreate, user: Dict, request: Optional[Request]) -> Dict:
+    """Create an image diary (actual processing)"""
     try:
         user_id = user.get('user_id')
-        user_name = user.get('name', 'User')
         
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid user")
@@ -1477,24 +1292,7 @@ async def create_image_only_diary(
             openai_service = get_openai_service()
             
             # ✅ 使用统一的用户名字获取逻辑（与文字日记和语音日记保持一致）
-            import re
-            user_name = ""
-            # 1. 优先从请求头获取（前端传递的最新名字）
-            if request:
-                header_name = request.headers.get("X-User-Name", "").strip()
-                if header_name:
-                    user_name = header_name
-                    print(f"   ✅ 优先使用请求头中的用户名字: {user_name}")
-            
-            # 2. 如果请求头没有，从 token 获取
-            if not user_name:
-                user_name = user.get('name', '').strip() or user.get('preferred_username', '').strip()
-            
-            if not user_name:
-                user_name = user.get('given_name', '').strip() or user.get('nickname', '').strip()
-            
-            # 提取名字（取第一个词）
-            user_display_name = re.split(r'\s+', user_name)[0] if user_name else None
+            user_display_name = resolve_user_display_name(user, request)
             print(f"👤 用户信息: user_id={user.get('user_id')}, name={user.get('name')}, display_name={user_display_name}")
             
             print(f"✨ Processing text content with AI...")
@@ -1503,11 +1301,12 @@ async def create_image_only_diary(
             ai_result = await openai_service.polish_content_multilingual(
                 content, 
                 user_name=user_display_name,
-                image_urls=None  # ✅ 暂时不传递图片URL，去掉Vision模型
+                image_urls=None,  # ✅ 暂时不传递图片URL，去掉Vision模型
+                user_id=user['user_id']
             )
             
             # Create diary with AI-processed content
-            diary = db_service.create_diary(
+            diary = await db_service.create_diary(
                 user_id=user_id,
                 original_content=content,
                 polished_content=ai_result["polished_content"],
@@ -1525,7 +1324,7 @@ async def create_image_only_diary(
             title = ""
             content = ""
             
-            diary = db_service.create_diary(
+            diary = await db_service.create_diary(
                 user_id=user_id,
                 original_content=content,
                 polished_content=content,
@@ -1551,16 +1350,43 @@ async def create_image_only_diary(
             detail=f"Failed to create diary: {str(e)}"
         )
 
-@router.get("/list", response_model=List[DiaryResponse], summary="获取日记列表")
+@router.get(
+    "/list",
+    response_model=Union[List[DiaryResponse], List[DiarySummaryResponse], DiaryListPage, DiarySummaryPage],
+    summary="获取日记列表"
+)
 async def get_diaries(
+    limit: Optional[int] = Query(None, ge=1, le=100, description="每页条数（传入后启用分页）"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    fields: Literal["full", "summary"] = Query("full", description="summary: 只返回时间线摘要"),
+    from_: Optional[str] = Query(None, alias="from", description="起始日期 YYYY-MM-DD 或 ISO 时间（含）"),
+    to: Optional[str] = Query(None, description="结束日期 YYYY-MM-DD 或 ISO 时间（含）"),
+    month: Optional[str] = Query(None, description="只返回某月的日记 YYYY-MM"),
     user: Dict = Depends(get_current_user)
 ):
     """
-    获取用户的所有日记列表（无数量限制）
+    获取用户的日记列表
+
+    - 不传 limit / cursor：返回全部日记（兼容旧版客户端）
+    - 传入 limit 或 cursor：只查询一页，返回 {items, next_cursor}
+    - fields=summary：只返回标题、日期、预览、情绪和媒体数量，完整内容请调用 /diary/{id}
+    - from / to / month：按 createdAt（UTC）范围查询，可与分页和 summary 组合
 
     Args:
+        limit: 每页条数
+        cursor: 分页游标
+        fields: 返回字段模式（full / summary）
+        from_: 起始日期
+        to: 结束日期
+        month: 月份
         user: 当前登录用户
     """
+    summary_mode = fields == "summary"
+    try:
+        created_range = build_created_at_range(from_, to, month)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         print(f"📖 收到获取日记列表请求 - 用户ID: {user.get('user_id')}")
         
@@ -1572,10 +1398,42 @@ async def get_diaries(
                 status_code=401,
                 detail="用户ID无效"
             )
+
+        # 分页模式
+        if limit is not None or cursor:
+            exclusive_start_key = None
+            if cursor:
+                try:
+                    exclusive_start_key = decode_cursor(cursor)
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="无效的分页游标")
+                if exclusive_start_key.get('userId') != user_id:
+                    raise HTTPException(status_code=400, detail="无效的分页游标")
+
+            page = await db_service.get_user_diaries_page(
+                user_id,
+                limit=limit or 20,
+                exclusive_start_key=exclusive_start_key,
+                summary=summary_mode,
+                created_range=created_range
+            )
+            last_evaluated_key = page['last_evaluated_key']
+            next_cursor = encode_cursor(last_evaluated_key) if last_evaluated_key else None
+            print(f"✅ 获取日记分页成功 - 用户: {user_id}, 数量: {len(page['items'])}, 还有更多: {bool(next_cursor)}")
+            return {
+                "items": page['items'],
+                "next_cursor": next_cursor
+            }
         
+        # 按日期范围获取
+        if created_range:
+            diaries = await db_service.get_user_diaries_in_range(user_id, created_range, summary=summary_mode)
+            print(f"✅ 获取日期范围内日记成功 - 用户: {user_id}, 范围: {created_range}, 数量: {len(diaries)}")
+            return diaries
+
         # 尝试获取所有日记
-        diaries = db_service.get_user_diaries(user_id)
-        if diaries and len(diaries) > 0:
+        diaries = await db_service.get_user_diaries(user_id, summary=summary_mode)
+        if diaries and len(diaries) > 0 and not summary_mode:
             print(f"🔍 [DEBUG] 第一条日记情感数据: {diaries[0].get('emotion_data')}")
         print(f"✅ 获取日记列表成功 - 用户: {user_id}, 数量: {len(diaries)}")
         return diaries
@@ -1616,9 +1474,111 @@ async def get_diaries(
             )
 
 
+@router.get("/calendar", response_model=CalendarIndexResponse, summary="获取日历索引")
+async def get_calendar_index(
+    month: str = Query(..., description="月份 YYYY-MM"),
+    user: Dict = Depends(get_current_user)
+):
+    """
+    获取某月的按天索引，用于绘制日历（不下载日记正文）
+
+    Args:
+        month: 月份 YYYY-MM（按 UTC 日期统计）
+        user: 当前登录用户
+    """
+    try:
+        month = parse_month(month)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        days = await db_service.get_calendar_index(user['user_id'], month)
+        return {
+            "month": month,
+            "days": days
+        }
+    except Exception as e:
+        print(f"❌ 获取日历索引失败: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取日历索引失败: {str(e)}"
+        )
+
+
+@router.get("/stats", response_model=UserStatsResponse, summary="获取写作统计")
+async def get_user_stats(user: Dict = Depends(get_current_user)):
+    """
+    获取日记总数、连续写作天数和情绪分布（读取预先维护的统计项，不扫描日记）
+
+    Args:
+        user: 当前登录用户
+    """
+    try:
+        return await db_service.get_user_stats(user['user_id'])
+    except Exception as e:
+        print(f"❌ 获取写作统计失败: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取写作统计失败: {str(e)}"
+        )
+
+
+@router.get("/changes", response_model=DiaryChangesResponse, summary="增量同步日记变更")
+async def get_diary_changes(
+    since: Optional[str] = Query(None, description="上次同步返回的 next_token；为空表示首次同步"),
+    user: Dict = Depends(get_current_user)
+):
+    """
+    返回自上次同步以来新建、编辑或删除的日记
+
+    - 首次同步或令牌过期时返回 reset=true，客户端应全量拉取 /diary/list 后保存 next_token
+    - 查询起点会回退一个重叠窗口以容忍多实例时钟偏差，客户端按 diary_id 幂等合并即可
+
+    Args:
+        since: 上次同步返回的令牌
+        user: 当前登录用户
+    """
+    settings = get_settings()
+    user_id = user['user_id']
+    now = datetime.now(timezone.utc)
+    next_token = encode_cursor({"u": user_id, "t": now.isoformat()})
+
+    since_time = None
+    if since:
+        try:
+            payload = decode_cursor(since)
+            if payload.get("u") != user_id:
+                raise ValueError("令牌不属于当前用户")
+            since_time = datetime.fromisoformat(payload["t"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="无效的同步令牌")
+
+    overlap = timedelta(seconds=settings.diary_changes_overlap_seconds)
+    retention = timedelta(days=settings.diary_changes_retention_days)
+    if since_time is None or now - since_time + overlap >= retention:
+        # 变更日志可能已被 TTL 清理，无法保证增量完整
+        return {"changed": [], "deleted": [], "next_token": next_token, "reset": True}
+
+    try:
+        changes = await db_service.get_diary_changes(user_id, (since_time - overlap).isoformat())
+        return {
+            "changed": changes["changed"],
+            "deleted": changes["deleted"],
+            "next_token": next_token,
+            "reset": False
+        }
+    except Exception as e:
+        print(f"❌ 获取日记变更失败: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"获取日记变更失败: {str(e)}"
+        )
+
+
 @router.get("/{diary_id}", response_model=DiaryResponse, summary="获取日记详情")
 async def get_diary_detail(
     diary_id: str,
+    created_at: Optional[str] = Query(None, description="日记创建时间（可选，提供时直接按主键读取）"),
     user: Dict = Depends(get_current_user)
 ):
     """
@@ -1626,10 +1586,11 @@ async def get_diary_detail(
     
     Args:
         diary_id: 日记 ID
+        created_at: 日记创建时间（列表中的 created_at，可选）
         user: 当前登录用户
     """
     try:
-        diary = db_service.get_diary_by_id(diary_id, user['user_id'])
+        diary = await db_service.get_diary_by_id(diary_id, user['user_id'], created_at=created_at)
         
         if not diary:
             raise HTTPException(
@@ -1654,6 +1615,7 @@ async def get_diary_detail(
 async def update_diary(
     diary_id: str,
     diary: DiaryUpdate,
+    created_at: Optional[str] = Query(None, description="日记创建时间（可选，提供时按主键直接更新）"),
     user: Dict = Depends(get_current_user)
 ):
     """
@@ -1664,6 +1626,7 @@ async def update_diary(
     Args:
         diary_id: 日记 ID
         diary: 更新内容
+        created_at: 日记创建时间（可选）
         user: 当前登录用户
     """
     try:
@@ -1682,9 +1645,10 @@ async def update_diary(
             raise ValueError("至少需要提供 content 或 title 之一")
         
         # 直接保存用户编辑的内容
-        diary_obj = db_service.update_diary(
+        diary_obj = await db_service.update_diary(
             diary_id=diary_id,
             user_id=user['user_id'],
+            created_at=created_at,
             **update_fields
         )
         
@@ -1714,6 +1678,7 @@ async def update_diary(
 @router.delete("/{diary_id}", summary="删除日记")
 async def delete_diary(
     diary_id: str,
+    created_at: Optional[str] = Query(None, description="日记创建时间（可选，提供时按主键直接删除）"),
     user: Dict = Depends(get_current_user)
 ):
     """
@@ -1721,14 +1686,16 @@ async def delete_diary(
     
     Args:
         diary_id: 日记 ID
+        created_at: 日记创建时间（可选）
         user: 当前登录用户
     """
     try:
         print(f"🗑️ 删除日记请求 - ID: {diary_id}, 用户: {user['user_id']}")
         
-        db_service.delete_diary(
+        await db_service.delete_diary(
             diary_id=diary_id,
-            user_id=user['user_id']
+            user_id=user['user_id'],
+            created_at=created_at
         )
         
         print(f"✅ 日记删除成功 - ID: {diary_id}")
@@ -1743,6 +1710,12 @@ async def delete_diary(
             status_code=404,
             detail=str(e)
         )
+    except PermissionError as e:
+        print(f"❌ 权限不足: {str(e)}")
+        raise HTTPException(
+            status_code=403,
+            detail=f"无权删除此日记: {str(e)}"
+        )
     except Exception as e:
         print(f"❌ 删除日记失败: {str(e)}")
         raise HTTPException(
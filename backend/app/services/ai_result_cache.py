@@ -0,0 +1,185 @@
+"""
+AI 结果缓存服务
+
+负责:
+- 按内容寻址缓存润色 / 标题 / 反馈结果：键为（规范化文本、语言、用户称呼、图片、提示词版本、模型）的哈希
+- 一级缓存为进程内 LRU（可替换的 CacheBackend），可选的二级缓存存放在用户自己的 DynamoDB 分区
+- 提示词版本或模型变更后键随之变化，旧结果自然失效
+- 记录命中 / 未命中次数，降级结果不写入缓存
+- Whisper 转录缓存：按音频 sha256 + 时长保存 verbose_json 的文本与分段，重试时离线重放校验
+"""
+
+import copy
+import hashlib
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from ..config import get_settings
+from ..utils.idempotency import request_fingerprint
+from .cache_service import CacheBackend, InMemoryLRUCache
+
+
+class FallbackResult(dict):
+    """AI 调用失败时的降级结果（与普通结果用法相同，但不会写入缓存）"""
+
+
+def normalize_text(text: str) -> str:
+    """统一 Unicode 形式并去掉行尾 / 首尾空白；保留换行（润色会保留原有格式）"""
+    text = unicodedata.normalize("NFC", text or "")
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def image_digests(encoded_images: Optional[List[str]]) -> List[str]:
+    """图片内容摘要（base64 编码后的图片），同一段文字配不同图片不会命中"""
+    return [hashlib.sha256(image.encode("ascii")).hexdigest() for image in encoded_images or []]
+
+
+class AIResultCache:
+    """
+    AI 结果缓存
+
+    - backend: 一级缓存（进程内，命中在微秒级）
+    - store: 可选的二级缓存（AsyncDynamoDBService），需要 user_id，按用户分区保存
+    """
+
+    def __init__(self, backend: CacheBackend, store: Any = None, enabled: bool = True):
+        self.backend = backend
+        self.store = store
+        self.enabled = enabled
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        kind: str,
+        model: str,
+        prompt_version: str,
+        text: str,
+        language: Optional[str],
+        user_name: Optional[str] = None,
+        encoded_images: Optional[List[str]] = None
+    ) -> str:
+        return request_fingerprint(
+            f"ai:{kind}",
+            model,
+            prompt_version,
+            normalize_text(text),
+            language,
+            user_name,
+            image_digests(encoded_images)
+        )
+
+    async def get(self, key: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        """命中返回结果副本（调用方可以放心修改），未命中返回 None"""
+        if not self.enabled:
+            return None
+
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return copy.deepcopy(value)
+
+        if self.store is not None and user_id:
+            try:
+                value = await self.store.get_ai_cache_entry(user_id, key)
+            except Exception as e:
+                print(f"⚠️ 读取 AI 结果缓存失败（忽略）: {e}")
+                value = None
+            if value is not None:
+                self.backend.set(key, value)
+                with self._lock:
+                    self.store_hits += 1
+                return copy.deepcopy(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict, user_id: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        if isinstance(value, FallbackResult):
+            with self._lock:
+                self.skipped += 1
+            return
+
+        value = copy.deepcopy(value)
+        self.backend.set(key, value)
+        if self.store is not None and user_id:
+            try:
+                await self.store.put_ai_cache_entry(user_id, key, value)
+            except Exception as e:
+                print(f"⚠️ 写入 AI 结果缓存失败（忽略）: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        backend_stats = self.backend.stats()
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "skipped_fallbacks": self.skipped,
+                "hit_rate": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+                "entries": backend_stats.get("entries"),
+                "bytes": backend_stats.get("bytes"),
+                "evictions": backend_stats.get("evictions"),
+            }
+
+
+# 转录校验用到的分段字段；其余字段（tokens 等）不缓存，控制条目大小
+TRANSCRIPTION_SEGMENT_FIELDS = ("start", "end", "no_speech_prob", "avg_logprob")
+
+
+def transcription_cache_key(model: str, audio_sha256: str, expected_duration: Optional[int]) -> str:
+    return f"whisper:{model}:{audio_sha256}:{expected_duration or 0}"
+
+
+def compact_transcription(response_json: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留校验需要的字段（文本、语言、时长、分段）"""
+    segments = []
+    for segment in response_json.get("segments") or []:
+        if isinstance(segment, dict):
+            segments.append({field: segment[field] for field in TRANSCRIPTION_SEGMENT_FIELDS if field in segment})
+    return {
+        "text": response_json.get("text") or "",
+        "language": response_json.get("language") or "",
+        "duration": response_json.get("duration"),
+        "segments": segments,
+    }
+
+
+@lru_cache()
+def get_ai_result_cache() -> AIResultCache:
+    """获取 AI 结果缓存（单例模式）"""
+    settings = get_settings()
+    backend = InMemoryLRUCache(
+        max_entries=settings.ai_cache_max_entries,
+        max_bytes=settings.ai_cache_max_bytes,
+        ttl_seconds=settings.ai_cache_ttl_seconds,
+    )
+    store = None
+    if settings.ai_cache_dynamodb_enabled:
+        from .async_dynamodb_service import get_async_db_service
+        store = get_async_db_service()
+    return AIResultCache(backend, store=store, enabled=settings.ai_cache_enabled)
+
+
+@lru_cache()
+def get_transcription_cache() -> Optional[InMemoryLRUCache]:
+    """获取 Whisper 转录缓存（单例模式，按字节数上限淘汰）；关闭时返回 None"""
+    settings = get_settings()
+    if not settings.transcription_cache_enabled:
+        return None
+    return InMemoryLRUCache(
+        max_entries=settings.transcription_cache_max_entries,
+        max_bytes=settings.transcription_cache_max_bytes,
+        ttl_seconds=settings.transcription_cache_ttl_seconds,
+    )
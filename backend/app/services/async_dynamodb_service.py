@@ -0,0 +1,118 @@
+"""
+异步 DynamoDB 服务
+
+负责:
+- 在专用、限定大小的线程池中执行 DynamoDBService 的同步 boto3 调用
+- 每个工作线程持有独立的 boto3 Session / resource（boto3 resource 不是线程安全的）
+- 向路由提供可 await 的方法，慢查询不再阻塞事件循环上的其他请求和 SSE 流
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, List, Optional
+
+import boto3
+
+from ..config import get_settings
+from .dynamodb_service import DynamoDBService
+
+
+class AsyncDynamoDBService:
+    """DynamoDBService 的异步外观"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        settings = get_settings()
+        self.max_workers = max(1, max_workers or settings.dynamodb_max_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="dynamodb"
+        )
+        self._local = threading.local()
+
+    def _thread_service(self) -> DynamoDBService:
+        """获取当前工作线程专属的 DynamoDBService（首次使用时创建）"""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = DynamoDBService(session=boto3.session.Session())
+            self._local.service = service
+        return service
+
+    def _invoke(self, method_name: str, args: tuple, kwargs: dict) -> Any:
+        return getattr(self._thread_service(), method_name)(*args, **kwargs)
+
+    async def _run(self, method_name: str, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self._invoke, method_name, args, kwargs)
+        )
+
+    # ---- 日记写操作 ----
+
+    async def create_diary(self, *args, **kwargs) -> dict:
+        return await self._run("create_diary", *args, **kwargs)
+
+    async def update_diary(self, *args, **kwargs) -> dict:
+        return await self._run("update_diary", *args, **kwargs)
+
+    async def delete_diary(self, *args, **kwargs) -> None:
+        return await self._run("delete_diary", *args, **kwargs)
+
+    # ---- 日记读操作 ----
+
+    async def get_user_diaries(self, *args, **kwargs) -> List[dict]:
+        return await self._run("get_user_diaries", *args, **kwargs)
+
+    async def get_user_diaries_page(self, *args, **kwargs) -> dict:
+        return await self._run("get_user_diaries_page", *args, **kwargs)
+
+    async def get_user_diaries_in_range(self, *args, **kwargs) -> List[dict]:
+        return await self._run("get_user_diaries_in_range", *args, **kwargs)
+
+    async def get_calendar_index(self, *args, **kwargs) -> List[dict]:
+        return await self._run("get_calendar_index", *args, **kwargs)
+
+    async def get_diary_by_id(self, *args, **kwargs) -> Optional[dict]:
+        return await self._run("get_diary_by_id", *args, **kwargs)
+
+    async def get_diary_changes(self, *args, **kwargs) -> dict:
+        return await self._run("get_diary_changes", *args, **kwargs)
+
+    async def get_user_stats(self, *args, **kwargs) -> dict:
+        return await self._run("get_user_stats", *args, **kwargs)
+
+    # ---- 幂等键 ----
+
+    async def claim_idempotency_key(self, *args, **kwargs) -> Optional[dict]:
+        return await self._run("claim_idempotency_key", *args, **kwargs)
+
+    async def complete_idempotency_key(self, *args, **kwargs) -> None:
+        return await self._run("complete_idempotency_key", *args, **kwargs)
+
+    async def release_idempotency_key(self, *args, **kwargs) -> None:
+        return await self._run("release_idempotency_key", *args, **kwargs)
+
+    # ---- AI 结果缓存 ----
+
+    async def get_ai_cache_entry(self, *args, **kwargs) -> Optional[dict]:
+        return await self._run("get_ai_cache_entry", *args, **kwargs)
+
+    async def put_ai_cache_entry(self, *args, **kwargs) -> None:
+        return await self._run("put_ai_cache_entry", *args, **kwargs)
+
+    # ---- 用户资料 / 账号 ----
+
+    async def upsert_user_profile(self, *args, **kwargs) -> None:
+        return await self._run("upsert_user_profile", *args, **kwargs)
+
+    async def delete_user_data(self, *args, **kwargs) -> List[str]:
+        return await self._run("delete_user_data", *args, **kwargs)
+
+
+@lru_cache()
+def get_async_db_service() -> AsyncDynamoDBService:
+    """获取异步 DynamoDB 服务（单例模式，所有路由共享同一个线程池）"""
+    return AsyncDynamoDBService()
@@ -0,0 +1,125 @@
+"""
+音频落盘服务
+
+负责:
+- 把上传的音频分块写入临时文件（每次只在内存中保留一个分块），同时计算大小和 sha256
+- 为 S3 上传、Whisper 请求等多个消费者各自打开独立的只读文件句柄，按需流式读取，不复制整段音频
+- 处理完成（或请求结束）后删除临时文件；对象被回收时兜底清理
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import weakref
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from ..config import get_settings
+
+
+def _unlink_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"⚠️ 删除音频临时文件失败: {path} - {e}")
+
+
+class SpooledAudio:
+    """
+    落盘的音频文件
+
+    - open(): 打开一个独立的读取句柄（多个消费者可并发读取）
+    - close(): 删除临时文件（幂等）；已打开的句柄在 POSIX 上仍可读到结束
+    - detach(): 交由后台任务持有，发起请求的一方不再负责关闭
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path: str, size: int, sha256: str, filename: str, content_type: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+        self.detached = False
+        self._finalizer = weakref.finalize(self, _unlink_quietly, path)
+
+    @classmethod
+    async def from_upload(
+        cls,
+        upload: UploadFile,
+        max_bytes: Optional[int] = None,
+        spool_dir: Optional[str] = None
+    ) -> "SpooledAudio":
+        """分块读取上传文件并落盘；超过 max_bytes 时返回 413"""
+        settings = get_settings()
+        max_bytes = max_bytes or settings.audio_spool_max_bytes
+        filename = upload.filename or "recording.m4a"
+        fd, path = tempfile.mkstemp(
+            prefix="audio-",
+            suffix=os.path.splitext(filename)[1] or ".m4a",
+            dir=spool_dir or settings.audio_spool_dir or None
+        )
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = await upload.read(cls.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise HTTPException(status_code=413, detail="音频文件过大")
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            _unlink_quietly(path)
+            raise
+        return cls(path, size, digest.hexdigest(), filename, upload.content_type or "audio/m4a")
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data: bytes,
+        filename: str = "recording.m4a",
+        content_type: str = "audio/m4a",
+        spool_dir: Optional[str] = None
+    ) -> "SpooledAudio":
+        """由内存中的音频创建（脚本 / 测试使用）"""
+        fd, path = tempfile.mkstemp(prefix="audio-", suffix=os.path.splitext(filename)[1] or ".m4a", dir=spool_dir)
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        return cls(path, len(data), hashlib.sha256(data).hexdigest(), filename, content_type)
+
+    @property
+    def closed(self) -> bool:
+        return not self._finalizer.alive
+
+    def open(self) -> BinaryIO:
+        """打开一个新的只读句柄（调用方负责关闭）"""
+        if self.closed:
+            raise ValueError("音频临时文件已释放")
+        return io.open(self.path, "rb")
+
+    def read_bytes(self) -> bytes:
+        """一次性读出全部内容（仅用于确实需要 bytes 的调用方）"""
+        with self.open() as f:
+            return f.read()
+
+    def detach(self) -> "SpooledAudio":
+        self.detached = True
+        return self
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def __enter__(self) -> "SpooledAudio":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,228 @@
+"""
+缓存服务
+
+负责:
+- 可插拔的缓存后端（当前为进程内 LRU，后续可替换为共享存储）
+- 日记列表的按用户读穿缓存，写操作后立即失效（包括其他实例上的写操作）
+"""
+
+import copy
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ..config import get_settings
+
+
+class CacheBackend:
+    """缓存后端接口（进程内 LRU / 共享存储均实现这几个方法）"""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+def estimate_size(value: Any) -> int:
+    """估算缓存值占用的字节数（按 JSON 序列化长度）"""
+    try:
+        return len(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return len(repr(value).encode("utf-8"))
+
+
+class InMemoryLRUCache(CacheBackend):
+    """
+    进程内 LRU 缓存
+
+    - 条数上限 + 字节上限，超出时淘汰最久未使用的条目
+    - 每个条目带 TTL，过期后视为未命中
+    - 线程安全（DynamoDB 调用可能在线程池中执行）
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl_seconds: Optional[float] = 300,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[Optional[float], int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, _, value = entry
+            if expires_at is not None and expires_at <= self._clock():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """写入缓存；ttl_seconds 为 None 时使用默认 TTL，为 0 时不过期（仍受 LRU 淘汰）"""
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            # 单个值超过总上限，不缓存
+            self.delete(key)
+            return
+
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = self._clock() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class DiaryListCache:
+    """
+    日记列表的按用户读穿缓存
+
+    每个用户有一个"代"标记（随机 token），缓存键包含该标记。
+    写操作只需更换标记，该用户的所有列表缓存即同时失效；
+    标记本身被淘汰时也只会生成新标记，不会读到旧数据。
+
+    代标记只在本进程内更换，其他实例（多个 worker / Lambda 实例）上的写操作无法通过它失效；
+    调用方可以传入 shared_version：从共享存储读取的该用户最新写入版本，同样加入缓存键，
+    任何实例写入后版本变化，所有实例的旧缓存随即不再命中。
+
+    返回的是缓存值的深拷贝，调用方修改结果不会影响缓存中的数据。
+    """
+
+    def __init__(self, backend: CacheBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, user_id: str) -> str:
+        gen_key = f"diary-list-gen:{user_id}"
+        generation = self.backend.get(gen_key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(gen_key, generation, ttl_seconds=0)
+        return generation
+
+    def _key(self, user_id: str, variant: str, version: str = "") -> str:
+        return f"diary-list:{user_id}:{self._generation(user_id)}:{version}:{variant}"
+
+    def get_or_load(
+        self,
+        user_id: str,
+        variant: str,
+        loader: Callable[[], Any],
+        shared_version: Optional[Callable[[], str]] = None
+    ) -> Any:
+        """
+        命中则返回缓存的拷贝，否则调用 loader 查询并写入缓存
+
+        shared_version: 可选，返回该用户在共享存储中的最新写入版本（每次查找时调用）
+        """
+        if not self.enabled:
+            return loader()
+
+        key = self._key(user_id, variant, shared_version() if shared_version else "")
+        cached = self.backend.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            print(f"⚡ 日记列表缓存命中 - 用户: {user_id}, 查询: {variant}")
+            return copy.deepcopy(cached)
+
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        self.backend.set(key, copy.deepcopy(value))
+        return value
+
+    def invalidate_user(self, user_id: str) -> None:
+        """用户的日记发生写操作后调用，使其所有列表缓存失效"""
+        if not self.enabled or not user_id:
+            return
+        self.backend.set(f"diary-list-gen:{user_id}", uuid.uuid4().hex, ttl_seconds=0)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中为列表查询维度的计数，其余为后端存储指标"""
+        backend_stats = self.backend.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": backend_stats.get("entries"),
+                "bytes": backend_stats.get("bytes"),
+                "evictions": backend_stats.get("evictions"),
+            }
+
+
+@lru_cache()
+def get_diary_list_cache() -> DiaryListCache:
+    """获取日记列表缓存（单例模式，所有 DynamoDBService 实例共享）"""
+    settings = get_settings()
+    backend = InMemoryLRUCache(
+        max_entries=settings.diary_list_cache_max_entries,
+        max_bytes=settings.diary_list_cache_max_bytes,
+        ttl_seconds=settings.diary_list_cache_ttl_seconds,
+    )
+    return DiaryListCache(backend, enabled=settings.diary_list_cache_enabled)
@@ -1,15 +1,81 @@
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
-from typing import List, Optional, Any
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from typing import List, Optional, Any, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ..config import get_settings
+from .cache_service import get_diary_list_cache
+from ..utils.date_range import SORT_KEY_MAX_SUFFIX
+from ..utils.stats import DAY_COUNTER_PREFIX, EMOTION_COUNTER_PREFIX, split_stats_counters, compute_streaks
 import uuid
+import json
+import time
+import random
 from decimal import Decimal
 from datetime import datetime, timezone
 
 
 class DynamoDBService:
     """DynamoDB数据库服务"""
-    def __init__(self):
+
+    # 日记排序键上界：ISO 时间以数字开头，小于任何字母开头的元数据排序键（如 PROFILE）
+    DIARY_SORT_KEY_UPPER_BOUND = "A"
+
+    # 时间线摘要模式：只读取列表页需要的属性（ProjectionExpression）
+    SUMMARY_PROJECTION = {
+        '#diaryId': 'diaryId',
+        '#userId': 'userId',
+        '#createdAt': 'createdAt',
+        '#date': 'date',
+        '#itemType': 'itemType',
+        '#language': 'language',
+        '#title': 'title',
+        '#polishedContent': 'polishedContent',
+        '#emotionData': 'emotionData',
+        '#emotion': 'emotion',
+        '#imageUrls': 'imageUrls',
+        '#audioUrl': 'audioUrl',
+        '#audioDuration': 'audioDuration',
+    }
+    # 摘要预览的最大字符数
+    SUMMARY_PREVIEW_LENGTH = 120
+
+    # 变更日志（增量同步）：与日记同分区，排序键 CHANGE#<变更时间>#<diaryId>，
+    # 大于日记排序键上界，不会出现在日记列表查询中
+    CHANGE_SORT_KEY_PREFIX = "CHANGE#"
+
+    # 用户统计项（与 PROFILE 同分区），计数器由写操作通过 ADD 原子维护；
+    # initialized 表示计数已由全量重建初始化，writeCount 每次写操作递增，用于重建时的并发检测；
+    # stale 表示有日记被删除、计数待重建（删除不读取旧条目，无法扣减情绪计数）
+    STATS_SORT_KEY = "STATS"
+    # 重建统计时条件写入失败（期间有并发写入）的最大尝试次数
+    STATS_REBUILD_MAX_RETRIES = 5
+
+    # 幂等键记录：排序键 IDEMPOTENCY#<key>，同样位于日记排序键上界之外；由 DynamoDB TTL（expiresAt）清理
+    IDEMPOTENCY_SORT_KEY_PREFIX = "IDEMPOTENCY#"
+    # 写入幂等结果的最大尝试次数与退避基数（秒）
+    IDEMPOTENCY_COMPLETE_MAX_ATTEMPTS = 4
+    IDEMPOTENCY_COMPLETE_BASE_DELAY = 0.1
+
+    # AI 结果缓存：排序键 AICACHE#<内容哈希>，放在用户自己的分区中，随账号删除一并清除；由 TTL（expiresAt）过期
+    AI_CACHE_SORT_KEY_PREFIX = "AICACHE#"
+
+    # BatchGetItem 每次最多 100 个主键
+    BATCH_GET_SIZE = 100
+
+    # BatchWriteItem 每次最多 25 条；UnprocessedItems 的重试次数与退避基数（秒）
+    BATCH_WRITE_SIZE = 25
+    BATCH_WRITE_MAX_RETRIES = 6
+    BATCH_WRITE_BASE_DELAY = 0.05
+
+    def __init__(self, session: Optional[boto3.session.Session] = None):
+        """
+        Args:
+            session: 可选的 boto3 Session；boto3 resource 不是线程安全的，
+                     多线程使用时每个线程应传入独立的 Session
+        """
         try:
             settings=get_settings()
             print(f"🔍 DynamoDB初始化 - 区域: {settings.aws_region}, 表名: {settings.dynamodb_table_name}")
@@ -17,12 +83,15 @@ class DynamoDBService:
             # 创建DynamoDB客户端
             # 在Lambda环境中，boto3会自动使用IAM角色凭证
             # 使用默认凭证链（IAM角色、环境变量等）
-            self.dynamodb=boto3.resource(
+            self.dynamodb=(session or boto3).resource(
                 "dynamodb",
                 region_name=settings.aws_region
             )
             # 获取表
             self.table=self.dynamodb.Table(settings.dynamodb_table_name)
+
+            # 日记列表读穿缓存（进程内共享，写操作后失效）
+            self.list_cache = get_diary_list_cache()
             
             # 验证表是否存在（延迟加载，不实际访问）
             print(f"✅ DynamoDB客户端初始化成功")
@@ -42,6 +111,73 @@ class DynamoDBService:
             return [self._convert_to_decimal(i) for i in obj]
         return obj
 
+    def _is_diary_item(self, item: dict) -> bool:
+        """判断查询结果是否为有效日记（跳过 PROFILE 等非日记数据）"""
+        item_type = item.get('itemType', 'diary').lower()
+        if item_type != 'diary':
+            return False
+
+        diary_id = item.get('diaryId')
+        if not diary_id or str(diary_id).lower() == 'unknown':
+            # ⚠️ 非日记数据或历史异常数据（无有效 diaryId），直接跳过
+            print(f"⚠️ 跳过无效日记记录: {item.get('diaryId')} {item.get('itemType')}")
+            return False
+
+        if 'originalContent' not in item and 'polishedContent' not in item:
+            return False
+        return True
+
+    def _item_to_diary(self, item: dict) -> dict:
+        """DynamoDB 日记项 → 返回给前端的格式(转成下划线命名)"""
+        return {
+            'diary_id': item.get('diaryId', 'unknown'),
+            'user_id': item.get('userId', ''),
+            'created_at': item.get('createdAt', ''),
+            'date': item.get('date', ''),
+            'language': item.get('language', 'zh'),
+            'title': item.get('title', '日记'),
+            'original_content': item.get('originalContent', ''),
+            'polished_content': item.get('polishedContent', ''),
+            'ai_feedback': item.get('aiFeedback', ''),
+            'audio_url': item.get('audioUrl'),
+            'audio_duration': item.get('audioDuration'),
+            'image_urls': item.get('imageUrls'),
+            'emotion_data': item.get('emotionData'),
+            'updated_at': item.get('updatedAt')
+        }
+
+    def _summary_projection_params(self) -> dict:
+        """构造摘要模式的 ProjectionExpression 参数"""
+        paths = [name for name in self.SUMMARY_PROJECTION if name not in ('#emotionData', '#emotion')]
+        paths.append('#emotionData.#emotion')
+        return {
+            'ProjectionExpression': ', '.join(paths),
+            'ExpressionAttributeNames': dict(self.SUMMARY_PROJECTION)
+        }
+
+    def _item_to_summary(self, item: dict) -> dict:
+        """DynamoDB 日记项 → 时间线摘要（服务端截断预览）"""
+        content = (item.get('polishedContent') or '').strip()
+        preview = content[:self.SUMMARY_PREVIEW_LENGTH]
+        if len(content) > self.SUMMARY_PREVIEW_LENGTH:
+            preview = preview.rstrip() + '…'
+
+        emotion_data = item.get('emotionData') or {}
+        image_urls = item.get('imageUrls') or []
+        return {
+            'diary_id': item.get('diaryId', 'unknown'),
+            'created_at': item.get('createdAt', ''),
+            'date': item.get('date', ''),
+            'language': item.get('language', 'zh'),
+            'title': item.get('title', '日记'),
+            'preview': preview,
+            'emotion': emotion_data.get('emotion'),
+            'image_count': len(image_urls),
+            'first_image_url': image_urls[0] if image_urls else None,
+            'has_audio': bool(item.get('audioUrl')),
+            'audio_duration': item.get('audioDuration')
+        }
+
     def create_diary(
         self, 
         user_id:str,
@@ -75,6 +211,7 @@ class DynamoDBService:
             'diaryId': diary_id,
             'userId':user_id,
             'createdAt':create_at,
+            'updatedAt':create_at,
             'date':date,
             'itemType': 'diary',
             'language': language,              # ← 新增：语言
@@ -94,9 +231,19 @@ class DynamoDBService:
         # ✅ 如果有情感数据，添加到item (需转换 float -> Decimal)
         if emotion_data:
             item['emotionData'] = self._convert_to_decimal(emotion_data)
-        # 保存到DynamoDB
+        # 保存到DynamoDB：日记、变更日志、统计累加在同一个事务中（一次往返，全部成功或全部失败）
         try:
-            self.table.put_item(Item=item)
+            self._write_with_stats(
+                user_id,
+                [
+                    ('Put', {'Item': item}),
+                    ('Put', self._change_put(user_id, diary_id, create_at, 'upsert', create_at)),
+                ],
+                date,
+                (emotion_data or {}).get('emotion'),
+                1
+            )
+            self.list_cache.invalidate_user(user_id)
             # 返回给前端的格式(转成下划线命名)
             return{ 
                 'diary_id': diary_id,
@@ -111,24 +258,38 @@ class DynamoDBService:
                 'audio_url':audio_url,
                 'audio_duration':audio_duration,
                 'image_urls': image_urls if image_urls else [],
-                'emotion_data': emotion_data
+                'emotion_data': emotion_data,
+                'updated_at': create_at
             }
         except Exception as e:
             print(f"保存日记失败:{str(e)}")
             raise
     def get_user_diaries(
         self,
-        user_id: str
+        user_id: str,
+        summary: bool = False
     ) -> List[dict]:
         """
-        获取用户的所有日记列表（无数量限制）
+        获取用户的所有日记列表（无数量限制，经过读穿缓存）
         
         参数:
             user_id: 用户ID
+            summary: 是否只返回时间线摘要（不含正文、反馈等大字段）
         
         返回:
             所有日记列表
         """
+        variant = f"all:{'summary' if summary else 'full'}"
+        diaries = self.list_cache.get_or_load(
+            user_id,
+            variant,
+            lambda: self._query_all_diaries(user_id, summary),
+            shared_version=lambda: self._latest_change_marker(user_id)
+        )
+        return list(diaries)
+
+    def _query_all_diaries(self, user_id: str, summary: bool) -> List[dict]:
+        """循环查询用户分区的所有日记（缓存未命中时调用）"""
         try:
             print(f"🔍 DynamoDB查询 - 表名: {self.table.table_name}, 用户ID: {user_id}, 查询所有日记")
             
@@ -136,17 +297,20 @@ class DynamoDBService:
             if not user_id or not user_id.strip():
                 raise ValueError("用户ID不能为空")
             
-            # 查询该用户的所有日记（使用分页循环）
+            # 查询该用户的所有日记（使用分页循环）；排序键上界排除同分区的 STATS / CHANGE# / IDEMPOTENCY# / AICACHE# 等非日记项
             diaries = []
             last_evaluated_key = None
             
             while True:
                 # 构建查询参数
                 query_params = {
-                    'KeyConditionExpression': Key('userId').eq(user_id),
+                    'KeyConditionExpression': self._diary_key_condition(user_id),
                     'ScanIndexForward': False  # 倒序排列(最新的在前)
                 }
                 
+                if summary:
+                    query_params.update(self._summary_projection_params())
+                
                 # 如果有分页键,添加到查询参数
                 if last_evaluated_key:
                     query_params['ExclusiveStartKey'] = last_evaluated_key
@@ -159,34 +323,9 @@ class DynamoDBService:
                 print(f"📊 DynamoDB响应 - 当前批次返回: {len(items)} 条")
                 
                 for item in items:
-                    item_type = item.get('itemType', 'diary').lower()
-                    if item_type != 'diary':
+                    if not self._is_diary_item(item):
                         continue
-
-                    diary_id = item.get('diaryId')
-                    if not diary_id or str(diary_id).lower() == 'unknown':
-                        # ⚠️ 非日记数据或历史异常数据（无有效 diaryId），直接跳过
-                        print(f"⚠️ 跳过无效日记记录: {item.get('diaryId')} {item.get('itemType')}")
-                        continue
-
-                    if 'originalContent' not in item and 'polishedContent' not in item:
-                        continue
-
-                    diaries.append({
-                        'diary_id': diary_id,
-                        'user_id': item.get('userId', ''),
-                        'created_at': item.get('createdAt', ''),
-                        'date': item.get('date', ''),
-                        'language': item.get('language', 'zh'),
-                        'title': item.get('title', '日记'),
-                        'original_content': item.get('originalContent', ''),
-                        'polished_content': item.get('polishedContent', ''),
-                        'ai_feedback': item.get('aiFeedback', ''),
-                        'audio_url': item.get('audioUrl'),
-                        'audio_duration': item.get('audioDuration'),
-                        'image_urls': item.get('imageUrls'),
-                        'emotion_data': item.get('emotionData')
-                    })
+                    diaries.append(self._item_to_summary(item) if summary else self._item_to_diary(item))
                 
                 # 检查是否还有更多数据
                 last_evaluated_key = response.get('LastEvaluatedKey')
@@ -207,48 +346,267 @@ class DynamoDBService:
             print(f"   错误堆栈:\n{error_trace}")
             raise
     
-    def get_diary_by_id(
+    def get_user_diaries_page(
         self,
-        diary_id: str,
-        user_id: str
-    ) -> Optional[dict]:
+        user_id: str,
+        limit: int,
+        exclusive_start_key: Optional[dict] = None,
+        summary: bool = False,
+        created_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+    ) -> dict:
         """
-        根据diary_id获取单条日记
+        分页获取用户日记（每次只查询一页，首屏无需读取整个分区）
         
         参数:
-            diary_id: 日记ID
             user_id: 用户ID
+            limit: 本页最多读取的条数（对应 DynamoDB Limit）
+            exclusive_start_key: 上一页返回的 LastEvaluatedKey
+            summary: 是否只返回时间线摘要
+            created_range: createdAt 的闭区间 (下界, 上界)，任一端可为 None
         
         返回:
-            日记对象或None
+            {"items": 日记列表, "last_evaluated_key": 下一页起点或None}
         """
+        if not user_id or not user_id.strip():
+            raise ValueError("用户ID不能为空")
+
+        # 游标必须属于当前用户，防止跨分区读取
+        if exclusive_start_key and exclusive_start_key.get('userId') != user_id:
+            raise ValueError("无效的分页游标")
+
+        start = exclusive_start_key.get('createdAt', '') if exclusive_start_key else ''
+        variant = f"page:{'summary' if summary else 'full'}:{limit}:{start}:{created_range}"
+        page = self.list_cache.get_or_load(
+            user_id,
+            variant,
+            lambda: self._query_diaries_page(user_id, limit, exclusive_start_key, summary, created_range),
+            shared_version=lambda: self._latest_change_marker(user_id)
+        )
+        return {
+            'items': list(page['items']),
+            'last_evaluated_key': page['last_evaluated_key']
+        }
+
+    def get_user_diaries_in_range(
+        self,
+        user_id: str,
+        created_range: Tuple[Optional[str], Optional[str]],
+        summary: bool = False
+    ) -> List[dict]:
+        """
+        获取 createdAt 在指定区间内的所有日记（如日历的某一个月）
+        
+        参数:
+            user_id: 用户ID
+            created_range: createdAt 的闭区间 (下界, 上界)，任一端可为 None
+            summary: 是否只返回时间线摘要
+        
+        返回:
+            区间内的日记列表（最新的在前）
+        """
+        if not user_id or not user_id.strip():
+            raise ValueError("用户ID不能为空")
+
+        def load() -> List[dict]:
+            diaries = []
+            last_evaluated_key = None
+            while True:
+                page = self._query_diaries_page(user_id, None, last_evaluated_key, summary, created_range)
+                diaries.extend(page['items'])
+                last_evaluated_key = page['last_evaluated_key']
+                if not last_evaluated_key:
+                    return diaries
+
+        variant = f"range:{'summary' if summary else 'full'}:{created_range}"
+        return list(self.list_cache.get_or_load(
+            user_id, variant, load, shared_version=lambda: self._latest_change_marker(user_id)
+        ))
+
+    def get_calendar_index(self, user_id: str, month: str) -> List[dict]:
+        """
+        获取某月的按天索引（日期 → 日记数量、主要情绪），不读取日记正文
+        
+        参数:
+            user_id: 用户ID
+            month: 月份 YYYY-MM
+        
+        返回:
+            [{"date": "2025-10-08", "count": 2, "dominant_emotion": "Joyful"}, ...]（按日期升序）
+        """
+        if not user_id or not user_id.strip():
+            raise ValueError("用户ID不能为空")
+
+        def load() -> List[dict]:
+            emotions_by_day = {}
+            counts_by_day = Counter()
+            last_evaluated_key = None
+            while True:
+                query_params = {
+                    'KeyConditionExpression': Key('userId').eq(user_id) & Key('createdAt').begins_with(month),
+                    'ScanIndexForward': True,
+                    'ProjectionExpression': '#diaryId, #createdAt, #date, #itemType, #emotionData.#emotion',
+                    'ExpressionAttributeNames': {
+                        '#diaryId': 'diaryId',
+                        '#createdAt': 'createdAt',
+                        '#date': 'date',
+                        '#itemType': 'itemType',
+                        '#emotionData': 'emotionData',
+                        '#emotion': 'emotion',
+                    }
+                }
+                if last_evaluated_key:
+                    query_params['ExclusiveStartKey'] = last_evaluated_key
+
+                response = self.table.query(**query_params)
+                for item in response.get('Items', []):
+                    if item.get('itemType', 'diary').lower() != 'diary' or not item.get('diaryId'):
+                        continue
+                    day = item.get('date') or item.get('createdAt', '')[:10]
+                    counts_by_day[day] += 1
+                    emotion = (item.get('emotionData') or {}).get('emotion')
+                    if emotion:
+                        emotions_by_day.setdefault(day, Counter())[emotion] += 1
+
+                last_evaluated_key = response.get('LastEvaluatedKey')
+                if not last_evaluated_key:
+                    break
+
+            days = []
+            for day in sorted(counts_by_day):
+                emotions = emotions_by_day.get(day)
+                days.append({
+                    'date': day,
+                    'count': counts_by_day[day],
+                    'dominant_emotion': emotions.most_common(1)[0][0] if emotions else None
+                })
+            print(f"📅 日历索引 - 用户: {user_id}, 月份: {month}, 有日记的天数: {len(days)}")
+            return days
+
         try:
-            # 使用scan查询，因为diary_id不是主键
-            response = self.table.scan(
-                FilterExpression=Attr('diaryId').eq(diary_id) & Attr('userId').eq(user_id)
+            return list(self.list_cache.get_or_load(
+                user_id, f"calendar:{month}", load, shared_version=lambda: self._latest_change_marker(user_id)
+            ))
+        except Exception as e:
+            print(f"❌ 获取日历索引失败: {str(e)}")
+            raise
+
+    def _diary_key_condition(
+        self,
+        user_id: str,
+        created_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+    ):
+        """
+        构造日记查询的 KeyConditionExpression
+        
+        日记的 createdAt 都是 ISO 时间（以数字开头），PROFILE 等元数据项以字母开头，
+        用排序键上界把它们排除在外，保证 Limit 只计算真正的日记
+        """
+        lower, upper = created_range or (None, None)
+        if lower:
+            return Key('userId').eq(user_id) & Key('createdAt').between(
+                lower, upper or self.DIARY_SORT_KEY_UPPER_BOUND
             )
-            
+        if upper:
+            return Key('userId').eq(user_id) & Key('createdAt').lte(upper)
+        return Key('userId').eq(user_id) & Key('createdAt').lt(self.DIARY_SORT_KEY_UPPER_BOUND)
+
+    def _query_diaries_page(
+        self,
+        user_id: str,
+        limit: Optional[int],
+        exclusive_start_key: Optional[dict],
+        summary: bool,
+        created_range: Optional[Tuple[Optional[str], Optional[str]]] = None
+    ) -> dict:
+        """查询用户日记的一页（缓存未命中时调用）"""
+        query_params = {
+            'KeyConditionExpression': self._diary_key_condition(user_id, created_range),
+            'ScanIndexForward': False
+        }
+        if limit:
+            query_params['Limit'] = limit
+        if summary:
+            query_params.update(self._summary_projection_params())
+        if exclusive_start_key:
+            query_params['ExclusiveStartKey'] = exclusive_start_key
+
+        try:
+            response = self.table.query(**query_params)
             items = response.get('Items', [])
-            if not items:
-                return None
-            
-            item = items[0]  # 取第一个匹配的项
-            
+            to_dict = self._item_to_summary if summary else self._item_to_diary
+            diaries = [to_dict(item) for item in items if self._is_diary_item(item)]
+            last_evaluated_key = response.get('LastEvaluatedKey')
+            print(f"📄 DynamoDB分页查询 - 用户: {user_id}, 本页: {len(diaries)} 条, 还有更多: {bool(last_evaluated_key)}")
             return {
-                'diary_id': item.get('diaryId', 'unknown'),
-                'user_id': item.get('userId', ''),
-                'created_at': item.get('createdAt', ''),
-                'date': item.get('date', ''),
-                'language': item.get('language', 'zh'),      # ← 新增：语言
-                'title': item.get('title', '日记'),           # ← 新增：标题
-                'original_content': item.get('originalContent', ''),
-                'polished_content': item.get('polishedContent', ''),
-                'ai_feedback': item.get('aiFeedback', ''),
-                'audio_url': item.get('audioUrl'),
-                'audio_duration': item.get('audioDuration'),
-                'image_urls': item.get('imageUrls'),
-                'emotion_data': item.get('emotionData') # ✅ 获取情感数据
+                'items': diaries,
+                'last_evaluated_key': last_evaluated_key
             }
+        except Exception as e:
+            print(f"❌ 分页获取日记列表失败: {str(e)}")
+            raise
+    
+    def get_diary_by_id(
+        self,
+        diary_id: str,
+        user_id: str,
+        created_at: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        根据diary_id获取单条日记（点查，不再扫描全表）
+        
+        参数:
+            diary_id: 日记ID
+            user_id: 用户ID
+            created_at: 日记创建时间（可选，提供时直接用主键 GetItem）
+        
+        返回:
+            日记对象或None（不存在或不属于该用户）
+        """
+        try:
+            item = None
+
+            # 1. 客户端提供了 createdAt：直接按主键 (userId, createdAt) 读取
+            if created_at:
+                response = self.table.get_item(
+                    Key={
+                        'userId': user_id,
+                        'createdAt': created_at
+                    }
+                )
+                item = response.get('Item')
+                if item and item.get('diaryId') != diary_id:
+                    item = None
+
+            # 2. 否则通过 diaryId-index GSI 查询
+            if not item:
+                response = self.table.query(
+                    IndexName='diaryId-index',
+                    KeyConditionExpression=Key('diaryId').eq(diary_id),
+                    Limit=1
+                )
+                items = response.get('Items', [])
+                if not items:
+                    return None
+                item = items[0]
+
+                # 验证权限：只能读取自己的日记
+                if item.get('userId') != user_id:
+                    print(f"⚠️ 日记不属于当前用户 - ID: {diary_id}, 用户: {user_id}")
+                    return None
+
+                # GSI 只投影了部分属性时，再按主键读取完整日记
+                if 'originalContent' not in item and 'polishedContent' not in item:
+                    response = self.table.get_item(
+                        Key={
+                            'userId': user_id,
+                            'createdAt': item.get('createdAt')
+                        }
+                    )
+                    item = response.get('Item')
+                    if not item:
+                        return None
+
+            return self._item_to_diary(item)
             
         except Exception as e:
             print(f"获取日记失败: {str(e)}")
@@ -259,7 +617,8 @@ class DynamoDBService:
         diary_id: str,
         user_id: str,
         polished_content: str = None,
-        title: str = None
+        title: str = None,
+        created_at: Optional[str] = None
     ) -> dict:
         """
         更新日记内容和/或标题
@@ -269,31 +628,13 @@ class DynamoDBService:
             user_id: 用户ID
             polished_content: 新的润色内容（可选）
             title: 新的标题（可选）
+            created_at: 日记创建时间（可选）。提供时直接按主键条件更新，不经过 GSI；
+                        未提供或与 diaryId 不匹配时回退到 GSI 查询
         
         返回:
             更新后的日记对象
         """
         try:
-            # 使用 GSI 通过 diaryId 直接查询
-            response = self.table.query(
-                IndexName='diaryId-index',
-                KeyConditionExpression=Key('diaryId').eq(diary_id)
-            )
-            
-            items = response.get('Items', [])
-            if not items:
-                raise ValueError(f"找不到日记ID: {diary_id}")
-            
-            # 获取日记信息
-            diary_item = items[0]
-            created_at = diary_item.get('createdAt')
-            
-            # 验证权限：确保用户只能更新自己的日记
-            if diary_item.get('userId') != user_id:
-                raise PermissionError("无权修改此日记")
-            
-            print(f"🔍 找到日记 - ID: {diary_id}, 用户: {user_id}, 创建时间: {created_at}")
-            
             # 构建动态更新表达式
             update_expressions = []
             expression_values = {}
@@ -310,47 +651,111 @@ class DynamoDBService:
             
             if not update_expressions:
                 raise ValueError("至少需要提供 polished_content 或 title 之一")
+
+            # 版本戳：增量同步按变更时间拉取
+            updated_at = datetime.now(timezone.utc).isoformat()
+            update_expressions.append('updatedAt = :ua')
+            expression_values[':ua'] = updated_at
+
+            updated_item = None
+            if created_at:
+                updated_item = self._conditional_update(
+                    diary_id, user_id, created_at, update_expressions, expression_values
+                )
+
+            if updated_item is None:
+                # 旧路径：使用 GSI 通过 diaryId 查询 createdAt 并校验权限
+                created_at = self._lookup_created_at(diary_id, user_id, "无权修改此日记")
+                print(f"🔍 找到日记 - ID: {diary_id}, 用户: {user_id}, 创建时间: {created_at}")
+                updated_item = self._conditional_update(
+                    diary_id, user_id, created_at, update_expressions, expression_values
+                )
+                if updated_item is None:
+                    raise ValueError(f"找不到日记ID: {diary_id}")
             
-            # 更新日记
-            response = self.table.update_item(
-                Key={
-                    'userId': user_id,
-                    'createdAt': created_at
-                },
-                UpdateExpression=f"SET {', '.join(update_expressions)}",
-                ExpressionAttributeValues=expression_values,
-                ReturnValues='ALL_NEW'
-            )
-            
+            self.list_cache.invalidate_user(user_id)
             print(f"✅ DynamoDB更新成功")
             
-            # 获取更新后的数据
-            updated_item = response.get('Attributes', {})
-            
-            # 返回更新后的数据
-            return {
-                'diary_id': diary_id,
-                'user_id': user_id,
-                'created_at': created_at,
-                'date': updated_item.get('date', diary_item.get('date', '')),
-                'language': updated_item.get('language', diary_item.get('language', 'zh')),
-                'title': updated_item.get('title', diary_item.get('title', '日记')),
-                'original_content': updated_item.get('originalContent', diary_item.get('originalContent', '')),
-                'polished_content': updated_item.get('polishedContent', diary_item.get('polishedContent', '')),
-                'ai_feedback': updated_item.get('aiFeedback', diary_item.get('aiFeedback', '')),
-                'audio_url': updated_item.get('audioUrl', diary_item.get('audioUrl')),
-                'audio_duration': updated_item.get('audioDuration', diary_item.get('audioDuration')),
-                'image_urls': updated_item.get('imageUrls', diary_item.get('imageUrls'))  # ← 添加这行
-            }
+            return self._item_to_diary(updated_item)
             
         except Exception as e:
             print(f"更新日记失败: {str(e)}")
             raise
 
+    def _conditional_update(
+        self,
+        diary_id: str,
+        user_id: str,
+        created_at: str,
+        update_expressions: List[str],
+        expression_values: dict
+    ) -> Optional[dict]:
+        """
+        按主键更新日记（单次 UpdateItem，ReturnValues=ALL_NEW 直接带回更新后的完整条目），
+        条件为该主键上的 diaryId 匹配（同时保证不会凭空创建新条目）
+
+        变更日志在另一个线程中与更新并发写入，不额外增加一次往返；
+        条件不满足时删除这条多余的变更日志并返回 None
+        """
+        key = {'userId': user_id, 'createdAt': created_at}
+        change = self._change_put(user_id, diary_id, created_at, 'upsert', expression_values[':ua'])['Item']
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            change_future = executor.submit(self._client_write, 'put_item', Item=change)
+            try:
+                response = self.table.update_item(
+                    Key=key,
+                    UpdateExpression=f"SET {', '.join(update_expressions)}",
+                    ConditionExpression='#diaryId = :diaryId',
+                    ExpressionAttributeNames={'#diaryId': 'diaryId'},
+                    ExpressionAttributeValues={**expression_values, ':diaryId': diary_id},
+                    ReturnValues='ALL_NEW'
+                )
+            except ClientError as e:
+                change_key = {'userId': user_id, 'createdAt': change['createdAt']}
+                try:
+                    change_future.result()
+                finally:
+                    self._client_write('delete_item', Key=change_key)
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                print(f"⚠️ 主键条件不匹配 - 日记: {diary_id}, createdAt: {created_at}")
+                return None
+            change_future.result()
+        return response.get('Attributes', {})
+
+    def _client_write(self, operation: str, **params) -> None:
+        """
+        通过低层 client（线程安全，resource 不是）执行单条 put_item / delete_item，
+        供与主写入并发的附带写入使用
+        """
+        serializer = TypeSerializer()
+        for field in ('Item', 'Key'):
+            if field in params:
+                params[field] = {k: serializer.serialize(v) for k, v in params[field].items()}
+        getattr(self.dynamodb.meta.client, operation)(TableName=self.table.name, **params)
+
+    def _lookup_created_at(self, diary_id: str, user_id: str, permission_message: str) -> str:
+        """通过 diaryId-index 查询日记的 createdAt，并校验归属"""
+        response = self.table.query(
+            IndexName='diaryId-index',
+            KeyConditionExpression=Key('diaryId').eq(diary_id)
+        )
+        
+        items = response.get('Items', [])
+        if not items:
+            raise ValueError(f"找不到日记ID: {diary_id}")
+        
+        diary_item = items[0]
+        # 验证权限：确保用户只能操作自己的日记
+        if diary_item.get('userId') != user_id:
+            raise PermissionError(permission_message)
+        return diary_item.get('createdAt')
+
     def delete_diary(
         self,
         diary_id: str,
-        user_id: str
+        user_id: str,
+        created_at: Optional[str] = None
     ):
         """
         删除日记
@@ -358,38 +763,523 @@ class DynamoDBService:
         参数:
             diary_id: 日记ID
             user_id: 用户ID
+            created_at: 日记创建时间（可选）。提供时直接按主键条件删除，不经过 GSI；
+                        未提供或与 diaryId 不匹配时回退到 GSI 查询
         """
         try:
-            # 使用 GSI 通过 diaryId 直接查询
-            response = self.table.query(
-                IndexName='diaryId-index',
-                KeyConditionExpression=Key('diaryId').eq(diary_id)
-            )
-            
-            items = response.get('Items', [])
-            if not items:
-                raise ValueError(f"找不到日记ID: {diary_id}")
-            
-            # 获取日记信息
-            diary_item = items[0]
-            created_at = diary_item.get('createdAt')
-            
-            # 验证权限：确保用户只能删除自己的日记
-            if diary_item.get('userId') != user_id:
-                raise PermissionError("无权删除此日记")
+            deleted = False
+            if created_at:
+                deleted = self._conditional_delete(diary_id, user_id, created_at)
+
+            if not deleted:
+                # 旧路径：使用 GSI 通过 diaryId 查询 createdAt 并校验权限
+                created_at = self._lookup_created_at(diary_id, user_id, "无权删除此日记")
+                if not self._conditional_delete(diary_id, user_id, created_at):
+                    raise ValueError(f"找不到日记ID: {diary_id}")
+
+            self.list_cache.invalidate_user(user_id)
             
-            # 删除日记
-            self.table.delete_item(
-                Key={
-                    'userId': user_id,
-                    'createdAt': created_at
+        except Exception as e:
+            print(f"删除日记失败: {str(e)}")
+            raise
+
+    def _conditional_delete(self, diary_id: str, user_id: str, created_at: str) -> bool:
+        """
+        按主键删除日记，条件为该主键上的 diaryId 匹配；
+        删除、墓碑（让其他设备在增量同步时得知该日记已删除）和统计标记在同一事务中，一次往返
+
+        事务不返回旧值，不再先读取日记的日期和情绪做扣减：统计项改为标记 stale，
+        下次读取统计时全量重建
+
+        返回是否删除成功；条件不满足时返回 False
+        """
+        try:
+            self._transact_write([
+                ('Delete', {
+                    'Key': {'userId': user_id, 'createdAt': created_at},
+                    'ConditionExpression': '#diaryId = :diaryId',
+                    'ExpressionAttributeNames': {'#diaryId': 'diaryId'},
+                    'ExpressionAttributeValues': {':diaryId': diary_id},
+                }),
+                ('Put', self._change_put(
+                    user_id, diary_id, created_at, 'delete', datetime.now(timezone.utc).isoformat()
+                )),
+                ('Update', self._stats_stale_update(user_id)),
+            ])
+        except ClientError as e:
+            if 0 not in self._failed_conditions(e):
+                raise
+            print(f"⚠️ 主键条件不匹配 - 日记: {diary_id}, createdAt: {created_at}")
+            return False
+        return True
+
+    def _change_put(
+        self,
+        user_id: str,
+        diary_id: str,
+        diary_created_at: str,
+        op: str,
+        changed_at: str
+    ) -> dict:
+        """
+        变更日志条目（op: upsert / delete），超过保留期后由 DynamoDB TTL（expiresAt）自动清理
+        
+        注意：不写 diaryId 属性（改用 changedDiaryId），避免变更日志进入 diaryId-index
+        """
+        settings = get_settings()
+        expires_at = int(time.time()) + settings.diary_changes_retention_days * 86400
+        return {'Item': {
+            'userId': user_id,
+            'createdAt': f"{self.CHANGE_SORT_KEY_PREFIX}{changed_at}#{diary_id}",
+            'itemType': 'change',
+            'changedDiaryId': diary_id,
+            'diaryCreatedAt': diary_created_at,
+            'op': op,
+            'changedAt': changed_at,
+            'expiresAt': expires_at,
+        }}
+
+    def _latest_change_marker(self, user_id: str) -> str:
+        """
+        用户最新一条变更日志的排序键，作为列表缓存的共享版本
+
+        新建、编辑、删除都会写变更日志，任何实例写入后该值都会变化；
+        强一致读取、只取一条且只投影主键，代价远小于列表查询本身
+        """
+        response = self.table.query(
+            KeyConditionExpression=Key('userId').eq(user_id) & Key('createdAt').between(
+                self.CHANGE_SORT_KEY_PREFIX,
+                f"{self.CHANGE_SORT_KEY_PREFIX}{SORT_KEY_MAX_SUFFIX}"
+            ),
+            ScanIndexForward=False,
+            Limit=1,
+            ConsistentRead=True,
+            ProjectionExpression='#createdAt',
+            ExpressionAttributeNames={'#createdAt': 'createdAt'}
+        )
+        items = response.get('Items', [])
+        return items[0]['createdAt'] if items else ''
+
+    def _transact_write(self, actions: List[Tuple[str, dict]]) -> None:
+        """
+        TransactWriteItems：actions 为 [(Put / Update / Delete, 与 Table 方法相同的参数)]，
+        一次往返，全部成功或全部失败
+        """
+        serializer = TypeSerializer()
+        transact_items = []
+        for action, params in actions:
+            entry = {'TableName': self.table.name}
+            for field, value in params.items():
+                if field in ('Item', 'Key', 'ExpressionAttributeValues'):
+                    value = {k: serializer.serialize(v) for k, v in value.items()}
+                entry[field] = value
+            transact_items.append({action: entry})
+        self.dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+
+    @staticmethod
+    def _failed_conditions(error: ClientError) -> List[int]:
+        """事务因条件不满足被取消时，返回条件失败的操作下标；其他错误返回空列表"""
+        if error.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+            return []
+        reasons = error.response.get('CancellationReasons') or []
+        return [i for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed']
+
+    def _write_with_stats(
+        self,
+        user_id: str,
+        actions: List[Tuple[str, dict]],
+        day: str,
+        emotion: Optional[str],
+        delta: int
+    ) -> None:
+        """
+        日记写入与统计累加在同一事务中提交
+
+        统计项尚未初始化时（只有统计更新的条件失败）改为只递增 writeCount 再提交一次，
+        随后立即全量重建初始化统计项：额外的一次事务每个用户只发生一次，之后的写入直接累加；
+        其他失败原样抛出
+        """
+        try:
+            self._transact_write(actions + [('Update', self._stats_delta_update(user_id, day, emotion, delta))])
+        except ClientError as e:
+            if self._failed_conditions(e) != [len(actions)]:
+                raise
+            print(f"ℹ️ 用户统计尚未初始化，跳过累加并初始化 - 用户: {user_id}")
+            self._transact_write(actions + [('Update', self._stats_touch_update(user_id))])
+            try:
+                self.rebuild_user_stats(user_id)
+            except Exception as rebuild_error:
+                # 日记已写入，初始化失败不影响本次请求，下次读取统计时再重建
+                print(f"⚠️ 初始化用户统计失败，留待读取时重建 - 用户: {user_id}, 错误: {str(rebuild_error)}")
+
+    def get_diary_changes(self, user_id: str, since: str) -> dict:
+        """
+        获取某时间点之后新建、编辑或删除的日记
+        
+        参数:
+            user_id: 用户ID
+            since: ISO 时间，返回变更时间 >= since 的记录
+        
+        返回:
+            {'changed': [日记对象], 'deleted': [diaryId]}
+        """
+        if not user_id or not user_id.strip():
+            raise ValueError("用户ID不能为空")
+
+        try:
+            # 同一日记可能多次变更，按时间升序遍历，保留最后一次
+            latest = {}
+            last_evaluated_key = None
+            while True:
+                query_kwargs = {
+                    'KeyConditionExpression': Key('userId').eq(user_id) & Key('createdAt').between(
+                        f"{self.CHANGE_SORT_KEY_PREFIX}{since}",
+                        f"{self.CHANGE_SORT_KEY_PREFIX}{SORT_KEY_MAX_SUFFIX}"
+                    ),
                 }
+                if last_evaluated_key:
+                    query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+                response = self.table.query(**query_kwargs)
+                for item in response.get('Items', []):
+                    diary_id = item.get('changedDiaryId')
+                    if diary_id:
+                        latest[diary_id] = item
+
+                last_evaluated_key = response.get('LastEvaluatedKey')
+                if not last_evaluated_key:
+                    break
+
+            deleted = [diary_id for diary_id, item in latest.items() if item.get('op') == 'delete']
+            upsert_keys = [
+                {'userId': user_id, 'createdAt': item['diaryCreatedAt']}
+                for item in latest.values()
+                if item.get('op') != 'delete' and item.get('diaryCreatedAt')
+            ]
+
+            changed = []
+            found_ids = set()
+            for item in self._batch_get_items(upsert_keys):
+                if self._is_diary_item(item):
+                    changed.append(self._item_to_diary(item))
+                    found_ids.add(item.get('diaryId'))
+
+            # 变更日志显示为编辑、但日记已不存在（墓碑写入失败等情况），按删除处理
+            for diary_id, item in latest.items():
+                if item.get('op') != 'delete' and diary_id not in found_ids:
+                    deleted.append(diary_id)
+
+            changed.sort(key=lambda d: d['created_at'], reverse=True)
+            print(f"🔄 增量同步 - 用户: {user_id}, 变更: {len(changed)}, 删除: {len(deleted)}")
+            return {'changed': changed, 'deleted': deleted}
+
+        except Exception as e:
+            print(f"❌ 获取日记变更失败: {str(e)}")
+            raise
+
+    def _batch_get_items(self, keys: List[dict]) -> List[dict]:
+        """用 BatchGetItem 按主键批量读取（每批 ≤100 个，重试 UnprocessedKeys）"""
+        table_name = self.table.name
+        items: List[dict] = []
+        for i in range(0, len(keys), self.BATCH_GET_SIZE):
+            request_items = {table_name: {'Keys': keys[i:i + self.BATCH_GET_SIZE]}}
+            for attempt in range(self.BATCH_WRITE_MAX_RETRIES + 1):
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                items.extend(response.get('Responses', {}).get(table_name, []))
+                request_items = response.get('UnprocessedKeys') or {}
+                if not request_items:
+                    break
+                delay = min(self.BATCH_WRITE_BASE_DELAY * (2 ** attempt), 2.0)
+                time.sleep(delay + random.uniform(0, delay))
+            else:
+                raise RuntimeError("批量读取失败：部分主键在重试后仍未处理")
+        return items
+
+    def _stats_delta_update(
+        self,
+        user_id: str,
+        day: str,
+        emotion: Optional[str],
+        delta: int
+    ) -> dict:
+        """
+        统计项的 ADD 更新参数（日记数、按天计数、情绪分布，并递增 writeCount）
+
+        条件为统计项已初始化（由 rebuild_user_stats 写入 initialized）：
+        历史用户的统计项不存在或不完整时不能在其上累加，否则计数只包含部署后的日记
+        """
+        names = {'#count': 'diaryCount', '#day': f"{DAY_COUNTER_PREFIX}{day}"}
+        add_parts = ['#count :delta', '#day :delta', '#writeCount :one']
+        if emotion:
+            names['#emotion'] = f"{EMOTION_COUNTER_PREFIX}{emotion}"
+            add_parts.append('#emotion :delta')
+
+        return {
+            'Key': {'userId': user_id, 'createdAt': self.STATS_SORT_KEY},
+            'UpdateExpression': f"ADD {', '.join(add_parts)} SET #itemType = :itemType, #updatedAt = :updatedAt",
+            'ConditionExpression': 'attribute_exists(#initialized)',
+            'ExpressionAttributeNames': {
+                **names,
+                '#writeCount': 'writeCount',
+                '#initialized': 'initialized',
+                '#itemType': 'itemType',
+                '#updatedAt': 'updatedAt',
+            },
+            'ExpressionAttributeValues': {
+                ':delta': delta,
+                ':one': 1,
+                ':itemType': 'stats',
+                ':updatedAt': datetime.now(timezone.utc).isoformat(),
+            }
+        }
+
+    def _stats_touch_update(self, user_id: str) -> dict:
+        """
+        统计项未初始化时的更新参数：只递增 writeCount（不累加计数），
+        让并发进行中的重建在条件写入时发现有新的写操作并重试
+        """
+        return {
+            'Key': {'userId': user_id, 'createdAt': self.STATS_SORT_KEY},
+            'UpdateExpression': 'ADD #writeCount :one SET #itemType = :itemType',
+            'ExpressionAttributeNames': {'#writeCount': 'writeCount', '#itemType': 'itemType'},
+            'ExpressionAttributeValues': {':one': 1, ':itemType': 'stats'}
+        }
+
+    def _stats_stale_update(self, user_id: str) -> dict:
+        """
+        删除日记时的统计更新参数：不知道被删日记的情绪，不做扣减，标记 stale 让下次读取时全量重建；
+        同时递增 writeCount，让并发进行中的重建重新统计
+        """
+        return {
+            'Key': {'userId': user_id, 'createdAt': self.STATS_SORT_KEY},
+            'UpdateExpression': 'ADD #writeCount :one SET #itemType = :itemType, #stale = :stale',
+            'ExpressionAttributeNames': {'#writeCount': 'writeCount', '#itemType': 'itemType', '#stale': 'stale'},
+            'ExpressionAttributeValues': {':one': 1, ':itemType': 'stats', ':stale': True}
+        }
+
+    def get_user_stats(self, user_id: str) -> dict:
+        """
+        读取用户统计（单次 GetItem）；统计项不存在、尚未初始化（历史用户）或被删除操作标记为 stale 时先重建一次
+        
+        返回:
+            {'diary_count', 'current_streak', 'longest_streak', 'last_entry_date', 'emotion_counts'}
+        """
+        if not user_id or not user_id.strip():
+            raise ValueError("用户ID不能为空")
+
+        try:
+            response = self.table.get_item(
+                Key={'userId': user_id, 'createdAt': self.STATS_SORT_KEY}
             )
-            
+            item = response.get('Item')
+            if item is None or not item.get('initialized') or item.get('stale'):
+                print(f"ℹ️ 用户统计未初始化，开始重建 - 用户: {user_id}")
+                item = self.rebuild_user_stats(user_id)
+            return self._stats_item_to_response(item)
         except Exception as e:
-            print(f"删除日记失败: {str(e)}")
+            print(f"❌ 获取用户统计失败: {str(e)}")
             raise
 
+    def _stats_item_to_response(self, item: dict) -> dict:
+        emotions, days = split_stats_counters(item)
+        current_streak, longest_streak = compute_streaks(days, datetime.now(timezone.utc).date())
+        return {
+            'diary_count': max(int(item.get('diaryCount', 0)), 0),
+            'current_streak': current_streak,
+            'longest_streak': longest_streak,
+            'last_entry_date': max(days) if days else None,
+            'emotion_counts': dict(sorted(emotions.items(), key=lambda kv: (-kv[1], kv[0]))),
+        }
+
+    def rebuild_user_stats(self, user_id: str) -> dict:
+        """
+        全量读取用户日记（只投影日期和情绪）并覆盖写入统计项，返回写入的统计项
+
+        覆盖写入以读取时的 writeCount 为条件：重建期间有日记写入（累加或 writeCount 递增）时
+        条件失败并重新统计，不会丢失并发的计数
+        """
+        key = {'userId': user_id, 'createdAt': self.STATS_SORT_KEY}
+        for attempt in range(self.STATS_REBUILD_MAX_RETRIES):
+            current = self.table.get_item(Key=key, ConsistentRead=True).get('Item') or {}
+            write_count = current.get('writeCount')
+            day_counts, emotion_counts = self._count_user_diaries(user_id)
+
+            stats_item = {
+                **key,
+                'itemType': 'stats',
+                'initialized': True,
+                'writeCount': write_count or 0,
+                'diaryCount': sum(day_counts.values()),
+                'updatedAt': datetime.now(timezone.utc).isoformat(),
+            }
+            stats_item.update({f"{DAY_COUNTER_PREFIX}{day}": count for day, count in day_counts.items()})
+            stats_item.update({f"{EMOTION_COUNTER_PREFIX}{emotion}": count for emotion, count in emotion_counts.items()})
+
+            condition = {'ExpressionAttributeNames': {'#writeCount': 'writeCount'}}
+            if write_count is None:
+                condition['ConditionExpression'] = 'attribute_not_exists(#writeCount)'
+            else:
+                condition['ConditionExpression'] = '#writeCount = :writeCount'
+                condition['ExpressionAttributeValues'] = {':writeCount': write_count}
+
+            try:
+                self.table.put_item(Item=stats_item, **condition)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                print(f"⚠️ 重建期间统计项有新的写入，重新统计 - 用户: {user_id}, 第 {attempt + 1} 次")
+                continue
+
+            print(f"📊 已重建用户统计 - 用户: {user_id}, 日记: {stats_item['diaryCount']}, 天数: {len(day_counts)}")
+            return stats_item
+
+        raise RuntimeError(f"重建用户统计失败：统计项持续被并发修改 - 用户: {user_id}")
+
+    def _count_user_diaries(self, user_id: str) -> Tuple[Counter, Counter]:
+        """强一致读取用户全部日记，返回 (按天计数, 情绪计数)"""
+        day_counts = Counter()
+        emotion_counts = Counter()
+        last_evaluated_key = None
+        while True:
+            query_params = {
+                'KeyConditionExpression': Key('userId').eq(user_id) & Key('createdAt').lt(self.DIARY_SORT_KEY_UPPER_BOUND),
+                'ProjectionExpression': '#diaryId, #createdAt, #date, #itemType, #emotionData.#emotion',
+                'ExpressionAttributeNames': {
+                    '#diaryId': 'diaryId',
+                    '#createdAt': 'createdAt',
+                    '#date': 'date',
+                    '#itemType': 'itemType',
+                    '#emotionData': 'emotionData',
+                    '#emotion': 'emotion',
+                },
+                'ConsistentRead': True,
+            }
+            if last_evaluated_key:
+                query_params['ExclusiveStartKey'] = last_evaluated_key
+
+            response = self.table.query(**query_params)
+            for item in response.get('Items', []):
+                if item.get('itemType', 'diary').lower() != 'diary' or not item.get('diaryId'):
+                    continue
+                day_counts[item.get('date') or item.get('createdAt', '')[:10]] += 1
+                emotion = (item.get('emotionData') or {}).get('emotion')
+                if emotion:
+                    emotion_counts[emotion] += 1
+
+            last_evaluated_key = response.get('LastEvaluatedKey')
+            if not last_evaluated_key:
+                return day_counts, emotion_counts
+
+    def claim_idempotency_key(self, user_id: str, key: str, fingerprint: str) -> Optional[dict]:
+        """
+        占用幂等键（条件写入，同一个键只会有一个请求成功占用）
+
+        以下情况可以占用：键不存在、记录已过期但 TTL 尚未删除、处理中的记录超过占用时长（原请求已中断）
+        
+        返回:
+            None 表示占用成功，调用方应执行请求；
+            否则返回已有记录 {'fingerprint', 'status', 'response'}
+        """
+        settings = get_settings()
+        sort_key = f"{self.IDEMPOTENCY_SORT_KEY_PREFIX}{key}"
+        for _ in range(2):
+            now = int(time.time())
+            try:
+                self.table.put_item(
+                    Item={
+                        'userId': user_id,
+                        'createdAt': sort_key,
+                        'itemType': 'idempotency',
+                        'fingerprint': fingerprint,
+                        'status': 'in_progress',
+                        'claimedAt': now,
+                        'expiresAt': now + settings.idempotency_ttl_hours * 3600,
+                    },
+                    ConditionExpression=(
+                        Attr('createdAt').not_exists()
+                        | Attr('expiresAt').lt(now)
+                        | (Attr('status').eq('in_progress') & Attr('claimedAt').lt(now - settings.idempotency_lock_seconds))
+                    )
+                )
+                return None
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+            item = self.table.get_item(
+                Key={'userId': user_id, 'createdAt': sort_key},
+                ConsistentRead=True
+            ).get('Item')
+            if item is None:
+                # 条件失败后记录恰好被释放，重新尝试占用
+                continue
+            response = item.get('response')
+            return {
+                'fingerprint': item.get('fingerprint'),
+                'status': item.get('status'),
+                'response': json.loads(response) if response else None,
+            }
+        raise RuntimeError(f"无法占用幂等键: {key}")
+
+    def complete_idempotency_key(self, user_id: str, key: str, response: dict) -> None:
+        """
+        记录请求结果（JSON 字符串），之后相同键的重试直接返回该结果
+
+        写入失败时退避重试；仍然失败则抛出：记录停留在处理中，占用超时后的重试会重复创建，
+        不能静默忽略
+        """
+        for attempt in range(self.IDEMPOTENCY_COMPLETE_MAX_ATTEMPTS):
+            try:
+                self.table.update_item(
+                    Key={'userId': user_id, 'createdAt': f"{self.IDEMPOTENCY_SORT_KEY_PREFIX}{key}"},
+                    UpdateExpression="SET #status = :completed, #response = :response",
+                    ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+                    ExpressionAttributeValues={
+                        ':completed': 'completed',
+                        ':response': json.dumps(response, ensure_ascii=False),
+                    }
+                )
+                return
+            except Exception as e:
+                print(f"⚠️ 写入幂等结果失败 - 键: {key}, 第 {attempt + 1} 次, 错误: {str(e)}")
+                if attempt + 1 == self.IDEMPOTENCY_COMPLETE_MAX_ATTEMPTS:
+                    raise
+                delay = self.IDEMPOTENCY_COMPLETE_BASE_DELAY * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+
+    def release_idempotency_key(self, user_id: str, key: str) -> None:
+        """请求失败时释放幂等键（只删除处理中的记录），让客户端可以用同一个键重试"""
+        try:
+            self.table.delete_item(
+                Key={'userId': user_id, 'createdAt': f"{self.IDEMPOTENCY_SORT_KEY_PREFIX}{key}"},
+                ConditionExpression=Attr('status').eq('in_progress')
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"⚠️ 释放幂等键失败 - 键: {key}, 错误: {str(e)}")
+
+    def get_ai_cache_entry(self, user_id: str, key: str) -> Optional[dict]:
+        """读取 AI 结果缓存（已过期但 TTL 尚未删除的记录视为未命中）"""
+        item = self.table.get_item(
+            Key={'userId': user_id, 'createdAt': f"{self.AI_CACHE_SORT_KEY_PREFIX}{key}"}
+        ).get('Item')
+        if item is None or int(item.get('expiresAt', 0)) < int(time.time()):
+            return None
+        return json.loads(item['result'])
+
+    def put_ai_cache_entry(self, user_id: str, key: str, result: dict) -> None:
+        """写入 AI 结果缓存（JSON 字符串）"""
+        settings = get_settings()
+        self.table.put_item(
+            Item={
+                'userId': user_id,
+                'createdAt': f"{self.AI_CACHE_SORT_KEY_PREFIX}{key}",
+                'itemType': 'ai_cache',
+                'result': json.dumps(result, ensure_ascii=False),
+                'expiresAt': int(time.time()) + settings.ai_cache_dynamodb_ttl_days * 86400,
+            }
+        )
+
     def upsert_user_profile(self, user_id: str, name: str) -> None:
         """创建或更新用户资料"""
         try:
@@ -406,51 +1296,100 @@ class DynamoDBService:
             raise
 
     def delete_user_data(self, user_id: str) -> List[str]:
-        """删除用户的所有日记并返回需要删除的音频URL列表"""
-        audio_urls: List[str] = []
+        """
+        删除用户的所有数据（日记、资料等），返回需要从 S3 删除的文件URL（音频 + 图片）
+        
+        每页查询结果按 25 条一组交给 BatchWriteItem，多个批次在线程池中并行执行，
+        删除耗时随批次数而不是条目数增长
+        """
+        media_urls: List[str] = []
+        settings = get_settings()
+        max_workers = max(1, settings.account_purge_max_workers)
+        deleted_count = 0
         try:
-            last_evaluated_key = None
-            while True:
-                query_kwargs = {
-                    'KeyConditionExpression': Key('userId').eq(user_id),
-                    'ScanIndexForward': False,
-                }
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = []
+                last_evaluated_key = None
+                while True:
+                    # 只读取主键和媒体字段，减少返回数据量
+                    query_kwargs = {
+                        'KeyConditionExpression': Key('userId').eq(user_id),
+                        'ProjectionExpression': '#userId, #createdAt, #audioUrl, #imageUrls',
+                        'ExpressionAttributeNames': {
+                            '#userId': 'userId',
+                            '#createdAt': 'createdAt',
+                            '#audioUrl': 'audioUrl',
+                            '#imageUrls': 'imageUrls',
+                        },
+                    }
 
-                if last_evaluated_key:
-                    query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+                    if last_evaluated_key:
+                        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
 
-                response = self.table.query(**query_kwargs)
-                items = response.get('Items', [])
+                    response = self.table.query(**query_kwargs)
+                    items = response.get('Items', [])
 
-                if not items and not last_evaluated_key:
-                    break
+                    keys = []
+                    for item in items:
+                        created_at = item.get('createdAt')
+                        if not created_at:
+                            continue
 
-                for item in items:
-                    created_at = item.get('createdAt')
-                    if not created_at:
-                        continue
+                        audio_url = item.get('audioUrl')
+                        if audio_url:
+                            media_urls.append(audio_url)
+                        media_urls.extend(url for url in (item.get('imageUrls') or []) if url)
 
-                    audio_url = item.get('audioUrl')
-                    if audio_url:
-                        audio_urls.append(audio_url)
-
-                    try:
-                        self.table.delete_item(
-                            Key={
-                                'userId': user_id,
-                                'createdAt': created_at
-                            }
-                        )
-                    except Exception as delete_error:
-                        print(f"❌ 删除日记失败 (userId={user_id}, createdAt={created_at}): {delete_error}")
-                        raise
+                        keys.append({
+                            'userId': user_id,
+                            'createdAt': created_at
+                        })
 
-                last_evaluated_key = response.get('LastEvaluatedKey')
-                if not last_evaluated_key:
-                    break
+                    # 边查询边删除：当前页的批次立即提交，与下一页查询重叠
+                    for i in range(0, len(keys), self.BATCH_WRITE_SIZE):
+                        batch = keys[i:i + self.BATCH_WRITE_SIZE]
+                        futures.append(executor.submit(self._batch_delete_keys, batch))
+                    deleted_count += len(keys)
+
+                    last_evaluated_key = response.get('LastEvaluatedKey')
+                    if not last_evaluated_key:
+                        break
+
+                for future in as_completed(futures):
+                    future.result()
+
+            print(f"🧹 已批量删除用户数据 - 用户: {user_id}, 条目: {deleted_count}, 批次: {len(futures)}, 媒体文件: {len(media_urls)}")
 
         except Exception as e:
             print(f"❌ 删除用户日记失败: {str(e)}")
             raise
+        finally:
+            # 即使中途失败，部分日记也可能已被删除
+            self.list_cache.invalidate_user(user_id)
+
+        return media_urls
+
+    def _batch_delete_keys(self, keys: List[dict]) -> None:
+        """
+        用 BatchWriteItem 删除一批（≤25 条）主键，重试 UnprocessedItems
+        
+        使用底层 client（线程安全），可在线程池中并发调用
+        """
+        client = self.dynamodb.meta.client
+        table_name = self.table.name
+        request_items = {
+            table_name: [{'DeleteRequest': {'Key': key}} for key in keys]
+        }
+
+        for attempt in range(self.BATCH_WRITE_MAX_RETRIES + 1):
+            response = client.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                return
+
+            # 被限流的条目指数退避后重试（带随机抖动）
+            delay = min(self.BATCH_WRITE_BASE_DELAY * (2 ** attempt), 2.0)
+            time.sleep(delay + random.uniform(0, delay))
 
-        return audio_urls
\ No newline at end of file
+        remaining = len(request_items.get(table_name, []))
+        raise RuntimeError(f"批量删除失败：{remaining} 条记录在重试后仍未处理")
\ No newline at end of file
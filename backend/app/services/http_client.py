@@ -0,0 +1,56 @@
+"""
+共享 HTTP 客户端
+
+负责:
+- 为每个事件循环维护一个长期存活的 httpx.AsyncClient（连接复用、keep-alive）
+- 安装了 h2 时启用 HTTP/2，否则退回 HTTP/1.1
+- 应用关闭时关闭客户端，释放连接
+"""
+
+import asyncio
+import importlib.util
+import weakref
+from typing import Optional
+
+import httpx
+
+from ..config import get_settings
+
+
+# 事件循环 -> 客户端；AsyncClient 的连接池绑定在创建它的事件循环上，不能跨循环共享
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def http2_available() -> bool:
+    """httpx 的 HTTP/2 支持依赖可选的 h2 包（httpx[http2]）"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _create_client() -> httpx.AsyncClient:
+    settings = get_settings()
+    return httpx.AsyncClient(
+        http2=http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry_seconds,
+        ),
+        timeout=httpx.Timeout(settings.http_timeout_seconds, connect=settings.http_connect_timeout_seconds),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环的共享客户端（必须在事件循环内调用）"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _create_client()
+        _clients[loop] = client
+    return client
+
+
+async def close_http_client() -> None:
+    """关闭当前事件循环的共享客户端（应用关闭时调用）"""
+    client: Optional[httpx.AsyncClient] = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
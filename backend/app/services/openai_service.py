@@ -14,17 +14,39 @@ AI 服务 - 混合模型优化版本
 3. 优雅但不炫技（Elegant but not showy）
 """
 
-import tempfile
-import os
+import hashlib
 import json
 import asyncio  # 🔥 用于并行执行
-from typing import Dict, Optional, List, Any
-from openai import OpenAI
-import io
+from typing import Callable, Dict, Optional, List, Any, Tuple, Union
+from functools import lru_cache
+from openai import AsyncOpenAI
 import base64
-import requests
+import httpx
 
 from ..config import get_settings
+from .audio_spool import SpooledAudio
+from .http_client import get_http_client
+from ..utils.partial_json import PartialJSONFieldExtractor
+from .ai_result_cache import (
+    FallbackResult,
+    compact_transcription,
+    get_ai_result_cache,
+    get_transcription_cache,
+    transcription_cache_key,
+)
+
+
+# 流式部分结果回调：参数为本次增长的字段 -> 本次新增的文本（调用方自行拼接，推送量与内容长度成线性）
+PartialCallback = Callable[[Dict[str, str]], None]
+
+
+def emit_cached_partial(on_partial: Optional[PartialCallback], result: Dict[str, Any], fields: Tuple[str, ...]) -> None:
+    """缓存命中时一次性推送完整字段（相当于从空串开始的一次增量），流式客户端拼接后与真实生成时结果相同"""
+    if on_partial is None:
+        return
+    values = {field: result[field] for field in fields if isinstance(result.get(field), str)}
+    if values:
+        on_partial(values)
 
 
 class OpenAIService:
@@ -68,6 +90,13 @@ class OpenAIService:
         # ✅ 与润色模型统一，方便维护
     }
     
+    # 📝 提示词版本：修改润色 / 反馈提示词时递增，AI 结果缓存中的旧结果随之失效
+    PROMPT_VERSION = "1"
+    
+    # 📡 流式生成时从未完成的 JSON 中提前提取、推送给客户端的字段
+    POLISH_PARTIAL_FIELDS = ("title", "polished_content")
+    FEEDBACK_PARTIAL_FIELDS = ("reply",)
+    
     # 📏 长度限制（保持不变）
     LENGTH_LIMITS = {
         "title_min": 4,
@@ -82,303 +111,451 @@ class OpenAIService:
         """初始化服务客户端"""
         settings = get_settings()
         
-        # OpenAI 客户端（用于 Whisper）
-        self.openai_client = OpenAI(api_key=settings.openai_api_key)
         self.openai_api_key = settings.openai_api_key
+        self.openai_timeout = httpx.Timeout(
+            settings.openai_timeout_seconds,
+            connect=settings.http_connect_timeout_seconds
+        )
+        self.openai_max_retries = settings.openai_max_retries
+        # 异步 OpenAI 客户端绑定在共享 httpx 客户端上，首次使用时创建
+        self._openai_client: Optional[AsyncOpenAI] = None
+        self._openai_http_client: Optional[httpx.AsyncClient] = None
         
         print(f"✅ AI 服务初始化完成")
         print(f"   - Whisper: 语音转文字")
         print(f"   - GPT-4o-mini: 润色 + 标题 (配置字段 haiku)")
         print(f"   - GPT-4o-mini: AI 反馈 (配置字段 sonnet)")
     
+    @property
+    def openai_client(self) -> AsyncOpenAI:
+        """
+        异步 OpenAI 客户端（润色 / 反馈）
+
+        复用当前事件循环的共享 httpx 连接池，不再占用线程池线程；
+        共享客户端重建（新的事件循环或已关闭）时随之重建
+        """
+        http_client = get_http_client()
+        if self._openai_client is None or self._openai_http_client is not http_client:
+            self._openai_client = AsyncOpenAI(
+                api_key=self.openai_api_key,
+                http_client=http_client,
+                timeout=self.openai_timeout,
+                max_retries=self.openai_max_retries
+            )
+            self._openai_http_client = http_client
+        return self._openai_client
+    
+    async def _complete_json(
+        self,
+        on_partial: Optional[PartialCallback],
+        partial_fields: Tuple[str, ...],
+        **params
+    ) -> Optional[str]:
+        """
+        JSON 模式的对话补全，返回完整的响应文本
+
+        提供 on_partial 时使用 stream=True：边接收边从未完成的 JSON 中提取字段并回调，
+        客户端几百毫秒内即可看到第一段文字
+        """
+        if on_partial is None:
+            response = await self.openai_client.chat.completions.create(
+                response_format={"type": "json_object"},  # 强制 JSON 格式
+                **params
+            )
+            return response.choices[0].message.content
+        
+        extractor = PartialJSONFieldExtractor(partial_fields)
+        parts: List[str] = []
+        stream = await self.openai_client.chat.completions.create(
+            response_format={"type": "json_object"},
+            stream=True,
+            **params
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            updated = extractor.feed(delta)
+            if updated:
+                on_partial(updated)
+        return "".join(parts)
+    
     # ========================================================================
     # 语音转文字（保持不变）
     # ========================================================================
     
     async def transcribe_audio(
         self, 
-        audio_content: bytes, 
+        audio: Union[SpooledAudio, bytes], 
         filename: str,
         expected_duration: Optional[int] = None
     ) -> str:
         """
         语音转文字 - 把你的声音变成文字
         
-        🔥 注意：这个方法完全不变，继续使用 Whisper
-        
         工作流程：
         1. 收到音频 → 检查大小
-        2. 创建临时文件 → 确保格式正确
-        3. 发送给 Whisper → 它是语音识别专家
-        4. 检查结果 → 确保不是空的
-        5. 清理临时文件 → 保持整洁
+        2. 查转录缓存（音频 sha256 + 时长）→ 同一段音频重试时不再调用 Whisper
+        3. 未命中则发送给 Whisper → 共享的 httpx.AsyncClient（连接复用，不阻塞事件循环）；
+           落盘的音频直接以文件句柄流式上传，不再复制到内存
+        4. 检查结果 → 确保不是空的（缓存命中时同样重新检查）
         """
-        temp_file_path = None
-        
         try:
             # 检查音频大小
-            audio_size_kb = len(audio_content) / 1024
+            audio_size = audio.size if isinstance(audio, SpooledAudio) else len(audio)
+            audio_size_kb = audio_size / 1024
             print(f"🎤 收到音频: {filename}, 大小: {audio_size_kb:.1f} KB")
             
             if audio_size_kb < 1:
                 raise ValueError("音频文件太小，请说长一点")
             
-            # 准备临时文件
-            suffix = '.m4a' if not filename.endswith('.m4a') else ''
-            with tempfile.NamedTemporaryFile(
-                delete=False, 
-                suffix=suffix or os.path.splitext(filename)[1]
-            ) as temp_file:
-                temp_file.write(audio_content)
-                temp_file_path = temp_file.name
+            cache = get_transcription_cache()
+            audio_sha256 = audio.sha256 if isinstance(audio, SpooledAudio) else hashlib.sha256(audio).hexdigest()
+            cache_key = transcription_cache_key(self.MODEL_CONFIG["transcription"], audio_sha256, expected_duration)
+            response_json = cache.get(cache_key) if cache is not None else None
+            if response_json is not None:
+                print(f"⚡ 转录缓存命中，跳过 Whisper 调用")
+            else:
+                response_json = await self._request_transcription(audio, filename)
+                if cache is not None:
+                    cache.set(cache_key, compact_transcription(response_json))
             
-            print(f"✅ 临时文件准备完成")
+            return self._validate_transcription_response(response_json, expected_duration)
             
-            # 调用 Whisper
-            import httpx
-            import io
+        except Exception as e:
+            print(f"❌ 语音转文字失败: {str(e)}")
+            if "Invalid file format" in str(e):
+                raise ValueError("音频格式不支持，请使用 m4a 格式")
+            elif "File too large" in str(e):
+                raise ValueError("音频文件太大，请控制在 2 分钟内")
+            else:
+                raise ValueError(f"语音识别失败: {str(e)}")
+
+    async def _request_transcription(self, audio: Union[SpooledAudio, bytes], filename: str) -> Dict[str, Any]:
+        """调用 Whisper（verbose_json），返回原始响应"""
+        audio_stream = audio.open() if isinstance(audio, SpooledAudio) else None
+        try:
             print("📤 正在识别语音（verbose_json 模式）...")
-            response_json = None
             try:
-                with httpx.Client(timeout=60.0) as client:
-                    file_stream = io.BytesIO(audio_content)
-                    response = client.post(
-                        "https://api.openai.com/v1/audio/transcriptions",
-                        headers={
-                            "Authorization": f"Bearer {self.openai_api_key}",
-                        },
-                        data={
-                            "model": self.MODEL_CONFIG["transcription"],
-                            "language": "",
-                            "temperature": "0",
-                            "response_format": "verbose_json",
-                        },
-                        files={
-                            "file": (filename or "recording.m4a", file_stream, "audio/m4a"),
-                        },
-                    )
-                    response.raise_for_status()
-                    response_json = response.json()
+                response = await get_http_client().post(
+                    "https://api.openai.com/v1/audio/transcriptions",
+                    headers={
+                        "Authorization": f"Bearer {self.openai_api_key}",
+                    },
+                    data={
+                        "model": self.MODEL_CONFIG["transcription"],
+                        "language": "",
+                        "temperature": "0",
+                        "response_format": "verbose_json",
+                    },
+                    files={
+                        "file": (filename or "recording.m4a", audio_stream or audio, "audio/m4a"),
+                    },
+                )
+                response.raise_for_status()
+                response_json = response.json()
             except httpx.HTTPError as http_err:
                 print(f"❌ Whisper HTTP 请求失败: {http_err}")
-                if http_err.response is not None:
+                if getattr(http_err, "response", None) is not None:
                     print(f"📄 Whisper 响应: {http_err.response.text[:200]}...")
                 raise ValueError("语音识别失败: 服务暂时不可用，请稍后重试")
             
             if not response_json:
                 raise ValueError("语音识别失败: 未收到有效响应")
+            return response_json
+        finally:
+            if audio_stream is not None:
+                audio_stream.close()
+    
+    def _validate_transcription_response(
+        self,
+        response_json: Dict[str, Any],
+        expected_duration: Optional[int] = None
+    ) -> str:
+        """检查 Whisper 结果（语言、重复、幻觉、有效语音时长），通过时返回文本"""
+        text = (response_json.get("text") or "").strip()
+        segments = response_json.get("segments", []) or []
+        detected_language = response_json.get("language", "").lower()  # ✅ 获取检测到的语言
+        
+        # 🔥 新增：语言白名单检查 - 防止背景音乐被误识别为韩语/日语等
+        SUPPORTED_LANGUAGES = {"zh", "en", "chinese", "english"}
+        if detected_language and detected_language not in SUPPORTED_LANGUAGES:
+            print(f"❌ 检测到不支持的语言: '{detected_language}'")
+            print(f"   识别文本: '{text[:100]}'")
+            print(f"   这可能是背景音乐或噪音被误识别")
+            raise ValueError("未识别到有效内容，请用中文或英文说话")
+        
+        # 🔥 新增：检测韩语/日语字符 - 双重保险
+        import re
+        korean_chars = len(re.findall(r'[\uac00-\ud7af]', text))  # 韩语字符
+        japanese_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff]', text))  # 日语字符
+        if korean_chars > 3 or japanese_chars > 3:
+            print(f"❌ 检测到韩语/日语字符: 韩语={korean_chars}, 日语={japanese_chars}")
+            print(f"   识别文本: '{text[:100]}'")
+            print(f"   这可能是背景音乐或噪音被误识别")
+            raise ValueError("未识别到有效内容，请用中文或英文说话")
+        
+        # 🔥 新增：检测重复文本模式 - Whisper 幻觉的常见特征
+        # 例如: "닭가슴살 치킨입니다. 닭가슴살 치킨과 닭가슴살 치킨은..."
+        words = text.split()
+        if len(words) >= 5:
+            # 检查是否有大量重复的词
+            word_counts = {}
+            for word in words:
+                if len(word) >= 3:  # 只统计长度>=3的词
+                    word_counts[word] = word_counts.get(word, 0) + 1
             
-            text = (response_json.get("text") or "").strip()
-            segments = response_json.get("segments", []) or []
-            detected_language = response_json.get("language", "").lower()  # ✅ 获取检测到的语言
-            
-            # 🔥 新增：语言白名单检查 - 防止背景音乐被误识别为韩语/日语等
-            SUPPORTED_LANGUAGES = {"zh", "en", "chinese", "english"}
-            if detected_language and detected_language not in SUPPORTED_LANGUAGES:
-                print(f"❌ 检测到不支持的语言: '{detected_language}'")
-                print(f"   识别文本: '{text[:100]}'")
-                print(f"   这可能是背景音乐或噪音被误识别")
-                raise ValueError("未识别到有效内容，请用中文或英文说话")
+            # 如果某个词出现次数超过总词数的40%,可能是幻觉
+            max_repetition = max(word_counts.values()) if word_counts else 0
+            repetition_ratio = max_repetition / len(words) if len(words) > 0 else 0
             
-            # 🔥 新增：检测韩语/日语字符 - 双重保险
-            import re
-            korean_chars = len(re.findall(r'[\uac00-\ud7af]', text))  # 韩语字符
-            japanese_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff]', text))  # 日语字符
-            if korean_chars > 3 or japanese_chars > 3:
-                print(f"❌ 检测到韩语/日语字符: 韩语={korean_chars}, 日语={japanese_chars}")
+            if repetition_ratio > 0.4:
+                print(f"❌ 检测到高度重复的文本模式: 重复率={repetition_ratio:.1%}")
                 print(f"   识别文本: '{text[:100]}'")
                 print(f"   这可能是背景音乐或噪音被误识别")
-                raise ValueError("未识别到有效内容，请用中文或英文说话")
+                raise ValueError("未识别到有效内容，请说清楚一些")
+        
+        normalized_text = re.sub(r"\s+", "", text)
+        
+        if len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]:
+            print(f"❌ 转录内容过短: '{text}'")
+            raise ValueError("未识别到有效内容，请说清楚一些")
+        
+        filler_tokens = {
+            "um",
+            "uh",
+            "uhh",
+            "hmm",
+            "hmmm",
+            "erm",
+            "er",
+            "ah",
+            "oh",
+            "mmm",
+        }
+        token_pattern = r"[A-Za-z\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff]+"
+        tokens = re.findall(token_pattern, text)
+        meaningful_tokens = [
+            token
+            for token in tokens
+            if len(token) >= 2 and token.lower() not in filler_tokens
+        ]
+        cjk_chars = re.findall(r"[\u4e00-\u9fff]", text)
+        has_cjk = len(cjk_chars) > 0
+        
+        unique_chars = len(set(normalized_text))
+        if unique_chars <= 2 and len(normalized_text) > 2:
+            print(
+                "❌ 转录结果包含大量重复字符，视为无效:",
+                {"text": text, "normalized": normalized_text},
+            )
+            raise ValueError("未识别到有效内容，请说清楚一些")
+        
+        # 分析 Whisper 段结果，确认是否真的有讲话
+        def _segment_value(segment, attr, default):
+            if isinstance(segment, dict):
+                return segment.get(attr, default)
+            return getattr(segment, attr, default)
+        
+        confident_segments = []
+        total_confident_duration = 0.0
+        total_segment_duration = 0.0
+        avg_no_speech_sum = 0.0
+        
+        for segment in segments:
+            try:
+                start = float(_segment_value(segment, "start", 0))
+                end = float(_segment_value(segment, "end", 0))
+                seg_duration = max(0.0, end - start)
+            except (TypeError, ValueError):
+                seg_duration = 0.0
+                start = 0.0
+                end = 0.0
             
-            # 🔥 新增：检测重复文本模式 - Whisper 幻觉的常见特征
-            # 例如: "닭가슴살 치킨입니다. 닭가슴살 치킨과 닭가슴살 치킨은..."
-            words = text.split()
-            if len(words) >= 5:
-                # 检查是否有大量重复的词
-                word_counts = {}
-                for word in words:
-                    if len(word) >= 3:  # 只统计长度>=3的词
-                        word_counts[word] = word_counts.get(word, 0) + 1
-                
-                # 如果某个词出现次数超过总词数的40%,可能是幻觉
-                max_repetition = max(word_counts.values()) if word_counts else 0
-                repetition_ratio = max_repetition / len(words) if len(words) > 0 else 0
-                
-                if repetition_ratio > 0.4:
-                    print(f"❌ 检测到高度重复的文本模式: 重复率={repetition_ratio:.1%}")
-                    print(f"   识别文本: '{text[:100]}'")
-                    print(f"   这可能是背景音乐或噪音被误识别")
-                    raise ValueError("未识别到有效内容，请说清楚一些")
+            total_segment_duration += seg_duration
             
-            normalized_text = re.sub(r"\s+", "", text)
+            try:
+                no_speech_prob = float(_segment_value(segment, "no_speech_prob", 1))
+            except (TypeError, ValueError):
+                no_speech_prob = 1
             
-            if len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]:
-                print(f"❌ 转录内容过短: '{text}'")
-                raise ValueError("未识别到有效内容，请说清楚一些")
+            try:
+                avg_logprob = float(_segment_value(segment, "avg_logprob", -10))
+            except (TypeError, ValueError):
+                avg_logprob = -10
             
-            filler_tokens = {
-                "um",
-                "uh",
-                "uhh",
-                "hmm",
-                "hmmm",
-                "erm",
-                "er",
-                "ah",
-                "oh",
-                "mmm",
-            }
-            token_pattern = r"[A-Za-z\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff]+"
-            tokens = re.findall(token_pattern, text)
-            meaningful_tokens = [
-                token
-                for token in tokens
-                if len(token) >= 2 and token.lower() not in filler_tokens
-            ]
-            cjk_chars = re.findall(r"[\u4e00-\u9fff]", text)
-            has_cjk = len(cjk_chars) > 0
+            avg_no_speech_sum += no_speech_prob * seg_duration
             
-            unique_chars = len(set(normalized_text))
-            if unique_chars <= 2 and len(normalized_text) > 2:
+            if (
+                seg_duration >= 0.3
+                and no_speech_prob < 0.45
+                and avg_logprob > -0.75
+            ):
+                confident_segments.append(segment)
+                total_confident_duration += seg_duration
+        
+        reference_duration = None
+        if expected_duration and expected_duration > 0:
+            reference_duration = float(expected_duration)
+        elif total_segment_duration > 0:
+            reference_duration = total_segment_duration
+        else:
+            reference_duration = None
+        
+        speech_ratio = (
+            total_confident_duration / reference_duration
+            if reference_duration and reference_duration > 0
+            else None
+        )
+        
+        avg_no_speech_prob = (
+            avg_no_speech_sum / total_segment_duration
+            if total_segment_duration > 0
+            else 1.0
+        )
+        
+        if reference_duration and reference_duration >= 6:
+            if (
+                len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]
+                and (speech_ratio is None or speech_ratio < 0.15)
+                and total_confident_duration < 0.6
+            ):
                 print(
-                    "❌ 转录结果包含大量重复字符，视为无效:",
-                    {"text": text, "normalized": normalized_text},
+                    "❌ 检测到有效语音过少:",
+                    {
+                        "expected_duration": expected_duration,
+                        "total_confident_duration": total_confident_duration,
+                        "speech_ratio": speech_ratio,
+                        "avg_no_speech_prob": avg_no_speech_prob,
+                        "segments_count": len(segments),
+                    },
                 )
                 raise ValueError("未识别到有效内容，请说清楚一些")
-            
-            # 分析 Whisper 段结果，确认是否真的有讲话
-            def _segment_value(segment, attr, default):
-                if isinstance(segment, dict):
-                    return segment.get(attr, default)
-                return getattr(segment, attr, default)
-            
-            confident_segments = []
-            total_confident_duration = 0.0
-            total_segment_duration = 0.0
-            avg_no_speech_sum = 0.0
-            
-            for segment in segments:
-                try:
-                    start = float(_segment_value(segment, "start", 0))
-                    end = float(_segment_value(segment, "end", 0))
-                    seg_duration = max(0.0, end - start)
-                except (TypeError, ValueError):
-                    seg_duration = 0.0
-                    start = 0.0
-                    end = 0.0
-                
-                total_segment_duration += seg_duration
-                
-                try:
-                    no_speech_prob = float(_segment_value(segment, "no_speech_prob", 1))
-                except (TypeError, ValueError):
-                    no_speech_prob = 1
-                
-                try:
-                    avg_logprob = float(_segment_value(segment, "avg_logprob", -10))
-                except (TypeError, ValueError):
-                    avg_logprob = -10
-                
-                avg_no_speech_sum += no_speech_prob * seg_duration
-                
+        
+        # 对长录音不再使用字符密度硬阈值，避免误杀真实内容
+
+        if reference_duration:
+            if has_cjk:
+                # 中文场景：用汉字数量判断，避免“一个长词”被误判
                 if (
-                    seg_duration >= 0.3
-                    and no_speech_prob < 0.45
-                    and avg_logprob > -0.75
+                    len(cjk_chars) < 3
+                    and len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]
                 ):
-                    confident_segments.append(segment)
-                    total_confident_duration += seg_duration
-            
-            reference_duration = None
-            if expected_duration and expected_duration > 0:
-                reference_duration = float(expected_duration)
-            elif total_segment_duration > 0:
-                reference_duration = total_segment_duration
+                    print(
+                        "❌ 中文有效字符过少，判定为无意义内容:",
+                        {
+                            "cjk_chars": len(cjk_chars),
+                            "duration": reference_duration,
+                        },
+                    )
+                    raise ValueError("未识别到有效内容，请稍作表达后再试")
             else:
-                reference_duration = None
-            
-            speech_ratio = (
-                total_confident_duration / reference_duration
-                if reference_duration and reference_duration > 0
-                else None
-            )
-            
-            avg_no_speech_prob = (
-                avg_no_speech_sum / total_segment_duration
-                if total_segment_duration > 0
-                else 1.0
-            )
-            
-            if reference_duration and reference_duration >= 6:
                 if (
-                    len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]
-                    and (speech_ratio is None or speech_ratio < 0.15)
-                    and total_confident_duration < 0.6
+                    len(meaningful_tokens) < 2
+                    and len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"] * 2
                 ):
                     print(
-                        "❌ 检测到有效语音过少:",
+                        "❌ 有效词汇数量不足，判定为无意义内容:",
                         {
-                            "expected_duration": expected_duration,
-                            "total_confident_duration": total_confident_duration,
-                            "speech_ratio": speech_ratio,
-                            "avg_no_speech_prob": avg_no_speech_prob,
-                            "segments_count": len(segments),
+                            "tokens": tokens,
+                            "meaningful_tokens": meaningful_tokens,
+                            "duration": reference_duration,
                         },
                     )
-                    raise ValueError("未识别到有效内容，请说清楚一些")
-            
-            # 对长录音不再使用字符密度硬阈值，避免误杀真实内容
-
-            if reference_duration:
-                if has_cjk:
-                    # 中文场景：用汉字数量判断，避免“一个长词”被误判
-                    if (
-                        len(cjk_chars) < 3
-                        and len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"]
-                    ):
-                        print(
-                            "❌ 中文有效字符过少，判定为无意义内容:",
-                            {
-                                "cjk_chars": len(cjk_chars),
-                                "duration": reference_duration,
-                            },
-                        )
-                        raise ValueError("未识别到有效内容，请稍作表达后再试")
-                else:
-                    if (
-                        len(meaningful_tokens) < 2
-                        and len(normalized_text) < self.LENGTH_LIMITS["min_audio_text"] * 2
-                    ):
-                        print(
-                            "❌ 有效词汇数量不足，判定为无意义内容:",
-                            {
-                                "tokens": tokens,
-                                "meaningful_tokens": meaningful_tokens,
-                                "duration": reference_duration,
-                            },
-                        )
-                        raise ValueError("未识别到有效内容，请稍作表达后再试")
+                    raise ValueError("未识别到有效内容，请稍作表达后再试")
+        
+        print(f"✅ 语音识别成功: '{text[:50]}...'")
+        return text
+    
+    # ========================================================================
+    # 🔥 可单独调用的处理步骤（供语音日记阶段图按步骤并行调度）
+    # ========================================================================
+    
+    def detect_language(self, text: str) -> str:
+        """
+        检测用户输入的主要语言（"Chinese" / "English"）
+        
+        🔥 优化语言检测：更准确地识别用户输入的主要语言
+        """
+        import re
+        # 移除空白字符和标点，只统计实际内容字符
+        content_only = re.sub(r'[\s\W]', '', text)
+        chinese_chars = 0
+        english_words = 0
+        
+        if not content_only:
+            # 如果只有空白和标点，默认使用中文
+            detected_lang = "Chinese"
+        else:
+            # 统计中文字符
+            chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', content_only))
+            # 统计英文字符（单词）
+            english_words = len(re.findall(r'[a-zA-Z]+', content_only))
             
-            print(f"✅ 语音识别成功: '{text[:50]}...'")
-            return text
+            # 🔥 新增：检测韩语/日语字符
+            korean_chars = len(re.findall(r'[\uac00-\ud7af]', content_only))
+            japanese_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff]', content_only))
             
-        except Exception as e:
-            print(f"❌ 语音转文字失败: {str(e)}")
-            if "Invalid file format" in str(e):
-                raise ValueError("音频格式不支持，请使用 m4a 格式")
-            elif "File too large" in str(e):
-                raise ValueError("音频文件太大，请控制在 2 分钟内")
+            # 🔥 语言白名单检查：如果检测到大量非中英文字符，降级到系统默认语言
+            if korean_chars > 5 or japanese_chars > 5:
+                print(f"⚠️ 检测到非支持语言字符: 韩语={korean_chars}, 日语={japanese_chars}")
+                print(f"   内容: '{text[:50]}'")
+                print(f"   降级到系统默认语言: Chinese")
+                detected_lang = "Chinese"  # 降级到中文
             else:
-                raise ValueError(f"语音识别失败: {str(e)}")
+                # 计算中文字符占比
+                chinese_ratio = chinese_chars / len(content_only) if len(content_only) > 0 else 0
+                # 计算英文单词占比（每个单词平均5个字符估算）
+                english_ratio = (english_words * 5) / len(content_only) if len(content_only) > 0 else 0
+                
+                # 🔥 关键逻辑：如果中文字符占比超过30%，或者中文字符数量明显多于英文单词，判定为中文
+                # 这样可以避免"少量中文+大量英文"被误判为英文的情况
+                if chinese_ratio > 0.3 or (chinese_chars > 5 and chinese_chars > english_words * 2):
+                    detected_lang = "Chinese"
+                elif english_ratio > 0.5 or english_words > 10:
+                    detected_lang = "English"
+                else:
+                    # 默认：如果中文字符存在且数量>=3，判定为中文
+                    detected_lang = "Chinese" if chinese_chars >= 3 else "English"
         
-        finally:
-            # 清理临时文件
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    print(f"🧹 临时文件已清理")
-                except Exception as e:
-                    print(f"⚠️ 清理失败（不影响功能）: {e}")
+        print(f"🌍 检测到语言: {detected_lang} (中文字符={chinese_chars}, 英文单词={english_words})")
+        return detected_lang
+    
+    def compose_result(
+        self,
+        text: str,
+        polish_result: Optional[Dict[str, str]],
+        feedback_data: Any
+    ) -> Dict[str, Any]:
+        """
+        合并润色 + 标题与反馈的结果，并做质量检查
+        
+        任一步骤失败（传入 None）时使用降级结果
+        """
+        if polish_result is None or feedback_data is None:
+            return self._create_fallback_result(text)
+        
+        # 处理反馈结果 (兼容旧逻辑)
+        if isinstance(feedback_data, dict):
+            feedback_text = feedback_data.get("reply", "")
+            emotion_data = feedback_data
+        else:
+            feedback_text = str(feedback_data)
+            emotion_data = {"emotion": "Reflective", "confidence": 0.0}
+        
+        # 合并结果
+        result = {
+            "title": polish_result['title'],
+            "polished_content": polish_result['polished_content'],
+            "feedback": feedback_text,
+            "emotion_data": emotion_data # ✅ 新增情绪数据
+        }
+        
+        # 质量检查
+        return self._validate_and_fix_result(result, text)
     
     # ========================================================================
     # 🔥 核心改动：混合模型处理
@@ -388,7 +565,8 @@ class OpenAIService:
         self, 
         text: str,
         user_name: Optional[str] = None,  # 用户名字，用于个性化反馈
-        image_urls: Optional[List[str]] = None  # 图片URL列表，用于vision分析
+        image_urls: Optional[List[str]] = None,  # 图片URL列表，用于vision分析
+        user_id: Optional[str] = None  # 用于 AI 结果缓存的 DynamoDB 分区（可选）
     ) -> Dict[str, Any]:
         """
         🔥 重大改动：从单一模型改为混合模型 + 并行执行
@@ -413,49 +591,7 @@ class OpenAIService:
             
             print(f"✨ 开始AI处理（并行模式）: {text[:50]}...")
             
-            # 🔥 优化语言检测：更准确地识别用户输入的主要语言
-            import re
-            # 移除空白字符和标点，只统计实际内容字符
-            content_only = re.sub(r'[\s\W]', '', text)
-            chinese_chars = 0
-            english_words = 0
-            
-            if not content_only:
-                # 如果只有空白和标点，默认使用中文
-                detected_lang = "Chinese"
-            else:
-                # 统计中文字符
-                chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', content_only))
-                # 统计英文字符（单词）
-                english_words = len(re.findall(r'[a-zA-Z]+', content_only))
-                
-                # 🔥 新增：检测韩语/日语字符
-                korean_chars = len(re.findall(r'[\uac00-\ud7af]', content_only))
-                japanese_chars = len(re.findall(r'[\u3040-\u309f\u30a0-\u30ff]', content_only))
-                
-                # 🔥 语言白名单检查：如果检测到大量非中英文字符，降级到系统默认语言
-                if korean_chars > 5 or japanese_chars > 5:
-                    print(f"⚠️ 检测到非支持语言字符: 韩语={korean_chars}, 日语={japanese_chars}")
-                    print(f"   内容: '{text[:50]}'")
-                    print(f"   降级到系统默认语言: Chinese")
-                    detected_lang = "Chinese"  # 降级到中文
-                else:
-                    # 计算中文字符占比
-                    chinese_ratio = chinese_chars / len(content_only) if len(content_only) > 0 else 0
-                    # 计算英文单词占比（每个单词平均5个字符估算）
-                    english_ratio = (english_words * 5) / len(content_only) if len(content_only) > 0 else 0
-                    
-                    # 🔥 关键逻辑：如果中文字符占比超过30%，或者中文字符数量明显多于英文单词，判定为中文
-                    # 这样可以避免"少量中文+大量英文"被误判为英文的情况
-                    if chinese_ratio > 0.3 or (chinese_chars > 5 and chinese_chars > english_words * 2):
-                        detected_lang = "Chinese"
-                    elif english_ratio > 0.5 or english_words > 10:
-                        detected_lang = "English"
-                    else:
-                        # 默认：如果中文字符存在且数量>=3，判定为中文
-                        detected_lang = "Chinese" if chinese_chars >= 3 else "English"
-            
-            print(f"🌍 检测到语言: {detected_lang} (中文字符={chinese_chars}, 英文单词={english_words})")
+            detected_lang = self.detect_language(text)
             
             # 🔥 关键改动：并行执行两个任务
             print(f"🚀 启动并行处理...")
@@ -478,8 +614,12 @@ class OpenAIService:
                         encoded_images.append(img_data)
             
             # 创建两个异步任务
-            polish_task = self._call_gpt4o_mini_for_polish_and_title(text, detected_lang, encoded_images)
-            feedback_task = self._call_gpt4o_mini_for_feedback(text, detected_lang, user_name, encoded_images)
+            polish_task = self._call_gpt4o_mini_for_polish_and_title(
+                text, detected_lang, encoded_images, user_id=user_id
+            )
+            feedback_task = self._call_gpt4o_mini_for_feedback(
+                text, detected_lang, user_name, encoded_images, user_id=user_id
+            )
             
             # 并行执行并等待结果
             polish_result, feedback_data = await asyncio.gather(
@@ -489,24 +629,8 @@ class OpenAIService:
             
             print(f"✅ 并行处理完成")
             
-            # 处理反馈结果 (兼容旧逻辑)
-            if isinstance(feedback_data, dict):
-                feedback_text = feedback_data.get("reply", "")
-                emotion_data = feedback_data
-            else:
-                feedback_text = str(feedback_data)
-                emotion_data = {"emotion": "Reflective", "confidence": 0.0}
-            
-            # 合并结果
-            result = {
-                "title": polish_result['title'],
-                "polished_content": polish_result['polished_content'],
-                "feedback": feedback_text,
-                "emotion_data": emotion_data # ✅ 新增情绪数据
-            }
-            
-            # 质量检查
-            result = self._validate_and_fix_result(result, text)
+            # 合并结果 + 质量检查
+            result = self.compose_result(text, polish_result, feedback_data)
             
             print(f"✅ 处理完成:")
             print(f"  - 标题: {result['title']}")
@@ -541,7 +665,35 @@ class OpenAIService:
         self, 
         text: str,
         language: str,
-        encoded_images: Optional[List[str]] = None
+        encoded_images: Optional[List[str]] = None,
+        user_id: Optional[str] = None,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Dict[str, str]:
+        """
+        润色 + 标题（先查 AI 结果缓存，未命中再调用模型）
+
+        提供 on_partial 时流式生成，title / polished_content 每增长一次回调一次（值为本次新增的文本）
+        """
+        cache = get_ai_result_cache()
+        key = cache.make_key(
+            "polish", self.MODEL_CONFIG["haiku"], self.PROMPT_VERSION, text, language,
+            encoded_images=encoded_images
+        )
+        cached = await cache.get(key, user_id=user_id)
+        if cached is not None:
+            print(f"⚡ AI 结果缓存命中（润色）")
+            emit_cached_partial(on_partial, cached, self.POLISH_PARTIAL_FIELDS)
+            return cached
+        result = await self._request_polish_and_title(text, language, encoded_images, on_partial=on_partial)
+        await cache.set(key, result, user_id=user_id)
+        return result
+    
+    async def _request_polish_and_title(
+        self, 
+        text: str,
+        language: str,
+        encoded_images: Optional[List[str]] = None,
+        on_partial: Optional[PartialCallback] = None
     ) -> Dict[str, str]:
         """
         调用 GPT-4o-mini 进行润色和生成标题
@@ -834,18 +986,17 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
                     {"role": "user", "content": user_prompt}
                 ]
             
-            # 使用 OpenAI client（已经在 __init__ 中初始化）
-            response = await asyncio.to_thread(
-                self.openai_client.chat.completions.create,
+            # 异步 OpenAI client（共享连接池）
+            content = await self._complete_json(
+                on_partial,
+                self.POLISH_PARTIAL_FIELDS,
                 model=self.MODEL_CONFIG["haiku"],
                 messages=messages,
                 temperature=0.3,
-                max_tokens=max_tokens,
-                response_format={"type": "json_object"}  # 强制 JSON 格式
+                max_tokens=max_tokens
             )
             
             # 解析响应
-            content = response.choices[0].message.content
             if not content:
                 raise ValueError("OpenAI 返回空响应")
             
@@ -855,7 +1006,7 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
             # 解析 JSON
             try:
                 result = json.loads(content)
-                polished_content = result.get("polished_content", text)
+                polished_content = result.get("polished_content") or text
                 
                 # ✅ 添加长度对比日志，检查是否被截断
                 original_length = len(text)
@@ -870,9 +1021,18 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
                     print(f"⚠️ 警告：润色后内容明显少于原始内容，可能被截断！")
                     print(f"   原始内容前100字符: {text[:100]}...")
                     print(f"   润色后内容前100字符: {polished_content[:100]}...")
-                    # 如果确实被截断，使用原始内容作为降级方案
-                    polished_content = text
+                    # 如果确实被截断，使用原始内容作为降级方案（降级结果不写入缓存）
                     print(f"   使用原始内容作为降级方案")
+                    return FallbackResult({
+                        "title": result.get("title", "Today's Reflection"),
+                        "polished_content": text
+                    })
+                if not result.get("polished_content"):
+                    # 响应缺少润色内容：同样按降级处理，下次请求重新生成
+                    return FallbackResult({
+                        "title": result.get("title", "Today's Reflection"),
+                        "polished_content": text
+                    })
                 
                 return {
                     "title": result.get("title", "Today's Reflection"),
@@ -887,19 +1047,20 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
                 if json_match:
                     try:
                         result = json.loads(json_match.group())
-                        return {
+                        # 从格式不正确的响应中抽取的结果只用于本次请求，不写入缓存
+                        return FallbackResult({
                             "title": result.get("title", "Today's Reflection"),
                             "polished_content": result.get("polished_content", text)
-                        }
+                        })
                     except:
                         pass
                 
                 # 降级方案
                 print(f"⚠️ GPT-4o-mini: 使用降级方案")
-                return {
+                return FallbackResult({
                     "title": "Today's Reflection" if language == "English" else "今日记录",
                     "polished_content": text
-                }
+                })
         
         except Exception as e:
             error_type = type(e).__name__
@@ -922,10 +1083,10 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
                 print(f"⚠️ OpenAI API 连接错误: 请检查网络连接")
             
             # 降级方案
-            return {
+            return FallbackResult({
                 "title": "Today's Reflection" if language == "English" else "今日记录",
                 "polished_content": text
-            }
+            })
     
     # ========================================================================
     # 🔥 GPT-4o-mini 调用（AI 反馈）
@@ -936,7 +1097,36 @@ Output: {{"title": "A Visit to the Park", "polished_content": "I went to 公园
         text: str,
         language: str,
         user_name: Optional[str] = None,
-        encoded_images: Optional[List[str]] = None
+        encoded_images: Optional[List[str]] = None,
+        user_id: Optional[str] = None,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        AI 反馈 + 情绪分析（先查 AI 结果缓存，未命中再调用模型）
+
+        提供 on_partial 时流式生成，reply 每增长一次回调一次
+        """
+        cache = get_ai_result_cache()
+        key = cache.make_key(
+            "feedback", self.MODEL_CONFIG["sonnet"], self.PROMPT_VERSION, text, language,
+            user_name=user_name, encoded_images=encoded_images
+        )
+        cached = await cache.get(key, user_id=user_id)
+        if cached is not None:
+            print(f"⚡ AI 结果缓存命中（反馈）")
+            emit_cached_partial(on_partial, cached, self.FEEDBACK_PARTIAL_FIELDS)
+            return cached
+        result = await self._request_feedback(text, language, user_name, encoded_images, on_partial=on_partial)
+        await cache.set(key, result, user_id=user_id)
+        return result
+    
+    async def _request_feedback(
+        self, 
+        text: str,
+        language: str,
+        user_name: Optional[str] = None,
+        encoded_images: Optional[List[str]] = None,
+        on_partial: Optional[PartialCallback] = None
     ) -> Dict[str, Any]:
         """
         调用 GPT-4o-mini 生成温暖的 AI 反馈 + 情绪分析
@@ -1050,16 +1240,15 @@ Response format (JSON ONLY):
             estimated_output_length = max_feedback_length + 200 
             max_tokens = max(300, min(estimated_output_length, 1000))
 
-            response = await asyncio.to_thread(
-                self.openai_client.chat.completions.create,
+            content = await self._complete_json(
+                on_partial,
+                self.FEEDBACK_PARTIAL_FIELDS,
                 model=self.MODEL_CONFIG["sonnet"], # 继续使用配置好的模型
                 messages=messages,
                 temperature=0.7,
-                max_tokens=max_tokens,
-                response_format={"type": "json_object"}
+                max_tokens=max_tokens
             )
 
-            content = response.choices[0].message.content
             if not content:
                 raise ValueError("OpenAI 返回空响应")
 
@@ -1088,22 +1277,23 @@ Response format (JSON ONLY):
                 
             except json.JSONDecodeError:
                 print("⚠️ JSON 解析失败，回退到纯文本处理")
-                return {
+                # 降级结果：不写入缓存
+                return FallbackResult({
                     "reply": content.strip(),
                     "emotion": "Reflective", 
                     "confidence": 0.5,
                     "rationale": "Extracted from non-JSON response"
-                }
+                })
         
         except Exception as e:
             print(f"❌ 反馈生成失败: {e}")
             fallback_reply = "感谢分享你的这一刻。" if language == "Chinese" else "Thanks for sharing this moment."
-            return {
+            return FallbackResult({
                 "reply": fallback_reply,
                 "emotion": "Reflective",
                 "confidence": 0.0,
                 "rationale": "Fallback due to error"
-            }
+            })
     
     # ========================================================================
     # 验证和降级逻辑（保持不变）
@@ -1385,8 +1575,8 @@ Response format (JSON ONLY):
         try:
             print(f"📥 下载图片: {image_url[:50]}...")
             
-            # 下载图片
-            response = await asyncio.to_thread(requests.get, image_url, timeout=10)
+            # 下载图片（共享 httpx 连接池）
+            response = await get_http_client().get(image_url, timeout=10)
             response.raise_for_status()
             
             # 转换为base64
@@ -1399,10 +1589,16 @@ Response format (JSON ONLY):
             print(f"❌ 下载图片失败: {e}")
             raise
 
+@lru_cache()
+def get_openai_service() -> OpenAIService:
+    """获取 AI 服务实例（单例模式，进程内共享连接池）"""
+    return OpenAIService()
+
+
 # 🎯 使用示例
 """
 # 1. 初始化服务
-service = OpenAIService()
+service = get_openai_service()
 
 # 2. 语音转文字（Whisper）
 text = await service.transcribe_audio(audio_bytes, "recording.m4a")
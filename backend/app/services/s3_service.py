@@ -74,6 +74,44 @@ class S3Service:
         except Exception as e:
             print(f"❌ S3上传失败: {str(e)}")
             raise
+
+    def upload_audio_file(
+        self,
+        fileobj: BinaryIO,
+        file_name: str,
+        content_type: str = 'audio/m4a'
+    ) -> str:
+        """
+        以流的方式上传音频文件到S3（不把整段音频读入内存）
+
+        参数:
+            fileobj: 以二进制模式打开的文件对象（由调用方关闭）
+            file_name: 原始文件名（如：recording.m4a）
+            content_type: 文件类型（默认audio/m4a）
+
+        返回:
+            S3文件的公开URL
+        """
+        unique_id = str(uuid.uuid4())[:8]
+        s3_key = f"audio/{unique_id}-{file_name}"
+
+        try:
+            # upload_fileobj 分块读取，大文件自动走分段上传
+            self.s3_client.upload_fileobj(
+                fileobj,
+                self.bucket_name,
+                s3_key,
+                ExtraArgs={'ContentType': content_type}
+            )
+
+            url = f"https://{self.bucket_name}.s3.amazonaws.com/{s3_key}"
+
+            print(f"✅ 文件上传成功: {url}")
+            return url
+
+        except Exception as e:
+            print(f"❌ S3上传失败: {str(e)}")
+            raise
     def upload_image(
         self,
         file_content: bytes,
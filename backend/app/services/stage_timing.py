@@ -0,0 +1,71 @@
+"""
+处理阶段耗时统计服务
+
+负责:
+- 按阶段记录语音日记流水线的真实耗时（滚动窗口）
+- 为流水线估算剩余时间（ETA）提供各阶段的预估耗时，随进度一起下发给客户端
+- 客户端据此平滑播放进度动画，服务端不再为"让进度条动起来"而等待
+"""
+
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, Optional
+
+
+# 尚无样本时各阶段的默认预估耗时（毫秒）
+DEFAULT_STAGE_MS = {
+    "validate_audio": 10,
+    "upload": 1500,
+    "transcribe": 4000,
+    "release_audio": 0,
+    "validate_transcript": 5,
+    "polish": 3000,
+    "feedback": 4000,
+    "wait_images": 0,
+    "save": 300,
+}
+
+
+class StageTimingHistogram:
+    """每个阶段保留最近 window 次耗时，按百分位给出预估值"""
+
+    def __init__(self, window: int = 200, defaults: Optional[Dict[str, float]] = None):
+        self.window = window
+        self.defaults = dict(DEFAULT_STAGE_MS if defaults is None else defaults)
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, duration_ms: float) -> None:
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(max(duration_ms, 0.0))
+
+    def expected_ms(self, stage: str, percentile: float = 50) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples:
+            return float(self.defaults.get(stage, 0))
+        index = min(int(len(samples) * percentile / 100), len(samples) - 1)
+        return samples[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """各阶段样本数与 p50 / p90（毫秒），用于 /health"""
+        with self._lock:
+            stages = list(self._samples)
+        return {
+            stage: {
+                "count": len(self._samples[stage]),
+                "p50_ms": round(self.expected_ms(stage, 50)),
+                "p90_ms": round(self.expected_ms(stage, 90)),
+            }
+            for stage in stages
+        }
+
+
+@lru_cache()
+def get_stage_timings() -> StageTimingHistogram:
+    """获取阶段耗时统计（单例模式，进程内共享）"""
+    return StageTimingHistogram()
@@ -0,0 +1,111 @@
+"""
+任务变更通知服务
+
+负责:
+- 进程内的按任务变更通知（任务存储写入后唤醒等待者）
+- 长轮询 / SSE 的"等待版本变化"逻辑
+- 定期回查任务存储，兼容由其他实例写入的变更（共享 SQLite / Redis 后端）
+"""
+
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Set
+
+from .task_store import TaskStore, get_task_store
+
+# 终态：到达后不会再有变化，等待者立即返回
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class TaskChangeNotifier:
+    """按 task_id 唤醒等待中的协程（可从任意线程调用 notify）"""
+
+    def __init__(self):
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    def notify(self, task_id: str) -> None:
+        with self._lock:
+            waiters = self._waiters.pop(task_id, set())
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(self._wake, future)
+
+    @staticmethod
+    def _wake(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(True)
+
+    def subscribe(self, task_id: str) -> asyncio.Future:
+        """登记一个等待者；先登记再读取存储，避免两者之间的变更被漏掉"""
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.setdefault(task_id, set()).add(future)
+        return future
+
+    def unsubscribe(self, task_id: str, future: asyncio.Future) -> None:
+        with self._lock:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    self._waiters.pop(task_id, None)
+
+    async def wait(self, task_id: str, timeout: float) -> bool:
+        """等待任务的下一次变更；在超时前被唤醒返回 True"""
+        future = self.subscribe(task_id)
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.unsubscribe(task_id, future)
+
+    def waiter_count(self) -> int:
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+
+async def wait_for_task_change(
+    store: TaskStore,
+    notifier: TaskChangeNotifier,
+    task_id: str,
+    known_version: Optional[int],
+    timeout: float,
+    recheck_interval: float = 1.0
+) -> Optional[Dict]:
+    """
+    等待任务版本不同于 known_version（或进入终态），返回最新的任务数据
+
+    超时返回当前数据（版本可能未变）；任务不存在返回 None。
+    本实例的写入通过 notifier 立即唤醒，其他实例的写入靠每 recheck_interval 秒回查存储发现。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        future = notifier.subscribe(task_id)
+        try:
+            task = await store.aget(task_id)
+            if task is None:
+                return None
+            if task.get("version") != known_version or task.get("status") in TERMINAL_STATUSES:
+                return task
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return task
+            try:
+                await asyncio.wait_for(future, timeout=min(remaining, recheck_interval))
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            notifier.unsubscribe(task_id, future)
+
+
+@lru_cache()
+def get_task_notifier() -> TaskChangeNotifier:
+    """获取任务变更通知器（单例模式，注册为任务存储的监听器）"""
+    notifier = TaskChangeNotifier()
+    get_task_store().add_listener(notifier.notify)
+    return notifier
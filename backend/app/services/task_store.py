@@ -0,0 +1,573 @@
+"""
+任务进度存储服务
+
+负责:
+- 异步语音任务的进度存储（替代路由模块中的进程内字典）
+- 可插拔后端：进程内内存 / 本地 SQLite 文件 / Redis 协议
+- 多个 uvicorn worker 或 Lambda 实例共享同一后端时，轮询和补充图片可以落在任意实例上
+"""
+
+import asyncio
+import functools
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..config import get_settings
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+def _matches(task: Dict[str, Any], expected: Optional[Dict[str, Any]]) -> bool:
+    """expected 中的字段是否与任务当前值全部相等（按 JSON 往返后的值比较）"""
+    if not expected:
+        return True
+    return all(task.get(field) == value for field, value in json.loads(dumps(expected)).items())
+
+
+class TaskStore:
+    """
+    任务存储接口
+
+    - get: 读取任务，不存在或已过期返回 None
+    - update: 合并写入字段；任务不存在时以 defaults 为初始值创建，defaults 为 None 则不写入并返回 None；
+      提供 expected 时只在任务存在且这些字段的当前值全部相等时写入（检查与写入原子完成），否则返回 None
+    - delete: 删除任务
+    - purge_expired: 清理过期任务
+
+    过期时间在每次写入时按状态计算：处理中的任务使用较短的 processing_ttl_seconds
+    （卡住、不再更新的任务会尽快被清理），完成/失败的任务使用 ttl_seconds
+
+    每次写入任务的 version 加 1，并通知已注册的监听器（用于长轮询 / SSE 推送）；
+    各后端实现 _update / _delete
+
+    aget / aupdate / acreate / adelete 供异步代码使用：SQLite / Redis 的调用会阻塞，
+    转到线程池执行，不占用事件循环（BLOCKING = False 的后端直接调用）
+    """
+
+    # 读写是否涉及阻塞 I/O
+    BLOCKING = True
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        clock: Callable[[], float] = time.time,
+        processing_ttl_seconds: Optional[float] = None
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.processing_ttl_seconds = processing_ttl_seconds or ttl_seconds
+        self._clock = clock
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """注册变更监听器，任务每次写入或删除后以 task_id 调用"""
+        self._listeners.append(listener)
+
+    def _notify(self, task_id: str) -> None:
+        for listener in self._listeners:
+            try:
+                listener(task_id)
+            except Exception as e:
+                print(f"⚠️ 任务变更通知失败: {e}")
+
+    def _ttl_for(self, task: Dict[str, Any]) -> float:
+        if task.get("status", "processing") == "processing":
+            return self.processing_ttl_seconds
+        return self.ttl_seconds
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]] = None,
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        if expected is not None:
+            defaults = None
+        task = self._update(task_id, fields, defaults, expected)
+        if task is not None:
+            self._notify(task_id)
+        return task
+
+    def create(self, task_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """创建（或覆盖）任务"""
+        self._delete(task_id)
+        return self.update(task_id, data, defaults={})
+
+    def delete(self, task_id: str) -> None:
+        self._delete(task_id)
+        self._notify(task_id)
+
+    async def _run(self, method: Callable[..., Any], *args: Any) -> Any:
+        if not self.BLOCKING:
+            return method(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args))
+
+    async def aget(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self.get, task_id)
+
+    async def aupdate(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]] = None,
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        return await self._run(self.update, task_id, fields, defaults, expected)
+
+    async def acreate(self, task_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._run(self.create, task_id, data)
+
+    async def adelete(self, task_id: str) -> None:
+        await self._run(self.delete, task_id)
+
+    def _update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]],
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _delete(self, task_id: str) -> None:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__}
+
+
+class InMemoryTaskStore(TaskStore):
+    """
+    进程内存储（单实例 / 本地开发）
+
+    - 过期索引为按截止时间排序的最小堆，条目更新时压入新版本，旧堆节点惰性作废
+    - 每次写入顺带弹出少量已到期节点（摊还 O(log n)），读取时也会检查过期
+    - 任务数 / 字节数超过上限时，优先淘汰最早到期的任务
+    """
+
+    # 只操作内存，异步调用无需转到线程池
+    BLOCKING = False
+
+    # 每次写入时最多顺带清理的到期节点数
+    PURGE_BATCH = 32
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        clock: Callable[[], float] = time.time,
+        processing_ttl_seconds: Optional[float] = None,
+        max_tasks: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024
+    ):
+        super().__init__(ttl_seconds, clock, processing_ttl_seconds)
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        # task_id -> (版本号, 截止时间, 字节数, 任务数据)
+        self._tasks: Dict[str, Tuple[int, float, int, Dict[str, Any]]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._version = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return None
+            if entry[1] <= self._clock():
+                self._remove(task_id)
+                self.expired += 1
+                return None
+            # 返回 JSON 往返后的副本，与共享后端的行为保持一致（调用方修改不会影响存储）
+            return json.loads(dumps(entry[3]))
+
+    def _update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]],
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = self._clock()
+            entry = self._tasks.get(task_id)
+            if entry is not None and entry[1] <= now:
+                self._remove(task_id)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                if defaults is None:
+                    return None
+                task = json.loads(dumps(defaults))
+            else:
+                if not _matches(entry[3], expected):
+                    return None
+                task = entry[3]
+                self._remove(task_id)
+
+            task.update(json.loads(dumps(fields)))
+            task["version"] = int(task.get("version") or 0) + 1
+            serialized = dumps(task)
+            size = len(serialized.encode("utf-8"))
+            expires_at = now + self._ttl_for(task)
+
+            self._version += 1
+            self._tasks[task_id] = (self._version, expires_at, size, task)
+            self._bytes += size
+            heapq.heappush(self._heap, (expires_at, self._version, task_id))
+
+            self._purge_locked(now, self.PURGE_BATCH)
+            self._enforce_limits_locked(keep=task_id)
+            return json.loads(serialized)
+
+    def _delete(self, task_id: str) -> None:
+        with self._lock:
+            self._remove(task_id)
+
+    def _remove(self, task_id: str) -> None:
+        entry = self._tasks.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _is_live(self, version: int, task_id: str) -> bool:
+        entry = self._tasks.get(task_id)
+        return entry is not None and entry[0] == version
+
+    def _purge_locked(self, now: float, limit: Optional[int] = None) -> int:
+        """弹出到期的堆节点；版本不匹配的节点（任务已更新或删除）直接丢弃"""
+        purged = 0
+        popped = 0
+        while self._heap and self._heap[0][0] <= now:
+            if limit is not None and popped >= limit:
+                break
+            _, version, task_id = heapq.heappop(self._heap)
+            popped += 1
+            if self._is_live(version, task_id):
+                self._remove(task_id)
+                self.expired += 1
+                purged += 1
+
+        # 作废节点过多时重建堆，避免堆无限增长
+        if len(self._heap) > 2 * len(self._tasks) + 64:
+            self._heap = [
+                (expires_at, version, task_id)
+                for task_id, (version, expires_at, _, _) in self._tasks.items()
+            ]
+            heapq.heapify(self._heap)
+        return purged
+
+    def _enforce_limits_locked(self, keep: str) -> None:
+        """超过任务数 / 字节上限时，按到期顺序淘汰（刚写入的任务除外）"""
+        skipped = []
+        while self._heap and (len(self._tasks) > self.max_tasks or self._bytes > self.max_bytes):
+            node = heapq.heappop(self._heap)
+            _, version, task_id = node
+            if not self._is_live(version, task_id):
+                continue
+            if task_id == keep:
+                skipped.append(node)
+                continue
+            self._remove(task_id)
+            self.evictions += 1
+        for node in skipped:
+            heapq.heappush(self._heap, node)
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_locked(self._clock())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "tasks": len(self._tasks),
+                "bytes": self._bytes,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    本地 SQLite 文件存储
+
+    同一台机器上的多个 uvicorn worker 共享同一个文件即可共享任务进度
+    """
+
+    # 每写入多少次顺带清理一次过期任务（expires_at 有索引，只触及到期行）
+    PURGE_EVERY_WRITES = 100
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float = 3600,
+        clock: Callable[[], float] = time.time,
+        processing_ttl_seconds: Optional[float] = None
+    ):
+        super().__init__(ttl_seconds, clock, processing_ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_expires_at ON tasks (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：手动控制事务（BEGIN IMMEDIATE 保证读-改-写的原子性）
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE ... COMMIT（异常时回滚），写操作在事务内完成"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?",
+            (task_id, self._clock())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]],
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        now = self._clock()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?",
+                (task_id, now)
+            ).fetchone()
+            if row:
+                task = json.loads(row[0])
+                if not _matches(task, expected):
+                    return None
+            elif defaults is not None:
+                task = json.loads(dumps(defaults))
+            else:
+                return None
+
+            task.update(json.loads(dumps(fields)))
+            task["version"] = int(task.get("version") or 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, data, expires_at) VALUES (?, ?, ?)",
+                (task_id, dumps(task), now + self._ttl_for(task))
+            )
+
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY_WRITES == 0:
+            self.purge_expired()
+        return task
+
+    def _delete(self, task_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def purge_expired(self) -> int:
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM tasks WHERE expires_at <= ?", (self._clock(),))
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM tasks WHERE expires_at > ?",
+            (self._clock(),)
+        ).fetchone()
+        return {"backend": "sqlite", "tasks": row[0], "bytes": row[1]}
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Redis 协议存储（多实例 / Lambda 共享）
+
+    每个任务是一个 Hash，字段值为 JSON；HSET 按字段合并，过期交给 Redis 的 EXPIRE
+
+    更新由 Lua 脚本在服务端原子执行（存在性检查、条件检查、写入默认值、合并字段、递增版本、
+    按状态设置过期时间、读回任务），并发更新不会交错，不存在的任务也不会被半途创建
+    """
+
+    KEY_PREFIX = "task:"
+
+    # KEYS[1]: 任务键
+    # ARGV: ttl, processing_ttl, 是否允许创建('1'/'0'), 默认值个数 n, 条件字段个数 m,
+    #       n 对默认值, m 对条件字段（JSON 值须与当前值完全相同）, 其余为要合并的字段对
+    UPDATE_SCRIPT = """
+local key = KEYS[1]
+local n_defaults = tonumber(ARGV[4])
+local n_expected = tonumber(ARGV[5])
+local i = 6
+if redis.call('EXISTS', key) == 0 then
+    if ARGV[3] ~= '1' then
+        return false
+    end
+    for _ = 1, n_defaults do
+        redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+        i = i + 2
+    end
+    i = i + 2 * n_expected
+else
+    i = i + 2 * n_defaults
+    for _ = 1, n_expected do
+        if redis.call('HGET', key, ARGV[i]) ~= ARGV[i + 1] then
+            return false
+        end
+        i = i + 2
+    end
+end
+while i < #ARGV do
+    redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+    i = i + 2
+end
+redis.call('HINCRBY', key, 'version', 1)
+local status = redis.call('HGET', key, 'status')
+local ttl = ARGV[1]
+if not status or status == '"processing"' then
+    ttl = ARGV[2]
+end
+redis.call('EXPIRE', key, ttl)
+return redis.call('HGETALL', key)
+"""
+
+    def __init__(
+        self,
+        client: Any = None,
+        url: str = "",
+        ttl_seconds: float = 3600,
+        processing_ttl_seconds: Optional[float] = None
+    ):
+        super().__init__(ttl_seconds, processing_ttl_seconds=processing_ttl_seconds)
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise RuntimeError("使用 Redis 任务存储需要安装 redis 包") from exc
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self._update_script = client.register_script(self.UPDATE_SCRIPT)
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.KEY_PREFIX}{task_id}"
+
+    @staticmethod
+    def _decode(raw: Dict[Any, Any]) -> Dict[str, Any]:
+        task = {}
+        for field, value in raw.items():
+            if isinstance(field, bytes):
+                field = field.decode("utf-8")
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            task[field] = json.loads(value)
+        return task
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.hgetall(self._key(task_id))
+        return self._decode(raw) if raw else None
+
+    def _update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        defaults: Optional[Dict[str, Any]],
+        expected: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        args: List[Any] = [
+            int(self.ttl_seconds),
+            int(self.processing_ttl_seconds),
+            "0" if defaults is None else "1",
+            len(defaults or {}),
+            len(expected or {}),
+        ]
+        for mapping in (defaults or {}, expected or {}, fields):
+            for field, value in mapping.items():
+                args.extend((field, dumps(value)))
+
+        raw = self._update_script(keys=[self._key(task_id)], args=args)
+        if not raw:
+            return None
+        # HGETALL 在脚本中返回扁平列表 [field, value, ...]
+        return self._decode(dict(zip(raw[::2], raw[1::2])))
+
+    def _delete(self, task_id: str) -> None:
+        self.client.delete(self._key(task_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis"}
+
+
+@lru_cache()
+def get_task_store() -> TaskStore:
+    """获取任务存储（单例模式，按配置选择后端）"""
+    settings = get_settings()
+    backend = (settings.task_store_backend or "memory").lower()
+    ttl = settings.task_ttl_seconds
+    processing_ttl = settings.task_processing_ttl_seconds
+
+    if backend == "sqlite":
+        print(f"🗂️ 任务存储: SQLite ({settings.task_store_sqlite_path})")
+        return SQLiteTaskStore(
+            settings.task_store_sqlite_path,
+            ttl_seconds=ttl,
+            processing_ttl_seconds=processing_ttl
+        )
+    if backend == "redis":
+        print(f"🗂️ 任务存储: Redis")
+        return RedisTaskStore(
+            url=settings.task_store_redis_url,
+            ttl_seconds=ttl,
+            processing_ttl_seconds=processing_ttl
+        )
+
+    print(f"🗂️ 任务存储: 内存")
+    return InMemoryTaskStore(
+        ttl_seconds=ttl,
+        processing_ttl_seconds=processing_ttl,
+        max_tasks=settings.task_store_max_tasks,
+        max_bytes=settings.task_store_max_bytes
+    )
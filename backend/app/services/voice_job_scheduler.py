@@ -0,0 +1,223 @@
+"""
+语音处理任务调度服务
+
+负责:
+- 限制同时运行的后台语音处理数量（每个任务持有整段音频并调用 Whisper + GPT）
+- 排队总量封顶，满载时拒绝并给出建议重试时间（路由层返回 429 / Retry-After）
+- 按用户轮转出队，单个用户的突发上传不会挤占其他用户
+- 记录排队等待时间，由回调写入任务进度
+- 取消排队中或运行中的任务
+"""
+
+import asyncio
+import inspect
+import math
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Awaitable, Callable, Deque, Dict, Optional, Union
+
+from ..config import get_settings
+
+
+class QueueFullError(Exception):
+    """排队已满（全局或单个用户），retry_after 为建议的重试秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobCancelledError(Exception):
+    """任务已被请求取消（由其他实例发起，本实例在下一次进度写入时发现）"""
+
+
+@dataclass
+class _Job:
+    job_id: str
+    user_id: str
+    # 零参数工厂：协程延迟到真正开始运行时才创建，排队中被移除时不会留下未 await 的协程
+    factory: Callable[[], Awaitable]
+    # 开始运行时以排队毫秒数调用；返回 awaitable 时在任务中等待其完成后再运行 factory
+    on_start: Optional[Callable[[float], Union[None, Awaitable[None]]]]
+    enqueued_at: float = field(default=0.0)
+
+
+class VoiceJobScheduler:
+    """
+    有界的 asyncio 任务调度器（单事件循环内使用）
+
+    - max_concurrency: 同时运行的任务数上限
+    - max_queue: 等待中的任务总数上限
+    - max_queue_per_user: 单个用户等待中的任务数上限
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 50,
+        max_queue_per_user: int = 5,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_user = max(1, max_queue_per_user)
+        self._clock = clock
+        # user_id -> 该用户的等待队列；OrderedDict 的顺序即轮转顺序
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queued = 0
+        self._running: Dict[str, asyncio.Task] = {}
+        # 任务平均耗时（指数滑动平均），用于估算 Retry-After
+        self._avg_job_seconds = 10.0
+        self._rejected = 0
+
+    # ------------------------------------------------------------------
+    # 提交 / 出队
+    # ------------------------------------------------------------------
+
+    def submit(
+        self,
+        job_id: str,
+        user_id: str,
+        factory: Callable[[], Awaitable],
+        on_start: Optional[Callable[[float], Union[None, Awaitable[None]]]] = None
+    ) -> int:
+        """
+        提交任务；有空闲并发时立即开始，否则排队
+
+        返回按用户轮转计算的排队位置（1 表示下一个出队，0 表示已开始运行）；排队已满抛出 QueueFullError
+        """
+        if len(self._running) >= self.max_concurrency or self._queued:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise QueueFullError("处理队列已满，请稍后重试", self.retry_after())
+            user_queue = self._queues.get(user_id)
+            if user_queue is not None and len(user_queue) >= self.max_queue_per_user:
+                self._rejected += 1
+                raise QueueFullError("你提交的任务过多，请稍后重试", self.retry_after())
+
+        job = _Job(job_id, user_id, factory, on_start, enqueued_at=self._clock())
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        self._pump()
+        return 0 if job_id in self._running else self.position(job_id)
+
+    def position(self, job_id: str) -> int:
+        """
+        排队中任务的出队顺位（从 1 开始）；不在队列中返回 0
+
+        按轮转模拟：每一轮按用户顺序各出队一个任务。该任务是其用户的第 i 个（从 0 开始）时，
+        排在它前面的是前 i 轮中仍有任务的用户各一个，加上第 i 轮中排在其用户之前、且至少有 i + 1 个任务的用户
+        """
+        for user_index, user_queue in enumerate(self._queues.values()):
+            for job_index, job in enumerate(user_queue):
+                if job.job_id != job_id:
+                    continue
+                ahead = 0
+                for other_index, other_queue in enumerate(self._queues.values()):
+                    ahead += min(len(other_queue), job_index)
+                    if other_index < user_index and len(other_queue) > job_index:
+                        ahead += 1
+                return ahead + 1
+        return 0
+
+    def _next_job(self) -> Optional[_Job]:
+        """按用户轮转取下一个任务：取队首用户的一个任务，该用户若仍有任务则移到队尾"""
+        while self._queues:
+            user_id, user_queue = next(iter(self._queues.items()))
+            if not user_queue:
+                self._queues.pop(user_id)
+                continue
+            job = user_queue.popleft()
+            self._queued -= 1
+            if user_queue:
+                self._queues.move_to_end(user_id)
+            else:
+                self._queues.pop(user_id)
+            return job
+        return None
+
+    def _pump(self) -> None:
+        while len(self._running) < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            self._start(job)
+
+    def _start(self, job: _Job) -> None:
+        started_at = self._clock()
+        task = asyncio.get_running_loop().create_task(
+            self._run_job(job, (started_at - job.enqueued_at) * 1000)
+        )
+        self._running[job.job_id] = task
+        task.add_done_callback(lambda done: self._on_done(job.job_id, started_at, done))
+
+    @staticmethod
+    async def _run_job(job: _Job, queue_wait_ms: float) -> None:
+        if job.on_start is not None:
+            try:
+                result = job.on_start(queue_wait_ms)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"⚠️ 任务开始回调失败: {job.job_id} - {e}")
+        await job.factory()
+
+    def _on_done(self, job_id: str, started_at: float, task: asyncio.Task) -> None:
+        self._running.pop(job_id, None)
+        elapsed = self._clock() - started_at
+        self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ 后台任务异常退出: {job_id} - {task.exception()}")
+        self._pump()
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        取消任务：排队中的直接移出队列，运行中的取消其 asyncio 任务
+
+        返回 "queued" / "running"；任务不在本调度器中（已结束或在其他实例）返回 None
+        """
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            return "running"
+
+        for user_id, user_queue in self._queues.items():
+            for job in user_queue:
+                if job.job_id == job_id:
+                    user_queue.remove(job)
+                    self._queued -= 1
+                    if not user_queue:
+                        self._queues.pop(user_id)
+                    return "queued"
+        return None
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def retry_after(self) -> int:
+        """按当前排队长度和平均任务耗时估算多少秒后会有空位"""
+        waves = (self._queued + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self._avg_job_seconds))
+
+    def stats(self) -> Dict:
+        return {
+            "running": len(self._running),
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "rejected": self._rejected,
+            "avg_job_seconds": round(self._avg_job_seconds, 2),
+        }
+
+
+@lru_cache()
+def get_voice_job_scheduler() -> VoiceJobScheduler:
+    """获取语音任务调度器（单例模式）"""
+    settings = get_settings()
+    return VoiceJobScheduler(
+        max_concurrency=settings.voice_job_max_concurrency,
+        max_queue=settings.voice_job_max_queue,
+        max_queue_per_user=settings.voice_job_max_queue_per_user
+    )
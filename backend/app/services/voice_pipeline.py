@@ -0,0 +1,487 @@
+"""
+语音日记处理流水线（阶段图）
+
+负责:
+- 以声明式的阶段依赖图描述 上传 / 转录 / 润色 / 反馈 / 等待图片 / 保存
+- 每个阶段的依赖一旦完成立即启动（S3 上传与 Whisper 重叠，润色与反馈重叠）
+- 记录各阶段真实耗时，按关键路径估算剩余时间（ETA）
+- 同一次运行通过 on_progress 回调驱动同步接口、SSE 推送和轮询任务三种前端
+- 失败或取消时取消仍在运行的阶段，并清理已完成阶段的副作用（如已上传的音频）
+"""
+
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .audio_spool import SpooledAudio
+from .stage_timing import StageTimingHistogram, get_stage_timings
+from ..utils.transcription import validate_audio_quality, validate_transcription
+
+
+# ============================================================================
+# 通用阶段图执行器
+# ============================================================================
+
+# 进度回调：可以是普通函数，也可以返回 awaitable（如写入任务存储），流水线会等待其完成
+ProgressCallback = Callable[[Dict], Optional[Awaitable[None]]]
+
+
+@dataclass(frozen=True)
+class ProgressStep:
+    """阶段开始 / 完成时上报给客户端的进度"""
+    progress: int
+    step: int
+    step_name: str
+    message: str
+
+
+@dataclass
+class Stage:
+    """
+    流水线中的一个阶段
+
+    - run: 接收 StageContext，返回值作为该阶段的结果供下游读取
+    - requires: 依赖的阶段名，全部完成后才启动
+    - on_start / on_done: 阶段开始 / 完成时的进度（可选）
+    - cleanup: 流水线失败或取消时，对该阶段已产生的结果做清理（可选）
+    - shield: 提交阶段（如保存）：一旦开始就不随流水线取消而中断，取消时等待其运行结束；
+      开始后不再执行任何清理（其结果可能已引用上游阶段的产物，如已上传的音频）
+    """
+    name: str
+    run: Callable[["StageContext"], Awaitable[Any]]
+    requires: Tuple[str, ...] = ()
+    on_start: Optional[ProgressStep] = None
+    on_done: Optional[ProgressStep] = None
+    cleanup: Optional[Callable[[Any], None]] = None
+    shield: bool = False
+
+
+@dataclass
+class StageContext:
+    """阶段函数可见的上下文：流水线输入、上游结果、阶段内进度上报（需 await）"""
+    stage: str
+    inputs: Any
+    results: Dict[str, Any]
+    report: Callable[[int, int, str, str], Awaitable[None]]
+
+
+class StageGraph:
+    """阶段依赖图（构造时校验依赖存在且无环）"""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("阶段名重复")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        visiting = set()
+
+        def visit(name: str) -> None:
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"阶段依赖存在环: {name}")
+            if name not in self.stages:
+                raise ValueError(f"未知的依赖阶段: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].requires:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    async def run(
+        self,
+        inputs: Any,
+        on_progress: Optional[ProgressCallback] = None,
+        timings: Optional[StageTimingHistogram] = None,
+        clock: Callable[[], float] = time.perf_counter
+    ) -> Dict[str, Any]:
+        """执行整张图，返回 {阶段名: 结果}"""
+        return await PipelineRun(self, inputs, on_progress, timings, clock).execute()
+
+
+class PipelineRun:
+    """一次流水线运行的状态：已启动 / 已完成的阶段、进度、耗时"""
+
+    def __init__(
+        self,
+        graph: StageGraph,
+        inputs: Any,
+        on_progress: Optional[ProgressCallback],
+        timings: Optional[StageTimingHistogram],
+        clock: Callable[[], float]
+    ):
+        self.graph = graph
+        self.inputs = inputs
+        self.on_progress = on_progress
+        self.timings = timings or get_stage_timings()
+        self._clock = clock
+        self.results: Dict[str, Any] = {}
+        self.started_at: Dict[str, float] = {}
+        self.progress = 0
+        self.current_stage: Optional[str] = None
+        # 已有提交阶段开始运行：之后失败或取消都不再清理
+        self.committed = False
+
+    async def execute(self) -> Dict[str, Any]:
+        pending = [name for name in self.graph.order]
+        running: Dict[asyncio.Task, str] = {}
+        try:
+            while pending or running:
+                for name in list(pending):
+                    if all(dep in self.results for dep in self.graph.stages[name].requires):
+                        pending.remove(name)
+                        running[await self._start(name)] = name
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    # 阶段异常在这里抛出，进入下方的取消与清理
+                    await self._finish(name, task.result())
+            return self.results
+        except BaseException:
+            for task, name in running.items():
+                if not self.graph.stages[name].shield:
+                    task.cancel()
+            await self._wait_until_done(running)
+            if not self.committed:
+                self._cleanup()
+            raise
+
+    @staticmethod
+    async def _wait_until_done(tasks) -> None:
+        """等待阶段全部结束；期间再次被取消也继续等待（受保护的阶段必须运行完毕）"""
+        pending = set(tasks)
+        while pending:
+            try:
+                await asyncio.shield(asyncio.wait(pending))
+            except asyncio.CancelledError:
+                pass
+            pending = {task for task in pending if not task.done()}
+        for task in tasks:
+            if not task.cancelled():
+                task.exception()
+
+    async def _start(self, name: str) -> asyncio.Task:
+        stage = self.graph.stages[name]
+        self.started_at[name] = self._clock()
+        if stage.on_start:
+            await self.emit(name, stage.on_start)
+        context = StageContext(
+            stage=name,
+            inputs=self.inputs,
+            results=self.results,
+            report=lambda progress, step, step_name, message: self.emit(
+                name, ProgressStep(progress, step, step_name, message)
+            )
+        )
+        task = asyncio.create_task(stage.run(context))
+        # 进度上报（可能因取消而抛出）之后才算开始提交
+        if stage.shield:
+            self.committed = True
+        return task
+
+    async def _finish(self, name: str, result: Any) -> None:
+        self.timings.record(name, (self._clock() - self.started_at[name]) * 1000)
+        self.results[name] = result
+        stage = self.graph.stages[name]
+        if stage.on_done:
+            await self.emit(name, stage.on_done)
+
+    def _cleanup(self) -> None:
+        for name, result in self.results.items():
+            cleanup = self.graph.stages[name].cleanup
+            if cleanup is None:
+                continue
+            try:
+                cleanup(result)
+            except Exception as e:
+                print(f"⚠️ 阶段清理失败: {name} - {e}")
+
+    def eta_ms(self) -> int:
+        """按关键路径估算剩余毫秒数：运行中阶段取剩余预估，未开始阶段从其依赖的最晚完成时间起算"""
+        now = self._clock()
+        finish: Dict[str, float] = {}
+        for name in self.graph.order:
+            if name in self.results:
+                finish[name] = 0.0
+                continue
+            expected = self.timings.expected_ms(name)
+            if name in self.started_at:
+                elapsed = (now - self.started_at[name]) * 1000
+                finish[name] = max(expected - elapsed, 0.0)
+            else:
+                deps = self.graph.stages[name].requires
+                finish[name] = max((finish[dep] for dep in deps), default=0.0) + expected
+        return round(max(finish.values(), default=0.0))
+
+    async def emit(self, stage: str, step: ProgressStep) -> None:
+        """上报进度（百分比单调不减），附带当前阶段与 ETA 提示"""
+        self.current_stage = stage
+        self.progress = max(self.progress, step.progress)
+        if self.on_progress is None:
+            return
+        result = self.on_progress({
+            "progress": self.progress,
+            "step": step.step,
+            "step_name": step.step_name,
+            "message": step.message,
+            "stage": stage,
+            "eta_ms": self.eta_ms(),
+            "stage_expected_ms": round(self.timings.expected_ms(stage)),
+        })
+        if inspect.isawaitable(result):
+            await result
+
+
+# ============================================================================
+# 语音日记阶段图
+# ============================================================================
+
+@dataclass
+class VoiceDiaryInput:
+    """一次语音日记处理的输入"""
+    user_id: str
+    # 落盘的音频；upload 与 transcribe 各自打开独立句柄流式读取
+    audio: SpooledAudio
+    duration: int
+    user_display_name: Optional[str] = None
+    # 润色 / 反馈使用的语言（"Chinese" / "English"）；None 时按转录文本检测
+    language: Optional[str] = None
+    # 用户手动输入的文字（与转录合并）
+    content: Optional[str] = None
+    image_urls: List[str] = field(default_factory=list)
+    # 等待客户端补充图片URL（仅异步任务模式），参数为阶段内进度上报函数
+    wait_for_images: Optional[Callable[[Callable[[int, int, str, str], Awaitable[None]]], Awaitable[List[str]]]] = None
+    # 流式部分结果（仅 SSE 模式）：参数为阶段名（polish / feedback）和已生成的字段
+    on_partial: Optional[Callable[[str, Dict[str, str]], None]] = None
+    # 润色 / 反馈抛出异常时：True 使用降级结果继续保存（同步、SSE、纯语音异步任务），
+    # False 让整条流水线失败（图文混合异步任务）
+    degrade_on_ai_error: bool = True
+    # 情绪数据包装为 {"source": "text_only", "meta": {...}} 再保存（异步任务）；
+    # 否则直接保存反馈返回的情绪数据（同步、SSE）
+    wrap_emotion_data: bool = False
+
+    @property
+    def speech_only(self) -> bool:
+        """纯语音：没有文字和图片，转录为空时应当报错"""
+        return not (self.content and self.content.strip()) and not self.image_urls and self.wait_for_images is None
+
+
+async def upload_audio_for_task(s3_service, audio: SpooledAudio) -> str:
+    """
+    以流的方式上传音频到 S3，可被取消
+
+    线程中的上传无法中断：取消时不再等待，上传线程结束后再删除已写入的对象
+    """
+    def upload_from_spool() -> str:
+        with audio.open() as audio_stream:
+            return s3_service.upload_audio_file(
+                audio_stream,
+                file_name=audio.filename,
+                content_type=audio.content_type
+            )
+
+    upload = asyncio.ensure_future(asyncio.to_thread(upload_from_spool))
+    try:
+        return await asyncio.shield(upload)
+    except asyncio.CancelledError:
+        def delete_when_uploaded(done: asyncio.Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                delete_audio_later(s3_service, done.result())
+
+        upload.add_done_callback(delete_when_uploaded)
+        raise
+
+
+def delete_audio_later(s3_service, audio_url: Optional[str]) -> None:
+    """后台删除已上传但不再需要的音频（处理失败 / 取消 / 超时）"""
+    if audio_url:
+        asyncio.get_running_loop().run_in_executor(None, s3_service.delete_objects_by_urls, [audio_url])
+
+
+class VoiceDiaryPipeline:
+    """
+    语音日记流水线：
+
+        validate_audio ─┬─ upload ──────────────────────────────────┐
+                        └─ transcribe → validate_transcript ─┬─ polish ───┤
+                                                             └─ feedback ─┴─ (wait_images) → save
+
+    upload 与 transcribe 都完成后 release_audio 立即删除落盘的音频，不等到保存结束；
+    save 开始后即使请求被取消（SSE 断开、超时、跨实例取消）也会写完，并保留已上传的音频
+    """
+
+    def __init__(self, openai_service, s3_service, db_service):
+        self.openai_service = openai_service
+        self.s3_service = s3_service
+        self.db_service = db_service
+
+    def build_graph(self, inputs: VoiceDiaryInput) -> StageGraph:
+        save_requires = ("upload", "polish", "feedback")
+        stages = [
+            Stage(
+                "validate_audio", self._validate_audio,
+                on_start=ProgressStep(8, 0, "验证中", "正在验证音频...")
+            ),
+            Stage(
+                "upload", self._upload, requires=("validate_audio",),
+                on_start=ProgressStep(15, 1, "上传中", "正在上传并识别语音..."),
+                cleanup=lambda audio_url: delete_audio_later(self.s3_service, audio_url)
+            ),
+            Stage(
+                "transcribe", self._transcribe, requires=("validate_audio",),
+                on_start=ProgressStep(20, 2, "语音识别", "正在识别语音..."),
+                on_done=ProgressStep(50, 2, "语音识别", "识别完成")
+            ),
+            Stage("release_audio", self._release_audio, requires=("upload", "transcribe")),
+            Stage("validate_transcript", self._validate_transcript, requires=("transcribe",)),
+            Stage(
+                "polish", self._polish, requires=("validate_transcript",),
+                on_start=ProgressStep(55, 3, "AI润色", "正在美化文字...")
+            ),
+            Stage(
+                "feedback", self._feedback, requires=("validate_transcript",),
+                on_start=ProgressStep(55, 3, "生成反馈", "正在感受你的心情..."),
+                on_done=ProgressStep(75, 3, "生成反馈", "反馈生成完成")
+            ),
+        ]
+        if inputs.wait_for_images is not None:
+            stages.append(Stage("wait_images", self._wait_images, requires=("polish", "feedback")))
+            save_requires += ("wait_images",)
+        # 保存在线程中写入数据库，取消协程并不能中止写入：受保护运行，开始后保留已上传的音频
+        stages.append(Stage(
+            "save", self._save, requires=save_requires,
+            on_start=ProgressStep(92, 4, "保存数据", "正在保存到数据库..."),
+            shield=True
+        ))
+        return StageGraph(stages)
+
+    async def run(
+        self,
+        inputs: VoiceDiaryInput,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Dict:
+        """执行流水线，返回保存后的日记"""
+        try:
+            results = await self.build_graph(inputs).run(inputs, on_progress=on_progress)
+        finally:
+            inputs.audio.close()
+        return results["save"]
+
+    @staticmethod
+    def _partial_reporter(ctx: StageContext) -> Optional[Callable[[Dict[str, str]], None]]:
+        """把 AI 流式生成的部分字段连同阶段名转交给 inputs.on_partial（未设置时不启用流式）"""
+        on_partial = ctx.inputs.on_partial
+        if on_partial is None:
+            return None
+        return lambda fields: on_partial(ctx.stage, fields)
+
+    # ---- 阶段实现 ----
+
+    async def _validate_audio(self, ctx: StageContext) -> None:
+        validate_audio_quality(ctx.inputs.duration, ctx.inputs.audio.size)
+
+    async def _upload(self, ctx: StageContext) -> str:
+        return await upload_audio_for_task(self.s3_service, ctx.inputs.audio)
+
+    async def _transcribe(self, ctx: StageContext) -> str:
+        inputs = ctx.inputs
+        return await self.openai_service.transcribe_audio(
+            inputs.audio,
+            inputs.audio.filename,
+            expected_duration=inputs.duration
+        )
+
+    async def _release_audio(self, ctx: StageContext) -> None:
+        ctx.inputs.audio.close()
+
+    async def _validate_transcript(self, ctx: StageContext) -> Dict[str, str]:
+        """校验转录并准备 AI 输入：润色文本、反馈上下文、语言"""
+        inputs = ctx.inputs
+        transcription = ctx.results["transcribe"]
+        if inputs.speech_only:
+            validate_transcription(transcription, inputs.duration)
+
+        manual = (inputs.content or "").strip()
+        spoken = (transcription or "").strip()
+        # 润色：手动文字与转录直接换行拼接；反馈：空行分隔，保留完整上下文
+        text = f"{manual}\n{transcription}" if manual else transcription
+        context = "\n\n".join(part for part in (manual, spoken) if part)
+        return {
+            "text": text,
+            "context": context,
+            "language": inputs.language or self.openai_service.detect_language(text),
+        }
+
+    async def _polish(self, ctx: StageContext) -> Optional[Dict[str, str]]:
+        prepared = ctx.results["validate_transcript"]
+        try:
+            return await self.openai_service._call_gpt4o_mini_for_polish_and_title(
+                prepared["text"], prepared["language"], None,  # ✅ 不传图片，避免干扰
+                user_id=ctx.inputs.user_id,
+                on_partial=self._partial_reporter(ctx)
+            )
+        except Exception as e:
+            if not ctx.inputs.degrade_on_ai_error:
+                raise
+            # 润色失败不让整条流水线失败，保存时使用降级结果
+            print(f"⚠️ 润色失败，将使用降级结果: {e}")
+            return None
+
+    async def _feedback(self, ctx: StageContext) -> Any:
+        prepared = ctx.results["validate_transcript"]
+        try:
+            return await self.openai_service._call_gpt4o_mini_for_feedback(
+                prepared["context"], prepared["language"], ctx.inputs.user_display_name, None,
+                user_id=ctx.inputs.user_id,
+                on_partial=self._partial_reporter(ctx)
+            )
+        except Exception as e:
+            if not ctx.inputs.degrade_on_ai_error:
+                raise
+            print(f"⚠️ 反馈生成失败，将使用降级结果: {e}")
+            return None
+
+    async def _wait_images(self, ctx: StageContext) -> List[str]:
+        return await ctx.inputs.wait_for_images(ctx.report)
+
+    async def _save(self, ctx: StageContext) -> Dict:
+        inputs = ctx.inputs
+        results = ctx.results
+        prepared = results["validate_transcript"]
+        ai_result = self.openai_service.compose_result(prepared["text"], results["polish"], results["feedback"])
+        emotion_data = ai_result.get("emotion_data")
+        if inputs.wrap_emotion_data:
+            text_emotion = emotion_data or {}
+            emotion_data = {
+                "emotion": text_emotion.get("emotion", "Reflective"),
+                "confidence": text_emotion.get("confidence", 0.0),
+                "rationale": text_emotion.get("rationale", ""),
+                "source": "text_only",
+                "meta": {
+                    "text": text_emotion
+                }
+            }
+        image_urls = results.get("wait_images") or inputs.image_urls or []
+        print(f"📸 保存日记，图片数量: {len(image_urls)}")
+
+        return await self.db_service.create_diary(
+            user_id=inputs.user_id,
+            original_content=results["transcribe"],
+            polished_content=ai_result["polished_content"],
+            ai_feedback=ai_result["feedback"],
+            language=ai_result.get("language", "zh"),
+            title=ai_result["title"],
+            audio_url=results["upload"],
+            audio_duration=inputs.duration,
+            image_urls=image_urls,
+            emotion_data=emotion_data
+        )
@@ -0,0 +1,66 @@
+import re
+from datetime import date, datetime, timezone
+from typing import Optional, Tuple
+
+# createdAt is an ISO timestamp; "~" sorts after every character used in it,
+# so "<day>~" is an inclusive upper bound for all timestamps on that day.
+SORT_KEY_MAX_SUFFIX = "~"
+
+_MONTH_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def parse_month(month: str) -> str:
+    """
+    Validate a YYYY-MM month string and return it unchanged.
+    """
+    if not month or not _MONTH_PATTERN.match(month):
+        raise ValueError("month 参数格式应为 YYYY-MM")
+    return month
+
+
+def _normalize_bound(value: str, name: str) -> str:
+    """
+    Return dates unchanged and timestamps in the stored createdAt form (UTC
+    ``isoformat()``), so that sort-key string comparison matches time order.
+    Timestamps without an offset are taken as UTC.
+    """
+    value = value.strip()
+    try:
+        if len(value) == 10:
+            return date.fromisoformat(value).isoformat()
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError as exc:
+        raise ValueError(f"{name} 参数格式应为 YYYY-MM-DD 或 ISO 时间") from exc
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def build_created_at_range(
+    from_value: Optional[str] = None,
+    to_value: Optional[str] = None,
+    month: Optional[str] = None,
+) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    Convert from/to/month query parameters into inclusive createdAt bounds.
+
+    Dates (YYYY-MM-DD) cover the whole UTC day; ISO timestamps are converted to UTC.
+    Returns None when no range was requested.
+    """
+    if month:
+        if from_value or to_value:
+            raise ValueError("month 不能与 from/to 同时使用")
+        prefix = parse_month(month)
+        return prefix, f"{prefix}{SORT_KEY_MAX_SUFFIX}"
+
+    if not from_value and not to_value:
+        return None
+
+    lower = _normalize_bound(from_value, "from") if from_value else None
+    upper = _normalize_bound(to_value, "to") if to_value else None
+    if upper and len(upper) == 10:
+        upper = f"{upper}{SORT_KEY_MAX_SUFFIX}"
+
+    if lower and upper and lower > upper:
+        raise ValueError("from 不能晚于 to")
+    return lower, upper
@@ -0,0 +1,45 @@
+import hashlib
+import json
+import re
+from typing import Any, Optional
+
+# Opaque client-generated keys (UUIDs in practice); kept short because the key
+# becomes part of the DynamoDB sort key.
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.:\-]{1,128}$")
+
+
+def normalize_idempotency_key(key: Optional[str]) -> Optional[str]:
+    """
+    Validate an Idempotency-Key header value.
+
+    Returns None when the header is missing or blank; raises ValueError for
+    values that cannot be used as a key.
+    """
+    if key is None:
+        return None
+    key = key.strip()
+    if not key:
+        return None
+    if not IDEMPOTENCY_KEY_PATTERN.match(key):
+        raise ValueError("Idempotency-Key 只能包含字母、数字和 _ . : -，且不超过 128 个字符")
+    return key
+
+
+def request_fingerprint(endpoint: str, *parts: Any) -> str:
+    """
+    Hash the parts of a request that determine its result.
+
+    A retry must send the same endpoint and parts to replay the stored result;
+    reusing a key for a different request is rejected. Bytes (audio) are hashed
+    as-is, everything else as canonical JSON.
+    """
+    digest = hashlib.sha256(endpoint.encode("utf-8"))
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            data = bytes(part)
+        else:
+            data = json.dumps(part, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+        # length prefix keeps ("ab", "c") and ("a", "bc") distinct
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
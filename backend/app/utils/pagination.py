@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+from functools import lru_cache
+from typing import Dict, Optional
+
+from ..config import get_settings
+
+
+@lru_cache()
+def _process_cursor_secret() -> str:
+    print("⚠️ 未配置 CURSOR_SECRET，使用进程内随机密钥签名分页游标（其他实例或重启后游标失效）")
+    return secrets.token_urlsafe(32)
+
+
+def get_cursor_secret() -> str:
+    """
+    Secret used to sign pagination cursors.
+
+    Only the dedicated ``cursor_secret`` setting is used. Without it a random
+    per-process key is generated, so cursors are rejected by other instances
+    (clients restart from the first page) but can never be forged.
+    """
+    return get_settings().cursor_secret or _process_cursor_secret()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    padding = "=" * (-len(text) % 4)
+    return base64.urlsafe_b64decode(text + padding)
+
+
+def encode_cursor(key: Dict[str, str], secret: Optional[str] = None) -> str:
+    """
+    Encode a DynamoDB LastEvaluatedKey into an opaque, signed cursor.
+    """
+    secret = secret if secret is not None else get_cursor_secret()
+    payload = json.dumps(key, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    signature = hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).digest()[:16]
+    return f"{_b64encode(payload)}.{_b64encode(signature)}"
+
+
+def decode_cursor(cursor: str, secret: Optional[str] = None) -> Dict[str, str]:
+    """
+    Decode and verify a cursor produced by encode_cursor.
+
+    Raises ValueError if the cursor is malformed or has been tampered with.
+    """
+    secret = secret if secret is not None else get_cursor_secret()
+    try:
+        payload_part, signature_part = cursor.split(".", 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("无效的分页游标") from exc
+
+    expected = hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).digest()[:16]
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("无效的分页游标")
+
+    try:
+        key = json.loads(payload.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("无效的分页游标") from exc
+
+    if not isinstance(key, dict):
+        raise ValueError("无效的分页游标")
+    return key
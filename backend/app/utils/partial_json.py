@@ -0,0 +1,127 @@
+from typing import Dict, Iterable, List, Optional
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class PartialJSONFieldExtractor:
+    """
+    Pull top-level string fields out of a JSON object while it is still being
+    generated.
+
+    Chunks are fed as they arrive from a streaming completion; each character
+    is scanned once. ``feed`` returns the fields whose value grew in that chunk,
+    mapped to only the text appended by that chunk, so callers append it to
+    what they display and the total output stays linear in the value length.
+    ``values`` holds the full value so far. Nested objects/arrays and
+    non-string values are skipped.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = set(fields)
+        self.values: Dict[str, str] = {}
+        self.completed: set = set()
+        self._depth = 0
+        self._in_string = False
+        self._string_is_key = False
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._buffer: List[str] = []
+        # escape state: None (not in escape), "" (after backslash) or the \u hex digits so far
+        self._escape: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+
+    def _capturing(self) -> bool:
+        return not self._string_is_key and self._depth == 1 and self._key in self.fields
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        appended: Dict[str, List[str]] = {}
+        for char in chunk:
+            if self._in_string:
+                decoded = self._consume_string_char(char)
+                if decoded is None:
+                    continue
+                if decoded is _END:
+                    self._end_string()
+                    continue
+                if self._string_is_key:
+                    self._buffer.append(decoded)
+                elif decoded and self._capturing():
+                    self.values[self._key] += decoded
+                    appended.setdefault(self._key, []).append(decoded)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = self._depth == 1 and self._expect_key
+                self._buffer = []
+                if self._capturing():
+                    self.values.setdefault(self._key, "")
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+            elif char in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and char == ",":
+                self._expect_key = True
+                self._key = None
+
+        return {field: "".join(pieces) for field, pieces in appended.items()}
+
+    def _consume_string_char(self, char: str):
+        """Return the decoded text for ``char`` ('' while inside an escape), or _END on the closing quote."""
+        if self._escape is None:
+            if char == "\\":
+                self._escape = ""
+                return None
+            if char == '"':
+                return _END
+            return self._with_surrogate(char)
+
+        if self._escape == "":
+            if char == "u":
+                self._escape = "u"
+                return None
+            self._escape = None
+            return self._with_surrogate(_SIMPLE_ESCAPES.get(char, char))
+
+        self._escape += char
+        if len(self._escape) < 5:
+            return None
+        code = int(self._escape[1:], 16)
+        self._escape = None
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return None
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+        return chr(code)
+
+    def _with_surrogate(self, text: str) -> str:
+        # an unpaired high surrogate is dropped rather than emitted as invalid text
+        self._high_surrogate = None
+        return text
+
+    def _end_string(self) -> None:
+        self._in_string = False
+        text = "".join(self._buffer)
+        if self._string_is_key:
+            self._key = text
+            self._expect_key = False
+        elif self._capturing():
+            self.completed.add(self._key)
+        self._buffer = []
+        self._string_is_key = False
+
+
+_END = object()
@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+# Attribute-name prefixes of the per-user STATS item. Counters are kept as
+# top-level attributes so that a single UpdateExpression ADD can bump them.
+EMOTION_COUNTER_PREFIX = "emotion#"
+DAY_COUNTER_PREFIX = "day#"
+
+
+def split_stats_counters(item: Dict) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Split a raw STATS item into (emotion counts, per-day counts), dropping zeros
+    left behind by deletes.
+    """
+    emotions: Dict[str, int] = {}
+    days: Dict[str, int] = {}
+    for name, value in item.items():
+        if name.startswith(EMOTION_COUNTER_PREFIX):
+            target, key = emotions, name[len(EMOTION_COUNTER_PREFIX):]
+        elif name.startswith(DAY_COUNTER_PREFIX):
+            target, key = days, name[len(DAY_COUNTER_PREFIX):]
+        else:
+            continue
+        count = int(value or 0)
+        if count > 0:
+            target[key] = count
+    return emotions, days
+
+
+def compute_streaks(days: Dict[str, int], today: date) -> Tuple[int, int]:
+    """
+    Return (current streak, longest streak) in days.
+
+    The current streak still counts if the last entry was yesterday, so it
+    does not drop to zero before the user has written today.
+    """
+    written = set()
+    for day in days:
+        try:
+            written.add(date.fromisoformat(day))
+        except ValueError:
+            continue
+
+    longest = 0
+    for day in written:
+        if day - timedelta(days=1) in written:
+            continue
+        length = 1
+        while day + timedelta(days=length) in written:
+            length += 1
+        longest = max(longest, length)
+
+    start: Optional[date] = None
+    if today in written:
+        start = today
+    elif today - timedelta(days=1) in written:
+        start = today - timedelta(days=1)
+
+    current = 0
+    while start is not None and start - timedelta(days=current) in written:
+        current += 1
+    return current, longest
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+重建用户统计项（STATS）
+
+用于上线写入时统计之前的历史数据，或统计与日记不一致时修复。
+
+使用方法:
+1. 确保已设置 AWS 凭证
+2. 重建指定用户: python scripts/rebuild_user_stats.py <user_id> [<user_id> ...]
+3. 重建所有用户: python scripts/rebuild_user_stats.py --all
+"""
+
+import sys
+import os
+import argparse
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.dynamodb_service import DynamoDBService
+
+
+def collect_user_ids(db_service: DynamoDBService) -> list:
+    """扫描全表，只投影 userId，收集所有写过日记的用户"""
+    user_ids = set()
+    scan_kwargs = {
+        'ProjectionExpression': '#userId',
+        'FilterExpression': '#itemType = :type',
+        'ExpressionAttributeNames': {'#userId': 'userId', '#itemType': 'itemType'},
+        'ExpressionAttributeValues': {':type': 'diary'},
+    }
+    while True:
+        response = db_service.table.scan(**scan_kwargs)
+        user_ids.update(item['userId'] for item in response.get('Items', []) if item.get('userId'))
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+    return sorted(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建用户统计项（日记数、按天计数、情绪分布）")
+    parser.add_argument("user_ids", nargs="*", help="要重建的用户ID")
+    parser.add_argument("--all", action="store_true", help="扫描全表，重建所有用户")
+    args = parser.parse_args()
+
+    if not args.user_ids and not args.all:
+        parser.error("请指定用户ID，或使用 --all")
+
+    print("=" * 60)
+    print("📊 重建用户统计")
+    print("=" * 60)
+
+    db_service = DynamoDBService()
+    user_ids = collect_user_ids(db_service) if args.all else args.user_ids
+    print(f"👥 共 {len(user_ids)} 个用户\n")
+
+    failed = 0
+    for user_id in user_ids:
+        try:
+            db_service.rebuild_user_stats(user_id)
+        except Exception as e:
+            failed += 1
+            print(f"❌ 重建失败 - 用户: {user_id}, 错误: {str(e)}")
+
+    print("\n" + "=" * 60)
+    print(f"✅ 完成: {len(user_ids) - failed} 成功, {failed} 失败")
+    print("=" * 60)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
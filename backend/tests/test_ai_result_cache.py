@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services import openai_service  # noqa: E402
+from app.services.ai_result_cache import AIResultCache, FallbackResult  # noqa: E402
+from app.services.cache_service import InMemoryLRUCache  # noqa: E402
+
+
+class FakeStore:
+    def __init__(self):
+        self.items = {}
+
+    async def get_ai_cache_entry(self, user_id, key):
+        return self.items.get((user_id, key))
+
+    async def put_ai_cache_entry(self, user_id, key, value):
+        self.items[(user_id, key)] = value
+
+
+def make_cache(store=None):
+    return AIResultCache(InMemoryLRUCache(max_entries=16, ttl_seconds=60), store=store)
+
+
+class AIResultCacheKeyTests(unittest.TestCase):
+    def test_key_ignores_trailing_whitespace_but_not_content(self):
+        key = AIResultCache.make_key("polish", "m", "1", "今天很好\n散步", "Chinese")
+        self.assertEqual(key, AIResultCache.make_key("polish", "m", "1", "  今天很好  \n散步\n", "Chinese"))
+        self.assertNotEqual(key, AIResultCache.make_key("polish", "m", "1", "今天很好 散步", "Chinese"))
+
+    def test_prompt_version_model_and_inputs_change_the_key(self):
+        base = dict(text="hello world", language="English", user_name="Ada", encoded_images=["aGk="])
+        key = AIResultCache.make_key("feedback", "m", "1", **base)
+        self.assertNotEqual(key, AIResultCache.make_key("feedback", "m", "2", **base))
+        self.assertNotEqual(key, AIResultCache.make_key("feedback", "m2", "1", **base))
+        self.assertNotEqual(key, AIResultCache.make_key("polish", "m", "1", **base))
+        self.assertNotEqual(key, AIResultCache.make_key("feedback", "m", "1", **dict(base, user_name="Bob")))
+        self.assertNotEqual(key, AIResultCache.make_key("feedback", "m", "1", **dict(base, encoded_images=[])))
+
+
+class AIResultCacheTests(unittest.TestCase):
+    def test_hit_returns_an_independent_copy(self):
+        cache = make_cache()
+
+        async def run():
+            await cache.set("k", {"emotion_data": {"emotion": "Joyful"}})
+            first = await cache.get("k")
+            first["emotion_data"]["emotion"] = "Sad"
+            return await cache.get("k")
+
+        self.assertEqual(asyncio.run(run()), {"emotion_data": {"emotion": "Joyful"}})
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_fallback_results_are_not_cached(self):
+        cache = make_cache()
+
+        async def run():
+            await cache.set("k", FallbackResult({"title": "今日记录"}))
+            return await cache.get("k")
+
+        self.assertIsNone(asyncio.run(run()))
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["skipped_fallbacks"]), (1, 1))
+
+    def test_store_tier_is_per_user_and_warms_memory(self):
+        store = FakeStore()
+        writer = make_cache(store)
+        reader = make_cache(store)
+
+        async def run():
+            await writer.set("k", {"reply": "hi"}, user_id="u1")
+            other_user = await reader.get("k", user_id="u2")
+            from_store = await reader.get("k", user_id="u1")
+            from_memory = await reader.get("k")
+            return other_user, from_store, from_memory
+
+        self.assertEqual(asyncio.run(run()), (None, {"reply": "hi"}, {"reply": "hi"}))
+        stats = reader.stats()
+        self.assertEqual((stats["hits"], stats["store_hits"], stats["misses"]), (1, 1, 1))
+
+
+class OpenAIServiceCachingTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = make_cache()
+        patcher = mock.patch.object(openai_service, "get_ai_result_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = openai_service.OpenAIService()
+
+    def test_repeated_polish_calls_the_model_once(self):
+        request = mock.AsyncMock(return_value={"title": "散步", "polished_content": "今天去公园散步。"})
+
+        async def run():
+            with mock.patch.object(self.service, "_request_polish_and_title", request):
+                first = await self.service._call_gpt4o_mini_for_polish_and_title("今天去公园散步", "Chinese")
+                second = await self.service._call_gpt4o_mini_for_polish_and_title("今天去公园散步 ", "Chinese")
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        request.assert_awaited_once()
+
+    def test_failed_feedback_is_retried(self):
+        request = mock.AsyncMock(return_value=FallbackResult({"reply": "感谢分享你的这一刻。"}))
+
+        async def run():
+            with mock.patch.object(self.service, "_request_feedback", request):
+                for _ in range(2):
+                    await self.service._call_gpt4o_mini_for_feedback("今天去公园散步", "Chinese", "Ada")
+
+        asyncio.run(run())
+        self.assertEqual(request.await_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services import async_dynamodb_service  # noqa: E402
+
+
+class FakeDynamoDBService:
+    instances = []
+
+    def __init__(self, session=None):
+        self.session = session
+        self.thread_id = threading.get_ident()
+        FakeDynamoDBService.instances.append(self)
+
+    def get_diary_by_id(self, diary_id, user_id, created_at=None):
+        return {
+            "diary_id": diary_id,
+            "user_id": user_id,
+            "created_at": created_at,
+            "thread_id": threading.get_ident(),
+            "service": self,
+        }
+
+
+class AsyncDynamoDBServiceTests(unittest.TestCase):
+    def setUp(self):
+        FakeDynamoDBService.instances = []
+        patcher = mock.patch.object(async_dynamodb_service, "DynamoDBService", FakeDynamoDBService)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runs_calls_off_the_event_loop_thread(self):
+        service = async_dynamodb_service.AsyncDynamoDBService(max_workers=2)
+
+        async def run():
+            return await service.get_diary_by_id("d1", "u1", created_at="2024-01-01")
+
+        result = asyncio.run(run())
+        self.assertEqual(result["diary_id"], "d1")
+        self.assertEqual(result["created_at"], "2024-01-01")
+        self.assertNotEqual(result["thread_id"], threading.get_ident())
+
+    def test_each_worker_thread_has_its_own_client(self):
+        service = async_dynamodb_service.AsyncDynamoDBService(max_workers=3)
+
+        async def run():
+            return await asyncio.gather(*[
+                service.get_diary_by_id(f"d{i}", "u1") for i in range(30)
+            ])
+
+        results = asyncio.run(run())
+        for result in results:
+            self.assertEqual(result["service"].thread_id, result["thread_id"])
+        self.assertLessEqual(len(FakeDynamoDBService.instances), 3)
+        sessions = {id(instance.session) for instance in FakeDynamoDBService.instances}
+        self.assertEqual(len(sessions), len(FakeDynamoDBService.instances))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from fastapi import HTTPException, UploadFile
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.audio_spool import SpooledAudio  # noqa: E402
+
+
+def make_upload(data: bytes, filename: str = "note.m4a") -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+class SpooledAudioTests(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, self.spool_dir)
+
+    def test_from_upload_spools_in_chunks_and_hashes(self):
+        data = os.urandom(SpooledAudio.CHUNK_SIZE * 2 + 123)
+        spooled = asyncio.run(SpooledAudio.from_upload(make_upload(data), spool_dir=self.spool_dir))
+
+        self.assertEqual(spooled.size, len(data))
+        self.assertEqual(spooled.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(spooled.filename, "note.m4a")
+        self.assertTrue(spooled.path.endswith(".m4a"))
+        # independent readers
+        with spooled.open() as first, spooled.open() as second:
+            self.assertEqual(first.read(10), data[:10])
+            self.assertEqual(second.read(), data)
+        spooled.close()
+
+    def test_close_is_idempotent_and_deletes_file(self):
+        spooled = SpooledAudio.from_bytes(b"abc", spool_dir=self.spool_dir)
+        reader = spooled.open()
+        spooled.close()
+        spooled.close()
+
+        self.assertTrue(spooled.closed)
+        self.assertFalse(os.path.exists(spooled.path))
+        # handles opened before close keep working
+        self.assertEqual(reader.read(), b"abc")
+        reader.close()
+        with self.assertRaises(ValueError):
+            spooled.open()
+
+    def test_oversized_upload_is_rejected_and_cleaned_up(self):
+        upload = make_upload(b"x" * 2048)
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(SpooledAudio.from_upload(upload, max_bytes=1024, spool_dir=self.spool_dir))
+
+        self.assertEqual(ctx.exception.status_code, 413)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_garbage_collected_spool_is_removed(self):
+        spooled = SpooledAudio.from_bytes(b"abc", spool_dir=self.spool_dir)
+        path = spooled.path
+        del spooled
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
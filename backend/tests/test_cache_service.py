@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.cache_service import DiaryListCache, InMemoryLRUCache  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class InMemoryLRUCacheTests(unittest.TestCase):
+    def test_get_returns_value_until_ttl_expires(self):
+        clock = FakeClock()
+        cache = InMemoryLRUCache(ttl_seconds=10, clock=clock)
+        cache.set("a", [1, 2, 3])
+        self.assertEqual(cache.get("a"), [1, 2, 3])
+        clock.now = 11
+        self.assertIsNone(cache.get("a"))
+
+    def test_evicts_least_recently_used_by_count(self):
+        cache = InMemoryLRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_evicts_by_byte_size(self):
+        cache = InMemoryLRUCache(max_bytes=100)
+        cache.set("a", "x" * 60)
+        cache.set("b", "y" * 60)
+        self.assertIsNone(cache.get("a"))
+        self.assertLessEqual(cache.stats()["bytes"], 100)
+
+    def test_skips_values_larger_than_limit(self):
+        cache = InMemoryLRUCache(max_bytes=10)
+        cache.set("a", "x" * 100)
+        self.assertIsNone(cache.get("a"))
+
+
+class DiaryListCacheTests(unittest.TestCase):
+    def test_read_through_and_invalidate(self):
+        cache = DiaryListCache(InMemoryLRUCache())
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return [{"diary_id": str(len(calls))}]
+
+        self.assertEqual(cache.get_or_load("u1", "all", loader), [{"diary_id": "1"}])
+        self.assertEqual(cache.get_or_load("u1", "all", loader), [{"diary_id": "1"}])
+        self.assertEqual(len(calls), 1)
+
+        cache.invalidate_user("u1")
+        self.assertEqual(cache.get_or_load("u1", "all", loader), [{"diary_id": "2"}])
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_invalidation_is_per_user(self):
+        cache = DiaryListCache(InMemoryLRUCache())
+        cache.get_or_load("u1", "all", lambda: ["u1"])
+        cache.get_or_load("u2", "all", lambda: ["u2"])
+        cache.invalidate_user("u1")
+        self.assertEqual(cache.get_or_load("u2", "all", lambda: ["stale"]), ["u2"])
+        self.assertEqual(cache.get_or_load("u1", "all", lambda: ["fresh"]), ["fresh"])
+
+    def test_shared_version_change_invalidates_without_a_local_write(self):
+        # 写操作发生在其他实例：本实例没有调用 invalidate_user，只有共享版本变化
+        cache = DiaryListCache(InMemoryLRUCache())
+        version = ["CHANGE#1"]
+        cache.get_or_load("u1", "all", lambda: ["old"], shared_version=lambda: version[0])
+        self.assertEqual(cache.get_or_load("u1", "all", lambda: ["new"], shared_version=lambda: version[0]), ["old"])
+
+        version[0] = "CHANGE#2"
+        self.assertEqual(cache.get_or_load("u1", "all", lambda: ["new"], shared_version=lambda: version[0]), ["new"])
+
+    def test_callers_get_copies(self):
+        cache = DiaryListCache(InMemoryLRUCache())
+        loaded = cache.get_or_load("u1", "all", lambda: [{"title": "a"}])
+        loaded[0]["title"] = "changed by caller"
+        hit = cache.get_or_load("u1", "all", lambda: [])
+        hit.append({"title": "b"})
+        self.assertEqual(cache.get_or_load("u1", "all", lambda: []), [{"title": "a"}])
+
+    def test_disabled_cache_always_loads(self):
+        cache = DiaryListCache(InMemoryLRUCache(), enabled=False)
+        cache.get_or_load("u1", "all", lambda: [1])
+        self.assertEqual(cache.get_or_load("u1", "all", lambda: [2]), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
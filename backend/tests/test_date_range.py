@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.utils.date_range import build_created_at_range, parse_month  # noqa: E402
+
+
+class DateRangeTests(unittest.TestCase):
+    def test_no_range(self):
+        self.assertIsNone(build_created_at_range())
+
+    def test_month_covers_whole_month(self):
+        lower, upper = build_created_at_range(month="2025-10")
+        self.assertLessEqual(lower, "2025-10-01T00:00:00+00:00")
+        self.assertGreater(upper, "2025-10-31T23:59:59.999999+00:00")
+        self.assertLess(upper, "2025-11")
+
+    def test_date_bounds_are_inclusive(self):
+        lower, upper = build_created_at_range("2025-10-01", "2025-10-07")
+        self.assertEqual(lower, "2025-10-01")
+        self.assertGreater(upper, "2025-10-07T23:59:59+00:00")
+        self.assertLess(upper, "2025-10-08")
+
+    def test_iso_bounds_kept_as_is(self):
+        lower, upper = build_created_at_range("2025-10-01T08:00:00+00:00", None)
+        self.assertEqual(lower, "2025-10-01T08:00:00+00:00")
+        self.assertIsNone(upper)
+
+    def test_zulu_bound_uses_stored_offset_form(self):
+        lower, upper = build_created_at_range("2025-10-01T08:00:00Z", "2025-10-01T09:30:00.250000Z")
+        self.assertEqual(lower, "2025-10-01T08:00:00+00:00")
+        self.assertEqual(upper, "2025-10-01T09:30:00.250000+00:00")
+
+    def test_non_utc_bound_is_converted_to_utc(self):
+        lower, upper = build_created_at_range("2024-05-01T08:00:00+08:00", "2024-05-01T08:00:00-02:00")
+        self.assertEqual(lower, "2024-05-01T00:00:00+00:00")
+        self.assertEqual(upper, "2024-05-01T10:00:00+00:00")
+        # 同一时刻的存储值落在范围内
+        self.assertTrue(lower <= "2024-05-01T00:00:00.000001+00:00" <= upper)
+
+    def test_naive_bound_is_treated_as_utc(self):
+        lower, _ = build_created_at_range("2024-05-01T08:00:00", None)
+        self.assertEqual(lower, "2024-05-01T08:00:00+00:00")
+
+    def test_offset_bounds_are_compared_in_utc(self):
+        # 08:00+08:00 (00:00Z) 早于 01:00Z，虽然字符串上更大
+        lower, upper = build_created_at_range("2024-05-01T08:00:00+08:00", "2024-05-01T01:00:00Z")
+        self.assertLess(lower, upper)
+        with self.assertRaises(ValueError):
+            build_created_at_range("2024-05-01T02:00:00Z", "2024-05-01T08:00:00+08:00")
+
+    def test_rejects_invalid_values(self):
+        for kwargs in (
+            {"month": "2025-13"},
+            {"month": "2025/10"},
+            {"from_value": "yesterday"},
+            {"from_value": "2025-10-08", "to_value": "2025-10-01"},
+            {"from_value": "2025-10-01", "month": "2025-10"},
+        ):
+            with self.assertRaises(ValueError):
+                build_created_at_range(**kwargs)
+
+    def test_parse_month(self):
+        self.assertEqual(parse_month("2025-01"), "2025-01")
+
+
+if __name__ == "__main__":
+    unittest.main()
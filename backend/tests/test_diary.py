@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.models.diary import DiaryCreate, ImageOnlyDiaryCreate  # noqa: E402
+from app.routers import diary  # noqa: E402
+from app.services.task_store import InMemoryTaskStore  # noqa: E402
+from app.services.voice_job_scheduler import JobCancelledError  # noqa: E402
+
+
+class TaskOwnershipTests(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryTaskStore()
+        patcher = mock.patch.object(diary, "task_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_owner_can_read_task(self):
+        self.store.create("t1", {"user_id": "u1", "status": "processing"})
+        self.assertEqual(asyncio.run(diary.get_user_task("t1", {"user_id": "u1"}))["status"], "processing")
+
+    def test_other_user_and_ownerless_tasks_are_not_found(self):
+        self.store.create("t1", {"user_id": "u1"})
+        self.store.create("t2", {"status": "processing"})
+        for task_id, user in (("t1", {"user_id": "u2"}), ("t2", {"user_id": "u1"}), ("missing", {"user_id": "u1"})):
+            with self.subTest(task_id=task_id), self.assertRaises(HTTPException) as ctx:
+                asyncio.run(diary.get_user_task(task_id, user))
+            self.assertEqual(ctx.exception.status_code, 404)
+
+    def test_cancel_after_task_completed_is_a_conflict(self):
+        self.store.create("t1", {"user_id": "u1", "status": "processing"})
+        real_get = self.store.get
+
+        def get_then_complete(task_id):
+            # 状态检查读到处理中之后、取消写入之前，任务完成
+            task = real_get(task_id)
+            self.store.update(task_id, {"status": "completed", "diary": {"diary_id": "d1"}})
+            return task
+
+        with mock.patch.object(self.store, "get", get_then_complete), self.assertRaises(HTTPException) as ctx:
+            asyncio.run(diary.cancel_voice_diary_task("t1", {"user_id": "u1"}))
+        self.assertEqual(ctx.exception.status_code, 409)
+        self.assertEqual(real_get("t1")["status"], "completed")
+
+    def test_cancel_marks_processing_task_cancelled(self):
+        self.store.create("t1", {"user_id": "u1", "status": "processing"})
+        response = asyncio.run(diary.cancel_voice_diary_task("t1", {"user_id": "u1"}))
+        self.assertEqual(response["status"], "cancelled")
+        self.assertTrue(self.store.get("t1")["cancel_requested"])
+
+    def test_progress_update_never_recreates_task(self):
+        self.assertIsNone(asyncio.run(
+            diary.update_task_progress("gone", "failed", 0, 0, "错误", "处理超时", error="处理超时")
+        ))
+        with self.assertRaises(JobCancelledError):
+            asyncio.run(diary.update_task_progress("gone", "processing", 50, 2, "润色", "..."))
+        self.assertIsNone(self.store.get("gone"))
+
+    def test_progress_update_merges_into_existing_task(self):
+        self.store.create("t1", {"user_id": "u1", "status": "processing"})
+        task = asyncio.run(diary.update_task_progress("t1", "processing", 40, 2, "润色", "正在润色..."))
+        self.assertEqual((task["user_id"], task["progress"]), ("u1", 40))
+
+
+class FakeOpenAIService:
+    def __init__(self):
+        self.user_names = []
+
+    async def polish_content_multilingual(self, text, user_name=None, image_urls=None, user_id=None):
+        self.user_names.append(user_name)
+        return {"title": "t", "polished_content": text, "feedback": "f", "emotion_data": {"emotion": "Joyful"}}
+
+
+class FakeDBService:
+    async def create_diary(self, **kwargs):
+        return {"diary_id": "d1", **kwargs}
+
+
+class FakeRequest:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class DisplayNameTests(unittest.TestCase):
+    def setUp(self):
+        self.openai_service = FakeOpenAIService()
+        for target, value in (("get_openai_service", lambda: self.openai_service), ("db_service", FakeDBService())):
+            patcher = mock.patch.object(diary, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_text_and_image_diaries_use_shared_name_resolution(self):
+        user = {"user_id": "u1", "name": "Token Name", "given_name": "Given"}
+        request = FakeRequest({"X-User-Name": "Ada Lovelace"})
+
+        asyncio.run(diary._create_text_diary(DiaryCreate(content="今天很开心"), request, user))
+        asyncio.run(diary._create_image_only_diary(
+            ImageOnlyDiaryCreate(image_urls=["https://bucket/a.jpg"], content="今天很开心"), user, None
+        ))
+
+        self.assertEqual(self.openai_service.user_names, [
+            diary.resolve_user_display_name(user, request),
+            diary.resolve_user_display_name(user, None),
+        ])
+        self.assertEqual(self.openai_service.user_names, ["Ada", "Token"])
+
+
+class OtherUsersDiaryDBService:
+    async def update_diary(self, **kwargs):
+        raise PermissionError("无权修改此日记")
+
+    async def delete_diary(self, **kwargs):
+        raise PermissionError("无权删除此日记")
+
+
+class DiaryOwnershipTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(diary, "db_service", OtherUsersDiaryDBService())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_update_and_delete_of_another_users_diary_are_forbidden(self):
+        user = {"user_id": "u1"}
+        calls = (
+            diary.update_diary("d1", diary.DiaryUpdate(title="x"), None, user),
+            diary.delete_diary("d1", None, user),
+        )
+        for call in calls:
+            with self.subTest(call=call.__name__), self.assertRaises(HTTPException) as ctx:
+                asyncio.run(call)
+            self.assertEqual(ctx.exception.status_code, 403)
+
+
+class FailingCompletionDBService:
+    def __init__(self):
+        self.released = []
+
+    async def claim_idempotency_key(self, user_id, key, fingerprint):
+        return None
+
+    async def complete_idempotency_key(self, user_id, key, response):
+        raise RuntimeError("throttled")
+
+    async def release_idempotency_key(self, user_id, key):
+        self.released.append(key)
+
+
+class IdempotencyTests(unittest.TestCase):
+    def test_unsaved_result_fails_the_request_and_keeps_the_claim(self):
+        db = FailingCompletionDBService()
+
+        async def create():
+            return {"diary_id": "d1"}
+
+        with mock.patch.object(diary, "db_service", db), self.assertRaises(HTTPException) as ctx:
+            asyncio.run(diary.run_idempotent(
+                {"user_id": "u1"}, "123e4567-e89b-12d3-a456-426614174000", "fp", create
+            ))
+        self.assertEqual(ctx.exception.status_code, 503)
+        # 日记已创建，不释放占用：重试在占用期内得到 409，而不是再创建一篇
+        self.assertEqual(db.released, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,388 @@
+import os
+import re
+import sys
+import unittest
+from unittest import mock
+
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.dynamodb_service import DynamoDBService  # noqa: E402
+
+
+class FakeTable:
+    table_name = "GratitudeDiaries"
+
+    def __init__(self, items=None):
+        self.items = list(items or [])
+        self.queries = []
+
+    def query(self, **params):
+        self.queries.append(params)
+        return {"Items": list(self.items)}
+
+
+def conditional_check_failed():
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+
+
+class StatefulTable:
+    """Stores items by primary key and evaluates the expressions the service writes."""
+
+    table_name = name = "GratitudeDiaries"
+
+    def __init__(self, items=None):
+        self.store = {}
+        self.queries = []
+        for item in items or []:
+            self.store[(item["userId"], item["createdAt"])] = dict(item)
+
+    def _key(self, key):
+        return (key["userId"], key["createdAt"])
+
+    def _check(self, item, condition, names, values):
+        if not condition:
+            return
+        names = names or {}
+        match = re.fullmatch(r"attribute_(not_)?exists\((#\w+)\)", condition)
+        if match:
+            exists = item is not None and names[match.group(2)] in item
+            ok = exists != bool(match.group(1))
+        else:
+            name, value = (part.strip() for part in condition.split("="))
+            ok = item is not None and item.get(names[name]) == values[value]
+        if not ok:
+            raise conditional_check_failed()
+
+    def get_item(self, Key, ConsistentRead=False):
+        item = self.store.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None):
+        key = self._key(Item)
+        self._check(self.store.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        self.store[key] = dict(Item)
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, ReturnValues=None):
+        names = ExpressionAttributeNames or {}
+        key = self._key(Key)
+        current = self.store.get(key)
+        self._check(current, ConditionExpression, names, ExpressionAttributeValues)
+        item = dict(current or Key)
+        for action, clause in re.findall(r"(ADD|SET) (.*?)(?= ADD | SET |$)", UpdateExpression):
+            for part in clause.split(","):
+                if action == "ADD":
+                    name, value = part.split()
+                    attr = names.get(name, name)
+                    item[attr] = item.get(attr, 0) + ExpressionAttributeValues[value]
+                else:
+                    name, value = (side.strip() for side in part.split("="))
+                    item[names.get(name, name)] = ExpressionAttributeValues[value]
+        self.store[key] = item
+        return {"Attributes": dict(item)} if ReturnValues == "ALL_NEW" else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None):
+        key = self._key(Key)
+        self._check(self.store.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        self.store.pop(key, None)
+
+    def query(self, **params):
+        self.queries.append(params)
+        return {"Items": [
+            dict(item) for (_, sort_key), item in sorted(self.store.items())
+            if sort_key < DynamoDBService.DIARY_SORT_KEY_UPPER_BOUND
+        ]}
+
+
+class FakeClient:
+    """Applies TransactWriteItems to a StatefulTable: every condition is checked before anything is written."""
+
+    def __init__(self, table):
+        self.table = table
+        self.transactions = []
+        self.error = None
+
+    def put_item(self, TableName, Item):
+        self.table.put_item(Item={k: TypeDeserializer().deserialize(v) for k, v in Item.items()})
+
+    def delete_item(self, TableName, Key):
+        self.table.delete_item(Key={k: TypeDeserializer().deserialize(v) for k, v in Key.items()})
+
+    def transact_write_items(self, TransactItems):
+        self.transactions.append(TransactItems)
+        if self.error is not None:
+            raise self.error
+        deserializer = TypeDeserializer()
+        actions = []
+        for entry in TransactItems:
+            (action, params), = entry.items()
+            params = {
+                field: {k: deserializer.deserialize(v) for k, v in value.items()}
+                if field in ("Item", "Key", "ExpressionAttributeValues") else value
+                for field, value in params.items() if field != "TableName"
+            }
+            actions.append((action, params))
+
+        reasons = []
+        for action, params in actions:
+            key = self.table._key(params.get("Key") or params.get("Item"))
+            try:
+                self.table._check(
+                    self.table.store.get(key), params.get("ConditionExpression"),
+                    params.get("ExpressionAttributeNames"), params.get("ExpressionAttributeValues")
+                )
+                reasons.append({"Code": "None"})
+            except ClientError:
+                reasons.append({"Code": "ConditionalCheckFailed"})
+        if any(reason["Code"] != "None" for reason in reasons):
+            raise ClientError(
+                {"Error": {"Code": "TransactionCanceledException"}, "CancellationReasons": reasons},
+                "TransactWriteItems"
+            )
+
+        methods = {"Put": self.table.put_item, "Update": self.table.update_item, "Delete": self.table.delete_item}
+        for action, params in actions:
+            methods[action](**params)
+
+
+class FakeResource:
+    def __init__(self, client):
+        self.meta = type("Meta", (), {"client": client})()
+
+
+class NullListCache:
+    def invalidate_user(self, user_id):
+        pass
+
+
+def make_service(table):
+    service = DynamoDBService.__new__(DynamoDBService)
+    service.table = table
+    service.dynamodb = FakeResource(FakeClient(table))
+    service.list_cache = NullListCache()
+    return service
+
+
+def diary(created_at, emotion=None):
+    item = {
+        "userId": "u1",
+        "createdAt": created_at,
+        "diaryId": f"d-{created_at}",
+        "date": created_at[:10],
+        "itemType": "diary",
+        "originalContent": "hi",
+    }
+    if emotion:
+        item["emotionData"] = {"emotion": emotion}
+    return item
+
+
+class QueryAllDiariesTests(unittest.TestCase):
+    def test_query_is_bounded_to_diary_sort_keys(self):
+        table = FakeTable([{
+            "userId": "u1",
+            "createdAt": "2024-05-01T00:00:00+00:00",
+            "diaryId": "d1",
+            "originalContent": "hi",
+        }])
+        service = make_service(table)
+
+        diaries = service._query_all_diaries("u1", summary=False)
+
+        self.assertEqual([d["diary_id"] for d in diaries], ["d1"])
+        self.assertEqual(
+            table.queries[0]["KeyConditionExpression"],
+            Key("userId").eq("u1") & Key("createdAt").lt(DynamoDBService.DIARY_SORT_KEY_UPPER_BOUND)
+        )
+
+
+class UserStatsTests(unittest.TestCase):
+    def stats_item(self, table):
+        return table.store[("u1", DynamoDBService.STATS_SORT_KEY)]
+
+    def test_user_with_diaries_before_deploy_then_creates_one(self):
+        table = StatefulTable([
+            diary("2024-05-01T08:00:00+00:00", "happy"),
+            diary("2024-05-02T08:00:00+00:00", "calm"),
+        ])
+        service = make_service(table)
+
+        created = service.create_diary("u1", "new", "new", "", emotion_data={"emotion": "calm"})
+        self.assertTrue(self.stats_item(table)["initialized"])
+
+        stats = service.get_user_stats("u1")
+        self.assertEqual(stats["diary_count"], 3)
+        self.assertEqual(stats["emotion_counts"], {"calm": 2, "happy": 1})
+        self.assertEqual(stats["last_entry_date"], created["date"])
+
+        # 已初始化后直接累加，不再重建
+        queries = len(table.queries)
+        service.create_diary("u1", "more", "more", "", emotion_data={"emotion": "happy"})
+        stats = service.get_user_stats("u1")
+        self.assertEqual(len(table.queries), queries)
+        self.assertEqual(stats["diary_count"], 4)
+        self.assertEqual(stats["emotion_counts"], {"calm": 2, "happy": 2})
+
+    def test_uninitialized_stats_item_is_rebuilt(self):
+        table = StatefulTable([
+            diary("2024-05-01T08:00:00+00:00", "happy"),
+            diary("2024-05-02T08:00:00+00:00"),
+            {"userId": "u1", "createdAt": "STATS", "itemType": "stats", "diaryCount": 1, "day#2024-05-02": 1},
+        ])
+        service = make_service(table)
+
+        self.assertEqual(service.get_user_stats("u1")["diary_count"], 2)
+        self.assertTrue(self.stats_item(table)["initialized"])
+
+    def test_rebuild_retries_when_a_diary_is_written_concurrently(self):
+        table = StatefulTable([diary("2024-05-01T08:00:00+00:00", "happy")])
+        service = make_service(table)
+        original_query = table.query
+
+        def query_with_concurrent_write(**params):
+            response = original_query(**params)
+            if len(table.queries) == 1:
+                service._write_with_stats(
+                    "u1", [("Put", {"Item": diary("2024-05-03T08:00:00+00:00", "calm")})], "2024-05-03", "calm", 1
+                )
+            return response
+
+        table.query = query_with_concurrent_write
+        service.rebuild_user_stats("u1")
+
+        # 并发写入自身初始化了统计项（第 2 次查询），外层重建条件失败后重新统计（第 3 次）
+        self.assertEqual(len(table.queries), 3)
+        item = self.stats_item(table)
+        self.assertEqual(item["diaryCount"], 2)
+        self.assertEqual(item["emotion#calm"], 1)
+
+        service._write_with_stats("u1", [("Put", {"Item": diary("2024-05-04T08:00:00+00:00")})], "2024-05-04", None, 1)
+        self.assertEqual(self.stats_item(table)["diaryCount"], 3)
+
+    def test_new_user_pays_the_extra_transaction_only_on_the_first_write(self):
+        table = StatefulTable()
+        service = make_service(table)
+        client = service.dynamodb.meta.client
+
+        service.create_diary("u1", "first", "first", "", emotion_data={"emotion": "calm"})
+        self.assertEqual(len(client.transactions), 2)
+
+        service.create_diary("u1", "second", "second", "", emotion_data={"emotion": "calm"})
+        self.assertEqual(len(client.transactions), 3)
+        self.assertEqual(self.stats_item(table)["diaryCount"], 2)
+        self.assertEqual(self.stats_item(table)["emotion#calm"], 2)
+
+
+class DiaryWriteTransactionTests(unittest.TestCase):
+    def setUp(self):
+        self.table = StatefulTable([diary("2024-05-01T08:00:00+00:00", "happy")])
+        self.service = make_service(self.table)
+        self.client = self.service.dynamodb.meta.client
+        self.service.rebuild_user_stats("u1")
+
+    def changes(self):
+        return [item for item in self.table.store.values() if item.get("itemType") == "change"]
+
+    def test_create_writes_diary_change_and_stats_in_one_transaction(self):
+        created = self.service.create_diary("u1", "new", "new", "", emotion_data={"emotion": "calm"})
+
+        self.assertEqual(len(self.client.transactions), 1)
+        self.assertEqual([list(entry)[0] for entry in self.client.transactions[0]], ["Put", "Put", "Update"])
+        self.assertEqual([change["changedDiaryId"] for change in self.changes()], [created["diary_id"]])
+        self.assertEqual(self.table.store[("u1", "STATS")]["diaryCount"], 2)
+
+    def test_failed_transaction_propagates_and_writes_nothing(self):
+        before = dict(self.table.store)
+        self.client.error = ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "TransactWriteItems")
+
+        with self.assertRaises(ClientError):
+            self.service.create_diary("u1", "new", "new", "")
+        self.assertEqual(self.table.store, before)
+
+    def test_update_records_change_and_returns_new_item(self):
+        created_at = "2024-05-01T08:00:00+00:00"
+
+        updated = self.service.update_diary(f"d-{created_at}", "u1", title="新标题", created_at=created_at)
+
+        self.assertEqual(updated["title"], "新标题")
+        self.assertEqual([(c["op"], c["diaryCreatedAt"]) for c in self.changes()], [("upsert", created_at)])
+        self.assertEqual(self.client.transactions, [])
+
+    def test_update_with_mismatched_key_falls_back_to_index_lookup(self):
+        created_at = "2024-05-01T08:00:00+00:00"
+        self.table.query = lambda **params: {"Items": [self.table.store[("u1", created_at)]]}
+
+        updated = self.service.update_diary(
+            f"d-{created_at}", "u1", title="新标题", created_at="2024-05-09T08:00:00+00:00"
+        )
+
+        self.assertEqual(updated["created_at"], created_at)
+        self.assertEqual([c["diaryCreatedAt"] for c in self.changes()], [created_at])
+
+    def test_update_with_mismatched_key_returns_none(self):
+        self.assertIsNone(self.service._conditional_update(
+            "other", "u1", "2024-05-01T08:00:00+00:00", ["title = :t", "updatedAt = :ua"],
+            {":t": "x", ":ua": "2024-05-02T00:00:00+00:00"}
+        ))
+        self.assertEqual(self.changes(), [])
+
+    def test_delete_is_one_transaction_and_marks_stats_for_rebuild(self):
+        created_at = "2024-05-01T08:00:00+00:00"
+
+        self.service.delete_diary(f"d-{created_at}", "u1", created_at=created_at)
+
+        self.assertNotIn(("u1", created_at), self.table.store)
+        self.assertEqual([c["op"] for c in self.changes()], ["delete"])
+        self.assertEqual([list(entry)[0] for entry in self.client.transactions[-1]], ["Delete", "Put", "Update"])
+        self.assertTrue(self.table.store[("u1", "STATS")]["stale"])
+        stats = self.service.get_user_stats("u1")
+        self.assertEqual(stats["diary_count"], 0)
+        self.assertEqual(stats["emotion_counts"], {})
+
+
+class FlakyUpdateTable:
+    """update_item fails with a throttling error for the first `failures` calls."""
+
+    table_name = name = "GratitudeDiaries"
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.updates = []
+
+    def update_item(self, **params):
+        self.updates.append(params)
+        if len(self.updates) <= self.failures:
+            raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "UpdateItem")
+        return {}
+
+
+class IdempotencyCompletionTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("app.services.dynamodb_service.time.sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transient_failure_is_retried(self):
+        table = FlakyUpdateTable(failures=2)
+        make_service(table).complete_idempotency_key("u1", "k1", {"diary_id": "d1"})
+        self.assertEqual(len(table.updates), 3)
+        self.assertEqual(table.updates[-1]["ExpressionAttributeValues"][":completed"], "completed")
+
+    def test_persistent_failure_is_raised(self):
+        table = FlakyUpdateTable(failures=DynamoDBService.IDEMPOTENCY_COMPLETE_MAX_ATTEMPTS)
+        with self.assertRaises(ClientError):
+            make_service(table).complete_idempotency_key("u1", "k1", {"diary_id": "d1"})
+        self.assertEqual(len(table.updates), DynamoDBService.IDEMPOTENCY_COMPLETE_MAX_ATTEMPTS)
+
+if __name__ == "__main__":
+    unittest.main()
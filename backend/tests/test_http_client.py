@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services import http_client  # noqa: E402
+
+
+class SharedHttpClientTests(unittest.TestCase):
+    def test_client_is_reused_within_a_loop(self):
+        async def run():
+            first = http_client.get_http_client()
+            second = http_client.get_http_client()
+            await http_client.close_http_client()
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertIs(first, second)
+        self.assertTrue(first.is_closed)
+
+    def test_each_loop_gets_its_own_client(self):
+        async def run():
+            client = http_client.get_http_client()
+            await http_client.close_http_client()
+            return client
+
+        self.assertIsNot(asyncio.run(run()), asyncio.run(run()))
+
+    def test_closed_client_is_replaced(self):
+        async def run():
+            client = http_client.get_http_client()
+            await client.aclose()
+            replacement = http_client.get_http_client()
+            await http_client.close_http_client()
+            return client, replacement
+
+        client, replacement = asyncio.run(run())
+        self.assertIsNot(client, replacement)
+
+    def test_http2_only_when_h2_is_installed(self):
+        with mock.patch.object(http_client, "http2_available", return_value=False), \
+                mock.patch.object(http_client.httpx, "AsyncClient") as async_client:
+            http_client._create_client()
+        self.assertFalse(async_client.call_args.kwargs["http2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.utils.idempotency import normalize_idempotency_key, request_fingerprint  # noqa: E402
+
+
+class IdempotencyKeyTests(unittest.TestCase):
+    def test_missing_or_blank_key_is_none(self):
+        self.assertIsNone(normalize_idempotency_key(None))
+        self.assertIsNone(normalize_idempotency_key("   "))
+
+    def test_accepts_uuid_and_strips(self):
+        key = " 0b6f5a0e-3f7c-4c1e-9d2a-7b1c2d3e4f50 "
+        self.assertEqual(normalize_idempotency_key(key), key.strip())
+
+    def test_rejects_invalid_keys(self):
+        with self.assertRaises(ValueError):
+            normalize_idempotency_key("has space")
+        with self.assertRaises(ValueError):
+            normalize_idempotency_key("x" * 129)
+        with self.assertRaises(ValueError):
+            normalize_idempotency_key("a#b")
+
+
+class RequestFingerprintTests(unittest.TestCase):
+    def test_same_request_same_fingerprint(self):
+        first = request_fingerprint("text", {"content": "hi", "tags": [1, 2]})
+        second = request_fingerprint("text", {"tags": [1, 2], "content": "hi"})
+        self.assertEqual(first, second)
+
+    def test_endpoint_and_parts_change_fingerprint(self):
+        base = request_fingerprint("voice", b"audio", 12)
+        self.assertNotEqual(base, request_fingerprint("voice/async", b"audio", 12))
+        self.assertNotEqual(base, request_fingerprint("voice", b"audio", 13))
+        self.assertNotEqual(base, request_fingerprint("voice", b"audio2", 12))
+
+    def test_part_boundaries_are_unambiguous(self):
+        self.assertNotEqual(
+            request_fingerprint("x", b"ab", b"c"),
+            request_fingerprint("x", b"a", b"bc")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
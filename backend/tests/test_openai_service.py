@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+import httpx
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services import openai_service  # noqa: E402
+from app.services.ai_result_cache import AIResultCache, FallbackResult  # noqa: E402
+from app.services.audio_spool import SpooledAudio  # noqa: E402
+from app.services.cache_service import InMemoryLRUCache  # noqa: E402
+from app.services.http_client import close_http_client  # noqa: E402
+
+
+WHISPER_RESPONSE = {
+    "text": "今天天气很好，我去公园散步了",
+    "language": "zh",
+    "segments": [{"start": 0, "end": 9, "no_speech_prob": 0.01, "avg_logprob": -0.2}],
+}
+
+
+class OpenAIServiceClientTests(unittest.TestCase):
+    def test_get_openai_service_is_a_singleton(self):
+        self.assertIs(openai_service.get_openai_service(), openai_service.get_openai_service())
+
+    def test_async_client_follows_the_shared_http_client(self):
+        service = openai_service.OpenAIService()
+
+        async def run():
+            first = service.openai_client
+            second = service.openai_client
+            await close_http_client()
+            return first, second, service.openai_client
+
+        first, second, after_close = asyncio.run(run())
+        self.assertIs(first, second)
+        self.assertIsNot(first, after_close)
+
+    def test_transcription_streams_spooled_audio_without_threads(self):
+        received = {}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            received["body"] = request.read()
+            return httpx.Response(200, json=WHISPER_RESPONSE)
+
+        service = openai_service.OpenAIService()
+        audio = SpooledAudio.from_bytes(b"\x01" * 4096, filename="a.m4a")
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with mock.patch.object(openai_service, "get_http_client", return_value=client), \
+                    mock.patch.object(openai_service.asyncio, "to_thread", side_effect=AssertionError):
+                try:
+                    return await service.transcribe_audio(audio, audio.filename, expected_duration=10)
+                finally:
+                    await client.aclose()
+                    audio.close()
+
+        self.assertEqual(asyncio.run(run()), WHISPER_RESPONSE["text"])
+        self.assertIn(b"\x01" * 4096, received["body"])
+
+
+class TranscriptionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = InMemoryLRUCache(max_entries=8, ttl_seconds=60)
+        patcher = mock.patch.object(openai_service, "get_transcription_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = openai_service.OpenAIService()
+        self.requests = 0
+
+    def transcribe_twice(self, response_json, durations=(10, 10)):
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests += 1
+            return httpx.Response(200, json=response_json)
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            outcomes = []
+            with mock.patch.object(openai_service, "get_http_client", return_value=client):
+                for duration in durations:
+                    try:
+                        outcomes.append(await self.service.transcribe_audio(b"\x02" * 4096, "a.m4a", duration))
+                    except ValueError as e:
+                        outcomes.append(e)
+            await client.aclose()
+            return outcomes
+
+        return asyncio.run(run())
+
+    def test_identical_audio_skips_whisper(self):
+        response_json = dict(WHISPER_RESPONSE, segments=[dict(WHISPER_RESPONSE["segments"][0], tokens=[1, 2, 3])])
+        outcomes = self.transcribe_twice(response_json)
+
+        self.assertEqual(outcomes, [WHISPER_RESPONSE["text"]] * 2)
+        self.assertEqual(self.requests, 1)
+        cached = next(iter(self.cache._entries.values()))[2]
+        self.assertNotIn("tokens", cached["segments"][0])
+
+    def test_validation_is_replayed_on_cached_response(self):
+        outcomes = self.transcribe_twice(dict(WHISPER_RESPONSE, language="ko"))
+
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        self.assertEqual(self.requests, 1)
+
+    def test_different_duration_is_a_different_entry(self):
+        self.transcribe_twice(WHISPER_RESPONSE, durations=(10, 12))
+        self.assertEqual(self.requests, 2)
+
+
+def completion_stream(content, chunk_size=4):
+    events = []
+    for i in range(0, len(content), chunk_size):
+        events.append({
+            "id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}, "finish_reason": None}],
+        })
+    body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body.encode("utf-8"))
+
+
+class StreamingCompletionTests(unittest.TestCase):
+    def setUp(self):
+        cache = AIResultCache(InMemoryLRUCache(max_entries=8, ttl_seconds=60))
+        patcher = mock.patch.object(openai_service, "get_ai_result_cache", return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = openai_service.OpenAIService()
+
+    def run_polish(self, on_partial):
+        content = json.dumps({"title": "公园散步", "polished_content": "今天天气很好，我去公园散步了。"}, ensure_ascii=False)
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(json.loads(request.read()))
+            return completion_stream(content)
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with mock.patch.object(openai_service, "get_http_client", return_value=client):
+                result = await self.service._call_gpt4o_mini_for_polish_and_title(
+                    "今天天气很好，我去公园散步了", "Chinese", on_partial=on_partial
+                )
+            await client.aclose()
+            return result
+
+        return asyncio.run(run()), requests
+
+    def test_partial_fields_arrive_before_the_result(self):
+        partials = []
+        result, requests = self.run_polish(partials.append)
+
+        self.assertTrue(requests[0]["stream"])
+        self.assertEqual(result["title"], "公园散步")
+        titles = [p["title"] for p in partials if "title" in p]
+        self.assertGreater(len(titles), 1)
+        self.assertEqual("".join(titles), "公园散步")
+        # 每次只推送新增的文本，总推送量与内容长度相同
+        contents = [p["polished_content"] for p in partials if "polished_content" in p]
+        self.assertEqual("".join(contents), result["polished_content"])
+
+    def test_cache_hit_emits_full_fields_once(self):
+        self.run_polish(lambda fields: None)
+        partials = []
+        result, requests = self.run_polish(partials.append)
+
+        self.assertEqual(requests, [])
+        self.assertEqual(partials, [{"title": result["title"], "polished_content": result["polished_content"]}])
+
+
+class DegradedResponseTests(unittest.TestCase):
+    TEXT = "今天天气很好，我去公园散步了，还遇到了老朋友"
+
+    def setUp(self):
+        self.cache = AIResultCache(InMemoryLRUCache(max_entries=8, ttl_seconds=60))
+        patcher = mock.patch.object(openai_service, "get_ai_result_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = openai_service.OpenAIService()
+
+    def call(self, method, content, *args):
+        with mock.patch.object(self.service, "_complete_json", new=mock.AsyncMock(return_value=content)):
+            return asyncio.run(getattr(self.service, method)(*args))
+
+    def assert_not_cached(self, result):
+        self.assertIsInstance(result, FallbackResult)
+        self.assertEqual(self.cache.skipped, 1)
+        self.assertEqual(self.cache.backend.stats()["entries"], 0)
+
+    def test_truncated_polish_is_not_cached(self):
+        content = json.dumps({"title": "散步", "polished_content": "今天"}, ensure_ascii=False)
+        result = self.call("_call_gpt4o_mini_for_polish_and_title", content, self.TEXT, "Chinese")
+        self.assertEqual((result["title"], result["polished_content"]), ("散步", self.TEXT))
+        self.assert_not_cached(result)
+
+    def test_polish_extracted_from_malformed_json_is_not_cached(self):
+        inner = json.dumps({"title": "散步", "polished_content": self.TEXT}, ensure_ascii=False)
+        result = self.call("_call_gpt4o_mini_for_polish_and_title", f"Here you go: {inner} ```", self.TEXT, "Chinese")
+        self.assertEqual(result["title"], "散步")
+        self.assert_not_cached(result)
+
+    def test_non_json_feedback_is_not_cached(self):
+        result = self.call("_call_gpt4o_mini_for_feedback", "真好，继续加油！", self.TEXT, "Chinese", None, None)
+        self.assertEqual(result["rationale"], "Extracted from non-JSON response")
+        self.assert_not_cached(result)
+
+    def test_valid_polish_is_cached(self):
+        content = json.dumps({"title": "散步", "polished_content": self.TEXT + "。"}, ensure_ascii=False)
+        result = self.call("_call_gpt4o_mini_for_polish_and_title", content, self.TEXT, "Chinese")
+        self.assertNotIsInstance(result, FallbackResult)
+        self.assertEqual(self.cache.backend.stats()["entries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
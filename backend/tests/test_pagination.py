@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.utils import pagination  # noqa: E402
+from app.utils.pagination import decode_cursor, encode_cursor  # noqa: E402
+
+
+class PaginationCursorTests(unittest.TestCase):
+    def test_round_trip(self):
+        key = {"userId": "user-1", "createdAt": "2025-10-08T10:30:00+00:00"}
+        cursor = encode_cursor(key, secret="s3cret")
+        self.assertEqual(decode_cursor(cursor, secret="s3cret"), key)
+
+    def test_cursor_is_opaque(self):
+        cursor = encode_cursor({"userId": "user-1", "createdAt": "x"}, secret="s3cret")
+        self.assertNotIn("user-1", cursor)
+
+    def test_rejects_wrong_secret(self):
+        cursor = encode_cursor({"userId": "user-1", "createdAt": "x"}, secret="s3cret")
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, secret="other")
+
+    def test_rejects_tampered_payload(self):
+        cursor = encode_cursor({"userId": "user-1", "createdAt": "x"}, secret="s3cret")
+        forged = encode_cursor({"userId": "user-2", "createdAt": "x"}, secret="s3cret")
+        tampered = forged.split(".")[0] + "." + cursor.split(".")[1]
+        with self.assertRaises(ValueError):
+            decode_cursor(tampered, secret="s3cret")
+
+    def test_rejects_garbage(self):
+        for cursor in ("", "abc", "!!!.???"):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, secret="s3cret")
+
+
+class CursorSecretTests(unittest.TestCase):
+    def settings(self, cursor_secret):
+        return mock.Mock(cursor_secret=cursor_secret, openai_api_key="sk-test", dynamodb_table_name="GratitudeDiaries")
+
+    def test_uses_configured_secret(self):
+        with mock.patch.object(pagination, "get_settings", return_value=self.settings("configured")):
+            self.assertEqual(pagination.get_cursor_secret(), "configured")
+
+    def test_never_falls_back_to_other_settings(self):
+        with mock.patch.object(pagination, "get_settings", return_value=self.settings("")):
+            secret = pagination.get_cursor_secret()
+            self.assertNotIn(secret, ("sk-test", "GratitudeDiaries", ""))
+            # 同一进程内保持稳定，游标可以翻页
+            self.assertEqual(pagination.get_cursor_secret(), secret)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.utils.partial_json import PartialJSONFieldExtractor  # noqa: E402
+
+
+FIELDS = ("title", "polished_content", "reply")
+DOCUMENT = {
+    "emotion_data": {"title": "nested, ignored", "tags": ["a\"}", 1]},
+    "title": "公园 \"散步\" 😀",
+    "confidence": 0.9,
+    "polished_content": "第一行\n第二行 \\ end\t.",
+    "reply": "真好",
+}
+
+
+def feed_in_chunks(text, size):
+    extractor = PartialJSONFieldExtractor(FIELDS)
+    updates = []
+    for i in range(0, len(text), size):
+        updates.append(extractor.feed(text[i:i + size]))
+    return extractor, updates
+
+
+class PartialJSONFieldExtractorTests(unittest.TestCase):
+    def test_extracts_fields_for_any_chunking(self):
+        for ensure_ascii in (True, False):
+            text = json.dumps(DOCUMENT, ensure_ascii=ensure_ascii)
+            for size in (1, 2, 3, 5, len(text)):
+                extractor, updates = feed_in_chunks(text, size)
+                with self.subTest(ensure_ascii=ensure_ascii, size=size):
+                    self.assertEqual(extractor.values, {field: DOCUMENT[field] for field in FIELDS})
+                    for field in FIELDS:
+                        self.assertEqual("".join(u.get(field, "") for u in updates), DOCUMENT[field])
+                    self.assertEqual(extractor.completed, set(FIELDS))
+
+    def test_reports_appended_text_before_the_string_closes(self):
+        extractor = PartialJSONFieldExtractor(["title", "reply"])
+
+        self.assertEqual(extractor.feed('{"title": "公'), {"title": "公"})
+        self.assertEqual(extractor.feed("园"), {"title": "园"})
+        self.assertEqual(extractor.values["title"], "公园")
+        self.assertEqual(extractor.feed('", "reply": "'), {})
+        self.assertEqual(extractor.completed, {"title"})
+        self.assertEqual(extractor.feed("hi\\"), {"reply": "hi"})
+        self.assertEqual(extractor.feed('n'), {"reply": "\n"})
+
+    def test_surrogate_pair_split_across_chunks(self):
+        extractor = PartialJSONFieldExtractor(["title"])
+        extractor.feed('{"title": "\\ud83d')
+        extractor.feed('\\ude00"}')
+        self.assertEqual(extractor.values["title"], "😀")
+
+    def test_non_string_values_are_ignored(self):
+        extractor = PartialJSONFieldExtractor(["title"])
+        extractor.feed('{"title": null, "other": "x"}')
+        self.assertEqual(extractor.values, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.stage_timing import StageTimingHistogram  # noqa: E402
+
+
+class StageTimingHistogramTests(unittest.TestCase):
+    def test_defaults_until_samples_arrive(self):
+        timings = StageTimingHistogram(defaults={"ai": 5000})
+        self.assertEqual(timings.expected_ms("ai"), 5000)
+        self.assertEqual(timings.expected_ms("unknown"), 0)
+        timings.record("ai", 1200)
+        self.assertEqual(timings.expected_ms("ai"), 1200)
+
+    def test_percentiles_over_rolling_window(self):
+        timings = StageTimingHistogram(window=10, defaults={})
+        for value in range(100):
+            timings.record("save", value)
+        # only the last 10 samples (90..99) are kept
+        self.assertEqual(timings.expected_ms("save", 0), 90)
+        self.assertEqual(timings.expected_ms("save", 90), 99)
+        snapshot = timings.snapshot()
+        self.assertEqual(snapshot["save"]["count"], 10)
+        self.assertEqual(snapshot["save"]["p50_ms"], 95)
+
+
+if __name__ == "__main__":
+    unittest.main()
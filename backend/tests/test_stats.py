@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+from datetime import date
+from decimal import Decimal
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.utils.stats import compute_streaks, split_stats_counters  # noqa: E402
+
+
+class SplitStatsCountersTests(unittest.TestCase):
+    def test_splits_counters_and_drops_zeros(self):
+        item = {
+            "userId": "u1",
+            "createdAt": "STATS",
+            "diaryCount": Decimal(3),
+            "emotion#Joyful": Decimal(2),
+            "emotion#Calm": Decimal(0),
+            "day#2025-10-01": Decimal(1),
+            "day#2025-10-02": Decimal(2),
+            "day#2025-10-03": Decimal(0),
+        }
+        emotions, days = split_stats_counters(item)
+        self.assertEqual(emotions, {"Joyful": 2})
+        self.assertEqual(days, {"2025-10-01": 1, "2025-10-02": 2})
+
+
+class ComputeStreaksTests(unittest.TestCase):
+    def test_current_streak_ending_today(self):
+        days = {"2025-10-08": 1, "2025-10-09": 1, "2025-10-10": 2}
+        self.assertEqual(compute_streaks(days, date(2025, 10, 10)), (3, 3))
+
+    def test_current_streak_survives_until_end_of_next_day(self):
+        days = {"2025-10-08": 1, "2025-10-09": 1}
+        self.assertEqual(compute_streaks(days, date(2025, 10, 10)), (2, 2))
+
+    def test_current_streak_broken(self):
+        days = {"2025-10-01": 1, "2025-10-02": 1, "2025-10-03": 1, "2025-10-07": 1}
+        self.assertEqual(compute_streaks(days, date(2025, 10, 10)), (0, 3))
+
+    def test_empty(self):
+        self.assertEqual(compute_streaks({}, date(2025, 10, 10)), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
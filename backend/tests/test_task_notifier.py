@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.task_notifier import TaskChangeNotifier, wait_for_task_change  # noqa: E402
+from app.services.task_store import InMemoryTaskStore  # noqa: E402
+
+
+class WaitForTaskChangeTests(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryTaskStore()
+        self.notifier = TaskChangeNotifier()
+        self.store.add_listener(self.notifier.notify)
+
+    def test_returns_immediately_when_version_differs(self):
+        task = self.store.create("t1", {"status": "processing"})
+
+        async def run():
+            return await wait_for_task_change(self.store, self.notifier, "t1", task["version"] - 1, timeout=5)
+
+        self.assertEqual(asyncio.run(run())["version"], task["version"])
+
+    def test_wakes_on_local_update(self):
+        task = self.store.create("t1", {"status": "processing", "progress": 5})
+
+        async def run():
+            async def update_later():
+                await asyncio.sleep(0.05)
+                self.store.update("t1", {"progress": 50})
+
+            updater = asyncio.create_task(update_later())
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await wait_for_task_change(
+                self.store, self.notifier, "t1", task["version"], timeout=5, recheck_interval=5
+            )
+            await updater
+            return result, loop.time() - started
+
+        result, elapsed = asyncio.run(run())
+        self.assertEqual(result["progress"], 50)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(self.notifier.waiter_count(), 0)
+
+    def test_recheck_picks_up_unnotified_writes(self):
+        # Writes from another instance do not reach this notifier.
+        other_store = self.store
+        task = self.store.create("t1", {"status": "processing"})
+
+        async def run():
+            async def update_silently():
+                await asyncio.sleep(0.05)
+                other_store._update("t1", {"progress": 90}, None)
+
+            updater = asyncio.create_task(update_silently())
+            result = await wait_for_task_change(
+                self.store, self.notifier, "t1", task["version"], timeout=5, recheck_interval=0.1
+            )
+            await updater
+            return result
+
+        self.assertEqual(asyncio.run(run())["progress"], 90)
+
+    def test_times_out_with_unchanged_task(self):
+        task = self.store.create("t1", {"status": "processing"})
+
+        async def run():
+            return await wait_for_task_change(
+                self.store, self.notifier, "t1", task["version"], timeout=0.05
+            )
+
+        self.assertEqual(asyncio.run(run())["version"], task["version"])
+
+    def test_terminal_task_returns_without_waiting(self):
+        task = self.store.create("t1", {"status": "completed"})
+
+        async def run():
+            return await wait_for_task_change(
+                self.store, self.notifier, "t1", task["version"], timeout=5
+            )
+
+        self.assertEqual(asyncio.run(run())["status"], "completed")
+
+    def test_missing_task_returns_none(self):
+        async def run():
+            return await wait_for_task_change(self.store, self.notifier, "nope", 0, timeout=5)
+
+        self.assertIsNone(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.task_store import InMemoryTaskStore, RedisTaskStore, SQLiteTaskStore  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Minimal stand-in for RedisTaskStore: hash reads and a Python port of its update script."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+        self.scripts = []
+
+    def register_script(self, script):
+        self.scripts.append(script)
+        return self._run_update_script
+
+    def _run_update_script(self, keys, args):
+        (key,) = keys
+        ttl, processing_ttl, create, n_defaults, n_expected, *pairs = [str(arg) for arg in args]
+        n_defaults, n_expected = int(n_defaults), int(n_expected)
+        defaults = pairs[:2 * n_defaults]
+        expected = pairs[2 * n_defaults:2 * (n_defaults + n_expected)]
+        fields = pairs[2 * (n_defaults + n_expected):]
+        if key not in self.hashes:
+            if create != "1":
+                return None
+            self.hashes[key] = {}
+            fields = defaults + fields
+        elif any(self.hashes[key].get(f) != v.encode("utf-8") for f, v in zip(expected[::2], expected[1::2])):
+            return None
+        task = self.hashes[key]
+        for field, value in zip(fields[::2], fields[1::2]):
+            task[field] = value.encode("utf-8")
+        task["version"] = str(int(task.get("version", b"0")) + 1).encode("utf-8")
+        status = task.get("status")
+        self.ttls[key] = int(processing_ttl if status in (None, b'"processing"') else ttl)
+        return [item for field, value in task.items() for item in (field.encode("utf-8"), value)]
+
+    def hgetall(self, key):
+        return {field.encode("utf-8"): value for field, value in self.hashes.get(key, {}).items()}
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+        self.ttls.pop(key, None)
+
+
+class TaskStoreContract:
+    """Behaviour shared by every backend."""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def test_update_without_defaults_does_not_create(self):
+        store = self.make_store()
+        self.assertIsNone(store.update("t1", {"progress": 10}))
+        self.assertIsNone(store.get("t1"))
+
+    def test_create_and_merge_fields(self):
+        store = self.make_store()
+        store.create("t1", {"user_id": "u1", "status": "processing", "progress": 5})
+        store.update("t1", {"progress": 50, "image_urls": ["a.jpg"]})
+        task = store.get("t1")
+        self.assertEqual(task["user_id"], "u1")
+        self.assertEqual(task["progress"], 50)
+        self.assertEqual(task["image_urls"], ["a.jpg"])
+
+    def test_defaults_only_apply_to_new_tasks(self):
+        store = self.make_store()
+        store.update("t1", {"status": "processing"}, defaults={"progress": 0, "step": 0})
+        store.update("t1", {"step": 2}, defaults={"progress": 0, "step": 0, "extra": True})
+        task = store.get("t1")
+        self.assertEqual(task["step"], 2)
+        self.assertNotIn("extra", task)
+
+    def test_serializes_datetime_and_decimal(self):
+        store = self.make_store()
+        created = datetime(2025, 10, 8, tzinfo=timezone.utc)
+        store.create("t1", {"created_at": created, "diary": {"score": Decimal("0.5"), "n": Decimal(3)}})
+        task = store.get("t1")
+        self.assertEqual(task["created_at"], created.isoformat())
+        self.assertEqual(task["diary"], {"score": 0.5, "n": 3})
+
+    def test_version_increments_and_listeners_are_notified(self):
+        store = self.make_store()
+        notified = []
+        store.add_listener(notified.append)
+        first = store.create("t1", {"status": "processing"})
+        second = store.update("t1", {"progress": 50})
+        self.assertEqual(second["version"], first["version"] + 1)
+        self.assertEqual(store.get("t1")["version"], second["version"])
+        store.update("missing", {"progress": 1})
+        self.assertEqual(notified, ["t1", "t1"])
+
+    def test_delete(self):
+        store = self.make_store()
+        store.create("t1", {"status": "processing"})
+        store.delete("t1")
+        self.assertIsNone(store.get("t1"))
+
+    def test_update_with_expected_fields_is_conditional(self):
+        store = self.make_store()
+        expected = {"status": "processing"}
+        self.assertIsNone(store.update("t1", {"status": "cancelled"}, expected=expected))
+        self.assertIsNone(store.get("t1"))
+
+        store.create("t1", {"status": "completed", "progress": 100})
+        self.assertIsNone(store.update("t1", {"status": "cancelled"}, expected=expected))
+        self.assertEqual(store.get("t1")["status"], "completed")
+
+        store.update("t1", {"status": "processing"})
+        task = store.update("t1", {"status": "cancelled"}, expected=expected)
+        self.assertEqual((task["status"], task["progress"]), ("cancelled", 100))
+
+    def test_async_methods_keep_blocking_io_off_the_event_loop(self):
+        store = self.make_store()
+        writer_threads = []
+        store.add_listener(lambda task_id: writer_threads.append(threading.get_ident()))
+
+        async def run():
+            await store.acreate("t1", {"status": "processing"})
+            await store.aupdate("t1", {"progress": 50})
+            task = await store.aget("t1")
+            await store.adelete("t1")
+            return threading.get_ident(), task, await store.aget("t1")
+
+        loop_thread, task, deleted = asyncio.run(run())
+        self.assertEqual(task["progress"], 50)
+        self.assertIsNone(deleted)
+        for thread in writer_threads:
+            self.assertEqual(thread == loop_thread, not store.BLOCKING)
+
+
+class InMemoryTaskStoreTests(TaskStoreContract, unittest.TestCase):
+    def make_store(self):
+        self.clock = FakeClock()
+        return InMemoryTaskStore(ttl_seconds=60, clock=self.clock)
+
+    def test_expires_after_ttl(self):
+        store = self.make_store()
+        store.create("t1", {"status": "completed"})
+        self.clock.now += 61
+        self.assertIsNone(store.get("t1"))
+
+    def test_processing_tasks_use_shorter_ttl(self):
+        self.clock = FakeClock()
+        store = InMemoryTaskStore(ttl_seconds=3600, processing_ttl_seconds=60, clock=self.clock)
+        store.create("stuck", {"status": "processing"})
+        store.create("done", {"status": "completed"})
+        self.clock.now += 61
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertIsNone(store.get("stuck"))
+        self.assertIsNotNone(store.get("done"))
+
+    def test_update_extends_deadline(self):
+        store = self.make_store()
+        store.create("t1", {"status": "processing"})
+        self.clock.now += 50
+        store.update("t1", {"progress": 50})
+        self.clock.now += 50
+        self.assertEqual(store.purge_expired(), 0)
+        self.assertEqual(store.get("t1")["progress"], 50)
+
+    def test_writes_evict_expired_tasks_without_full_sweep(self):
+        store = self.make_store()
+        for i in range(10):
+            store.create(f"old{i}", {"status": "completed"})
+        self.clock.now += 61
+        store.create("new", {"status": "processing"})
+        stats = store.stats()
+        self.assertEqual(stats["tasks"], 1)
+        self.assertEqual(stats["expired"], 10)
+
+    def test_enforces_task_and_byte_limits(self):
+        self.clock = FakeClock()
+        store = InMemoryTaskStore(ttl_seconds=60, clock=self.clock, max_tasks=2)
+        store.create("a", {"status": "processing"})
+        self.clock.now += 1
+        store.create("b", {"status": "processing"})
+        self.clock.now += 1
+        store.create("c", {"status": "processing"})
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.stats()["evictions"], 1)
+
+        store = InMemoryTaskStore(ttl_seconds=60, clock=self.clock, max_bytes=200)
+        store.create("a", {"payload": "x" * 120})
+        store.create("b", {"payload": "y" * 120})
+        self.assertIsNone(store.get("a"))
+        self.assertLessEqual(store.stats()["bytes"], 200)
+
+    def test_returned_task_is_a_copy(self):
+        store = self.make_store()
+        store.create("t1", {"image_urls": []})
+        store.get("t1")["image_urls"].append("x")
+        self.assertEqual(store.get("t1")["image_urls"], [])
+
+
+class SQLiteTaskStoreTests(TaskStoreContract, unittest.TestCase):
+    def make_store(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.clock = FakeClock()
+        return SQLiteTaskStore(os.path.join(tmp.name, "tasks.db"), ttl_seconds=60, clock=self.clock)
+
+    def test_shared_between_store_instances(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "tasks.db")
+        first = SQLiteTaskStore(path)
+        second = SQLiteTaskStore(path)
+        first.create("t1", {"status": "processing"})
+        second.update("t1", {"image_urls": ["a.jpg"]})
+        self.assertEqual(first.get("t1")["image_urls"], ["a.jpg"])
+
+    def test_purge_expired(self):
+        store = self.make_store()
+        store.create("t1", {"status": "completed"})
+        self.clock.now += 61
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertIsNone(store.get("t1"))
+
+    def test_writes_commit_their_transactions(self):
+        store = self.make_store()
+        store.create("t1", {"status": "completed"})
+        store.delete("t1")
+        store.purge_expired()
+        self.assertFalse(store._connect().in_transaction)
+        # 另一个连接可以立即获得写锁
+        other = SQLiteTaskStore(store.path, clock=self.clock)
+        other.create("t2", {"status": "processing"})
+        self.assertEqual(store.get("t2")["status"], "processing")
+
+
+class RedisTaskStoreTests(TaskStoreContract, unittest.TestCase):
+    def make_store(self):
+        self.redis = FakeRedis()
+        return RedisTaskStore(client=self.redis, ttl_seconds=60)
+
+    def test_sets_expiry_on_write(self):
+        store = self.make_store()
+        store.create("t1", {"status": "processing"})
+        self.assertEqual(self.redis.ttls["task:t1"], 60)
+
+    def test_update_runs_as_a_single_script(self):
+        store = RedisTaskStore(client=self.make_store().client, ttl_seconds=60, processing_ttl_seconds=10)
+        self.assertEqual(len(self.redis.scripts), 2)
+        self.assertIn("EXISTS", self.redis.scripts[-1])
+
+        store.update("t1", {"status": "processing"}, defaults={"progress": 0})
+        self.assertEqual(self.redis.ttls["task:t1"], 10)
+        task = store.update("t1", {"status": "completed", "progress": 100})
+        self.assertEqual((task["progress"], task["version"]), (100, 2))
+        self.assertEqual(self.redis.ttls["task:t1"], 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
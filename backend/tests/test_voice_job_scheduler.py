@@ -0,0 +1,177 @@
+import asyncio
+import os
+import sys
+import unittest
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services.voice_job_scheduler import QueueFullError, VoiceJobScheduler  # noqa: E402
+
+
+class VoiceJobSchedulerTests(unittest.TestCase):
+    def test_limits_concurrency_and_drains_queue(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=2, max_queue=10)
+            active = 0
+            peak = 0
+
+            async def job():
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+            positions = [scheduler.submit(f"j{i}", f"u{i}", job) for i in range(5)]
+            while scheduler.stats()["running"] or scheduler.stats()["queued"]:
+                await asyncio.sleep(0.01)
+            return positions, peak
+
+        positions, peak = asyncio.run(run())
+        self.assertEqual(positions, [0, 0, 1, 2, 3])
+        self.assertEqual(peak, 2)
+
+    def test_rejects_when_queue_is_full(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1, max_queue=1)
+            gate = asyncio.Event()
+            scheduler.submit("a", "u1", gate.wait)
+            scheduler.submit("b", "u2", gate.wait)
+            with self.assertRaises(QueueFullError) as ctx:
+                scheduler.submit("c", "u3", gate.wait)
+            self.assertGreaterEqual(ctx.exception.retry_after, 1)
+            self.assertEqual(scheduler.stats()["rejected"], 1)
+            gate.set()
+
+        asyncio.run(run())
+
+    def test_per_user_queue_limit(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1, max_queue=10, max_queue_per_user=1)
+            gate = asyncio.Event()
+            scheduler.submit("a", "u1", gate.wait)
+            scheduler.submit("b", "u1", gate.wait)
+            with self.assertRaises(QueueFullError):
+                scheduler.submit("c", "u1", gate.wait)
+            # other users still get in
+            scheduler.submit("d", "u2", gate.wait)
+            gate.set()
+
+        asyncio.run(run())
+
+    def test_round_robin_between_users(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1, max_queue=10)
+            order = []
+            gate = asyncio.Event()
+
+            def job(name):
+                async def run_job():
+                    order.append(name)
+                return run_job
+
+            scheduler.submit("blocker", "x", gate.wait)
+            for name in ("a1", "a2", "a3"):
+                scheduler.submit(name, "a", job(name))
+            scheduler.submit("b1", "b", job("b1"))
+            gate.set()
+            while scheduler.stats()["running"] or scheduler.stats()["queued"]:
+                await asyncio.sleep(0.01)
+            return order
+
+        self.assertEqual(asyncio.run(run()), ["a1", "b1", "a2", "a3"])
+
+    def test_reported_position_matches_round_robin_order(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1, max_queue=10)
+            gate = asyncio.Event()
+            order = []
+
+            def job(name):
+                async def run_job():
+                    order.append(name)
+                return run_job
+
+            scheduler.submit("blocker", "x", gate.wait)
+            positions = {}
+            for name, user in (("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b"), ("c1", "c"), ("b2", "b")):
+                positions[name] = scheduler.submit(name, user, job(name))
+            final = {name: scheduler.position(name) for name in positions}
+            missing = scheduler.position("missing")
+            gate.set()
+            while scheduler.stats()["running"] or scheduler.stats()["queued"]:
+                await asyncio.sleep(0.01)
+            return positions, final, missing, order
+
+        positions, final, missing, order = asyncio.run(run())
+        self.assertEqual(order, ["a1", "b1", "c1", "a2", "b2", "a3"])
+        self.assertEqual(final, {name: order.index(name) + 1 for name in order})
+        # 提交时的位置：b1 提交时排在 a1 之后、a2 之前
+        self.assertEqual(positions["b1"], 2)
+        self.assertEqual(missing, 0)
+
+    def test_on_start_reports_queue_wait(self):
+        async def run():
+            now = [100.0]
+            scheduler = VoiceJobScheduler(max_concurrency=1, clock=lambda: now[0])
+            waits = []
+            gate = asyncio.Event()
+            scheduler.submit("a", "u1", gate.wait, on_start=waits.append)
+            scheduler.submit("b", "u2", lambda: asyncio.sleep(0), on_start=waits.append)
+            now[0] += 1.5
+            gate.set()
+            while scheduler.stats()["running"] or scheduler.stats()["queued"]:
+                await asyncio.sleep(0.01)
+            return waits
+
+        self.assertEqual(asyncio.run(run()), [0.0, 1500.0])
+
+    def test_cancel_queued_job_never_starts(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1)
+            gate = asyncio.Event()
+            started = []
+
+            async def job():
+                started.append("b")
+
+            scheduler.submit("a", "u1", gate.wait)
+            scheduler.submit("b", "u2", job)
+            self.assertEqual(scheduler.cancel("b"), "queued")
+            self.assertEqual(scheduler.stats()["queued"], 0)
+            gate.set()
+            while scheduler.stats()["running"]:
+                await asyncio.sleep(0.01)
+            return started
+
+        self.assertEqual(asyncio.run(run()), [])
+
+    def test_cancel_running_job_frees_slot(self):
+        async def run():
+            scheduler = VoiceJobScheduler(max_concurrency=1)
+            cancelled = asyncio.Event()
+
+            async def job():
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+
+            scheduler.submit("a", "u1", job)
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.cancel("a"), "running")
+            await asyncio.wait_for(cancelled.wait(), timeout=1)
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.stats()["running"], 0)
+            self.assertIsNone(scheduler.cancel("a"))
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,350 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+CURRENT_DIR = os.path.dirname(__file__)
+BACKEND_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+if BACKEND_ROOT not in sys.path:
+    sys.path.insert(0, BACKEND_ROOT)
+
+from app.services import voice_pipeline  # noqa: E402
+from app.services.audio_spool import SpooledAudio  # noqa: E402
+from app.services.stage_timing import StageTimingHistogram  # noqa: E402
+from app.services.voice_pipeline import (  # noqa: E402
+    ProgressStep,
+    Stage,
+    StageGraph,
+    VoiceDiaryInput,
+    VoiceDiaryPipeline,
+)
+
+
+class StageGraphTests(unittest.TestCase):
+    def test_rejects_unknown_dependencies_and_cycles(self):
+        async def noop(ctx):
+            return None
+
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", noop, requires=("missing",))])
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", noop, requires=("b",)), Stage("b", noop, requires=("a",))])
+
+    def test_independent_stages_overlap(self):
+        events = []
+
+        def stage(name, delay):
+            async def run(ctx):
+                events.append(f"start:{name}")
+                await asyncio.sleep(delay)
+                events.append(f"end:{name}")
+                return name
+            return run
+
+        graph = StageGraph([
+            Stage("root", stage("root", 0)),
+            Stage("slow", stage("slow", 0.05), requires=("root",)),
+            Stage("fast", stage("fast", 0.01), requires=("root",)),
+            Stage("join", stage("join", 0), requires=("slow", "fast")),
+        ])
+        results = asyncio.run(graph.run(None, timings=StageTimingHistogram(defaults={})))
+
+        self.assertEqual(results["join"], "join")
+        # both branches start before either finishes
+        self.assertLess(events.index("start:fast"), events.index("end:slow"))
+        self.assertLess(events.index("start:slow"), events.index("end:fast"))
+        self.assertEqual(events[-2:], ["start:join", "end:join"])
+
+    def test_failure_cancels_running_stages_and_cleans_up(self):
+        cleaned = []
+
+        async def upload(ctx):
+            return "s3://audio"
+
+        async def slow(ctx):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cleaned.append("slow-cancelled")
+                raise
+
+        async def boom(ctx):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        graph = StageGraph([
+            Stage("upload", upload, cleanup=cleaned.append),
+            Stage("slow", slow),
+            Stage("boom", boom, requires=("upload",)),
+        ])
+        with self.assertRaises(RuntimeError):
+            asyncio.run(graph.run(None, timings=StageTimingHistogram(defaults={})))
+        self.assertEqual(sorted(cleaned), ["s3://audio", "slow-cancelled"])
+
+    def test_progress_is_monotonic_and_carries_critical_path_eta(self):
+        progress = []
+
+        async def noop(ctx):
+            return None
+
+        timings = StageTimingHistogram(defaults={"a": 100, "b": 1000, "c": 200, "d": 50})
+        graph = StageGraph([
+            Stage("a", noop, on_start=ProgressStep(10, 0, "a", "a")),
+            Stage("b", noop, requires=("a",), on_done=ProgressStep(60, 1, "b", "b")),
+            Stage("c", noop, requires=("a",), on_done=ProgressStep(40, 1, "c", "c")),
+            Stage("d", noop, requires=("b", "c"), on_start=ProgressStep(90, 2, "d", "d")),
+        ])
+        asyncio.run(graph.run(None, on_progress=progress.append, timings=timings))
+
+        first = progress[0]
+        self.assertEqual(first["stage"], "a")
+        # a (running) + slowest branch b + d
+        self.assertLessEqual(first["eta_ms"], 100 + 1000 + 50)
+        self.assertGreater(first["eta_ms"], 1000)
+        values = [p["progress"] for p in progress]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(values[-1], 90)
+        for name in "abcd":
+            self.assertEqual(timings.snapshot()[name]["count"], 1)
+
+
+class FakeOpenAIService:
+    def __init__(self, polish_error=None):
+        self.polish_error = polish_error
+        self.calls = []
+
+    async def transcribe_audio(self, audio, audio_filename, expected_duration=None):
+        self.calls.append("transcribe")
+        with audio.open() as f:
+            self.transcribed_bytes = len(f.read())
+        await asyncio.sleep(0.01)
+        return "今天天气很好，我去公园散步了"
+
+    def detect_language(self, text):
+        return "Chinese"
+
+    async def _call_gpt4o_mini_for_polish_and_title(self, text, language, images, user_id=None, on_partial=None):
+        self.calls.append(("polish", text, language))
+        if self.polish_error:
+            raise self.polish_error
+        if on_partial:
+            on_partial({"title": "公园"})
+            on_partial({"title": "散步"})
+        return {"title": "公园散步", "polished_content": text}
+
+    async def _call_gpt4o_mini_for_feedback(self, context, language, user_name, images, user_id=None, on_partial=None):
+        self.calls.append(("feedback", context, language, user_name))
+        if on_partial:
+            on_partial({"reply": "真好"})
+        return {"reply": "真好", "emotion": "Joyful", "confidence": 0.9}
+
+    def compose_result(self, text, polish_result, feedback_data):
+        if polish_result is None:
+            return {"title": "今日记录", "polished_content": text, "feedback": "感谢分享。", "emotion_data": {}}
+        return {
+            "title": polish_result["title"],
+            "polished_content": polish_result["polished_content"],
+            "feedback": feedback_data["reply"],
+            "emotion_data": feedback_data,
+        }
+
+
+class FakeS3Service:
+    def __init__(self):
+        self.deleted = []
+
+    def upload_audio_file(self, fileobj, file_name, content_type):
+        self.uploaded_bytes = len(fileobj.read())
+        return f"https://bucket/{file_name}"
+
+    def delete_objects_by_urls(self, urls):
+        self.deleted.extend(urls)
+
+
+class FakeDBService:
+    def __init__(self, error=None):
+        self.error = error
+        self.saved = None
+
+    async def create_diary(self, **kwargs):
+        if self.error:
+            raise self.error
+        self.saved = kwargs
+        return {"diary_id": "d1", **kwargs}
+
+
+def make_input(**overrides):
+    values = dict(
+        user_id="u1",
+        audio=SpooledAudio.from_bytes(b"x" * 4096, filename="a.m4a"),
+        duration=10,
+        user_display_name="Ada",
+    )
+    values.update(overrides)
+    return VoiceDiaryInput(**values)
+
+
+class VoiceDiaryPipelineTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(voice_pipeline, "validate_audio_quality", lambda duration, size: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pure_voice_run_saves_diary(self):
+        openai_service = FakeOpenAIService()
+        db = FakeDBService()
+        pipeline = VoiceDiaryPipeline(openai_service, FakeS3Service(), db)
+
+        s3 = FakeS3Service()
+        pipeline = VoiceDiaryPipeline(openai_service, s3, db)
+        inputs = make_input()
+
+        diary = asyncio.run(pipeline.run(inputs))
+
+        self.assertEqual(diary["diary_id"], "d1")
+        self.assertEqual(s3.uploaded_bytes, 4096)
+        self.assertEqual(openai_service.transcribed_bytes, 4096)
+        self.assertTrue(inputs.audio.closed)
+        self.assertFalse(os.path.exists(inputs.audio.path))
+        self.assertEqual(db.saved["audio_url"], "https://bucket/a.m4a")
+        self.assertEqual(db.saved["title"], "公园散步")
+        self.assertEqual(db.saved["emotion_data"]["emotion"], "Joyful")
+        self.assertEqual(db.saved["image_urls"], [])
+
+    def test_manual_text_and_images_are_merged(self):
+        openai_service = FakeOpenAIService()
+        db = FakeDBService()
+        pipeline = VoiceDiaryPipeline(openai_service, FakeS3Service(), db)
+
+        async def wait_for_images(report):
+            await report(93, 5, "等待图片", "...")
+            return ["https://bucket/img.jpg"]
+
+        asyncio.run(pipeline.run(make_input(
+            content="早上", language="English", wait_for_images=wait_for_images
+        )))
+
+        polish = next(c for c in openai_service.calls if c[0] == "polish")
+        feedback = next(c for c in openai_service.calls if c[0] == "feedback")
+        self.assertEqual(polish[1:], ("早上\n今天天气很好，我去公园散步了", "English"))
+        self.assertEqual(feedback[1], "早上\n\n今天天气很好，我去公园散步了")
+        self.assertEqual(db.saved["image_urls"], ["https://bucket/img.jpg"])
+
+    def test_partial_fields_are_tagged_with_their_stage(self):
+        partials = []
+        pipeline = VoiceDiaryPipeline(FakeOpenAIService(), FakeS3Service(), FakeDBService())
+
+        asyncio.run(pipeline.run(make_input(on_partial=lambda stage, fields: partials.append((stage, fields)))))
+
+        self.assertEqual(
+            [p for p in partials if p[0] == "polish"],
+            [("polish", {"title": "公园"}), ("polish", {"title": "散步"})]
+        )
+        self.assertIn(("feedback", {"reply": "真好"}), partials)
+
+    def test_polish_failure_falls_back(self):
+        db = FakeDBService()
+        pipeline = VoiceDiaryPipeline(FakeOpenAIService(polish_error=RuntimeError("rate limited")), FakeS3Service(), db)
+        asyncio.run(pipeline.run(make_input()))
+        self.assertEqual(db.saved["title"], "今日记录")
+
+    def test_polish_failure_fails_when_degrading_is_disabled(self):
+        s3 = FakeS3Service()
+        db = FakeDBService()
+        pipeline = VoiceDiaryPipeline(FakeOpenAIService(polish_error=RuntimeError("rate limited")), s3, db)
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await pipeline.run(make_input(degrade_on_ai_error=False))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertIsNone(db.saved)
+        self.assertEqual(s3.deleted, ["https://bucket/a.m4a"])
+
+    def test_emotion_data_is_saved_as_returned_by_default(self):
+        db = FakeDBService()
+        asyncio.run(VoiceDiaryPipeline(FakeOpenAIService(), FakeS3Service(), db).run(make_input()))
+        self.assertEqual(db.saved["emotion_data"], {"reply": "真好", "emotion": "Joyful", "confidence": 0.9})
+
+    def test_emotion_data_is_wrapped_for_async_tasks(self):
+        db = FakeDBService()
+        asyncio.run(VoiceDiaryPipeline(FakeOpenAIService(), FakeS3Service(), db).run(make_input(wrap_emotion_data=True)))
+        self.assertEqual(db.saved["emotion_data"], {
+            "emotion": "Joyful",
+            "confidence": 0.9,
+            "rationale": "",
+            "source": "text_only",
+            "meta": {"text": {"reply": "真好", "emotion": "Joyful", "confidence": 0.9}},
+        })
+
+    def test_failure_before_save_deletes_uploaded_audio(self):
+        s3 = FakeS3Service()
+        openai_service = FakeOpenAIService()
+        pipeline = VoiceDiaryPipeline(openai_service, s3, FakeDBService())
+
+        async def broken_feedback(*args, **kwargs):
+            raise RuntimeError("boom")
+
+        openai_service._call_gpt4o_mini_for_feedback = broken_feedback
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await pipeline.run(make_input(degrade_on_ai_error=False))
+            # deletion runs in the default executor
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(s3.deleted, ["https://bucket/a.m4a"])
+
+    def test_save_failure_keeps_uploaded_audio(self):
+        s3 = FakeS3Service()
+        pipeline = VoiceDiaryPipeline(FakeOpenAIService(), s3, FakeDBService(error=RuntimeError("ddb down")))
+
+        inputs = make_input()
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await pipeline.run(inputs)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        # 写入结果不确定（可能已提交），保存开始后不再删除音频
+        self.assertEqual(s3.deleted, [])
+        self.assertTrue(inputs.audio.closed)
+
+    def test_cancel_during_save_waits_for_the_write_and_keeps_audio(self):
+        s3 = FakeS3Service()
+        db = FakeDBService()
+        save_started = None
+
+        async def slow_create_diary(**kwargs):
+            save_started.set()
+            await asyncio.sleep(0.05)
+            db.saved = kwargs
+            return {"diary_id": "d1", **kwargs}
+
+        db.create_diary = slow_create_diary
+        pipeline = VoiceDiaryPipeline(FakeOpenAIService(), s3, db)
+
+        async def run():
+            nonlocal save_started
+            save_started = asyncio.Event()
+            task = asyncio.create_task(pipeline.run(make_input()))
+            await save_started.wait()
+            task.cancel()
+            await asyncio.sleep(0)
+            task.cancel()  # 再次取消也要等待保存完成
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertIsNotNone(db.saved)
+        self.assertEqual(s3.deleted, [])
+
+
+if __name__ == "__main__":
+    unittest.main()